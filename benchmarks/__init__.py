@@ -0,0 +1,3 @@
+# Benchmark scripts, run from the repository root as `python -m benchmarks.<script>`.
+# bench_support (in-memory tables, synthetic transactions) and stub_upstream (Helius/Solscan
+# stand-in) are also used by the tests.
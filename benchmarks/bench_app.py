@@ -0,0 +1,187 @@
+# End-to-end throughput and latency of the FastAPI app against the local upstream stub
+# Usage: python -m benchmarks.bench_app [--requests 200] [--concurrency 10] [--latency-ms 40]
+#        [--error-rate 0] [--fixtures DIR] [--scenario NAME ...] [--json results.json]
+# Runs without network access: Helius/Solscan are served by stub_upstream.py and the accounts,
+# tokens and prices_daily tables by bench_support.MemoryTables. Set BENCH_DATABASE_URL to use a
+# throwaway Postgres (with those tables created) instead. "failed" counts error statuses and
+# responses whose body is wrong (no edges, dangling edge endpoints, repeated or misordered pages).
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.bench_support import MemoryPool, percentile
+from benchmarks.stub_upstream import UpstreamStub
+
+ACCOUNTS = 20
+BATCH_SIZE = 50
+WALK_PAGES = 5
+
+def valid_graph(resp, min_edges: int = 1) -> bool:
+    # A 200 with at least min_edges edges, every edge endpoint present as a node
+    if resp.status_code != 200:
+        return False
+    body = resp.json()
+    pubkeys = {node["pubkey"] for node in body["nodes"]}
+    edges = body["edges"]
+    return len(edges) >= min_edges and all(edge["source"] in pubkeys and edge["target"] in pubkeys for edge in edges)
+
+async def tx_cold(client, i):
+    resp = await client.post(f"/transaction_flows/bench-{i}", json={})
+    return valid_graph(resp)
+
+async def tx_warm(client, i):
+    # Same signatures as tx_cold: served from the local tx store and warm caches
+    resp = await client.post(f"/transaction_flows/bench-{i}", json={})
+    return valid_graph(resp)
+
+async def tx_batch(client, i):
+    signatures = [f"batch-{i * BATCH_SIZE + j}" for j in range(BATCH_SIZE)]
+    resp = await client.post("/transactions/flows", json={"signatures": signatures})
+    return valid_graph(resp) and not resp.json()["errors"]
+
+async def account_first_page(client, i):
+    resp = await client.post(f"/account_flows/acct-{i % ACCOUNTS}?direction=in&limit=20", json={})
+    return valid_graph(resp)
+
+async def account_cursor_walk(client, i):
+    # Pages must continue where the previous one stopped: no repeated transfers, newest first
+    cursor = None
+    tx_ids = []
+    block_times = []
+    for _ in range(WALK_PAGES):
+        url = f"/account_flows/walk-{i % ACCOUNTS}?direction=out&sort=desc&limit=20"
+        resp = await client.post(url + (f"&cursor={cursor}" if cursor else ""), json={})
+        if not valid_graph(resp):
+            return False
+        body = resp.json()
+        tx_ids += [edge["txId"] for edge in body["edges"]]
+        block_times += [edge["blockTime"] for edge in body["edges"]]
+        cursor = body.get("nextCursor")
+        if not cursor:
+            break
+    return len(set(tx_ids)) == len(tx_ids) and block_times == sorted(block_times, reverse=True)
+
+# (name, request function returning whether the response was correct, requests relative to --requests)
+SCENARIOS = [
+    ("tx_cold", tx_cold, 1.0),
+    ("tx_warm", tx_warm, 1.0),
+    ("tx_batch", tx_batch, 0.1),
+    ("account_first_page", account_first_page, 1.0),
+    ("account_cursor_walk", account_cursor_walk, 0.25),
+]
+
+async def run_scenario(name, request, client, stub, total, concurrency):
+    stub.calls.clear()
+    stub.errors.clear()
+    latencies = []
+    failed = 0
+    workers = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal failed
+        async with workers:
+            started = time.perf_counter()
+            ok = await request(client, i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            failed += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "requests": total,
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "failed": failed,
+        "upstream_calls": dict(stub.calls),
+        "upstream_errors": dict(stub.errors),
+    }
+
+def print_results(results):
+    print(f"{'scenario':<22} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}  upstream calls")
+    for result in results:
+        calls = ", ".join(f"{endpoint}={count}" for endpoint, count in sorted(result["upstream_calls"].items()))
+        print(
+            f"{result['scenario']:<22} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} "
+            f"{result['p99_ms']:>8.1f} {result['failed']:>7}  {calls or '-'}"
+        )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the app against local upstream stand-ins")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="stub latency per upstream request")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fixtures", default=None)
+    parser.add_argument("--scenario", action="append", choices=[name for name, _, _ in SCENARIOS])
+    parser.add_argument("--json", default=None, help="write results to this file")
+    return parser.parse_args()
+
+def configure_app(base_url: str):
+    """Point the app at the stub at base_url and at the in-memory tables.
+
+    The app modules read their configuration at import time, so this has to
+    run before any of them is imported.
+    """
+    os.environ["HELIUS_RPC_URL"] = f"{base_url}/rpc"
+    os.environ["SOLSCAN_API_URL"] = base_url
+    os.environ["TX_STORE_DIR"] = tempfile.mkdtemp(prefix="bench_tx_store_")
+    os.environ.setdefault("TRANSFER_STORE_ENABLED", "false")
+    os.environ.setdefault("PRICE_BACKFILL_ENABLED", "false")
+    os.environ.setdefault("METADATA_REFRESH_ENABLED", "false")
+    os.environ.setdefault("SOLSCAN_RPS", "1000")
+    os.environ.setdefault("SOLSCAN_BURST", "1000")
+    os.environ.setdefault("HELIUS_RPS", "1000")
+    os.environ.setdefault("HELIUS_BURST", "1000")
+
+    import asyncpg
+    if os.getenv("BENCH_DATABASE_URL"):
+        os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+    else:
+        async def create_pool(*args, **kwargs):
+            return MemoryPool()
+        asyncpg.create_pool = create_pool
+
+def load_app(base_url: str):
+    configure_app(base_url)
+    import main as app_main
+    return app_main.app
+
+async def main():
+    args = parse_args()
+    stub = UpstreamStub(
+        fixtures_dir=args.fixtures,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+    )
+    base_url = await stub.start()
+
+    import httpx
+    app = load_app(base_url)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    selected = [scenario for scenario in SCENARIOS if not args.scenario or scenario[0] in args.scenario]
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for name, request, share in selected:
+                total = max(1, int(args.requests * share))
+                results.append(await run_scenario(name, request, client, stub, total, args.concurrency))
+    await stub.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
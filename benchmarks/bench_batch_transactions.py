@@ -0,0 +1,76 @@
+# Transactions/sec: N single-signature expansions vs one /transactions/flows style batch
+# Usage: python -m benchmarks.bench_batch_transactions [signatures] [rpc latency ms]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from aiohttp import web
+
+os.environ["TX_STORE_DIR"] = tempfile.mkdtemp(prefix="bench_tx_store_")
+from benchmarks.bench_support import InMemoryDB, make_transaction
+from http_utils import create_http_session
+import solana_utils
+from graph_utils import build_batch_tx_flows_network, build_tx_flows_network
+
+BROWSER_CONCURRENCY = 6
+
+async def start_rpc_stub(latency: float):
+    async def handle(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        payload = await request.json()
+
+        def answer(call):
+            tx_signature = call["params"][0]
+            tx_data = make_transaction(tx_signature, seed=int(tx_signature.rsplit("-", 1)[1]))
+            return {**tx_data, "id": call["id"]}
+
+        if isinstance(payload, list):
+            return web.json_response([answer(call) for call in payload])
+        return web.json_response(answer(payload))
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+async def run_single(signatures, rpc_url, session, db):
+    semaphore = asyncio.Semaphore(BROWSER_CONCURRENCY)
+
+    async def expand(tx_signature):
+        async with semaphore:
+            tx_data = await solana_utils.fetch_transaction(tx_signature, session=session)
+            await build_tx_flows_network(tx_data, rpc_url, db=db, session=session)
+
+    await asyncio.gather(*(expand(tx_signature) for tx_signature in signatures))
+
+async def run_batch(signatures, rpc_url, session, db):
+    transactions, errors = await solana_utils.fetch_transactions(signatures, session=session)
+    network_data = await build_batch_tx_flows_network(transactions, rpc_url, db=db, session=session)
+    assert not errors and not network_data["errors"], (errors, network_data["errors"])
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 30) / 1000
+    runner, rpc_url = await start_rpc_stub(latency)
+    solana_utils.rpc_url = rpc_url
+    session = create_http_session()
+    db = InMemoryDB()
+    try:
+        for label, scenario in (("single", run_single), ("batch", run_batch)):
+            # Fresh signatures per scenario so the local tx store never answers
+            signatures = [f"{label}sig-{i}" for i in range(count)]
+            start = time.perf_counter()
+            await scenario(signatures, rpc_url, session, db)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<7} n={count} elapsed={elapsed * 1000:8.1f}ms throughput={count / elapsed:8.1f} tx/s")
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
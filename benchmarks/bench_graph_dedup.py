@@ -0,0 +1,51 @@
+# Scaling of build_account_flows_network with the size of the client's existing graph
+# Usage: python -m benchmarks.bench_graph_dedup
+import asyncio
+import time
+
+from benchmarks.bench_support import InMemoryDB, USDC
+from graph_utils import build_account_flows_network
+
+def make_flows(count):
+    return [{
+        "from_address": f"wallet{i % 40}",
+        "to_address": f"wallet{(i * 7) % 40 + 40}",
+        "amount": 1_000_000 + i,
+        "token_decimals": 6,
+        "token_address": USDC,
+        "block_time": 1_700_000_000 + i * 60,
+        "trans_id": f"newtx{i}",
+        "activity_type": "ACTIVITY_SPL_TRANSFER",
+    } for i in range(count)]
+
+async def main():
+    flows = make_flows(100)
+    db = InMemoryDB()
+    print(f"{'existing edges':>15} {'builder ms':>11} {'list scan ms':>13}")
+    for existing in (100, 1_000, 10_000, 50_000):
+        existing_edges = [f"oldtx{i}-a-b-{USDC}-1.0" for i in range(existing)]
+        existing_nodes = [f"oldwallet{i}" for i in range(existing // 2)]
+
+        runs = 5
+        start = time.perf_counter()
+        for _ in range(runs):
+            await build_account_flows_network(
+                flows,
+                rpc_url="http://127.0.0.1",
+                db=db,
+                limit=len(flows),
+                existing_node_pubkeys=existing_nodes,
+                existing_edge_ids=existing_edges
+            )
+        builder_ms = (time.perf_counter() - start) / runs * 1000
+
+        # Reference: the same 100 membership checks against the raw list
+        start = time.perf_counter()
+        for flow in flows:
+            f"{flow['trans_id']}-x" in existing_edges
+        list_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{existing:>15} {builder_ms:>11.2f} {list_ms:>13.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
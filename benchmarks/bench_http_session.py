@@ -0,0 +1,72 @@
+# Compare a fresh aiohttp.ClientSession per call against the shared app session
+# Usage: python -m benchmarks.bench_http_session [requests] [concurrency]
+import asyncio
+import statistics
+import sys
+import time
+import aiohttp
+from aiohttp import web
+
+from http_utils import create_http_session
+
+async def handle_metadata(request: web.Request) -> web.Response:
+    return web.json_response({
+        "success": True,
+        "data": {"account_label": "stub", "account_tags": [], "account_type": "", "account_icon": ""}
+    })
+
+async def start_stub_server():
+    app = web.Application()
+    app.router.add_get("/v2.0/account/metadata", handle_metadata)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/v2.0/account/metadata?address=stub"
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run(label, url, total, concurrency, shared_session=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one_call():
+        async with semaphore:
+            start = time.perf_counter()
+            if shared_session is None:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(url) as resp:
+                        await resp.json()
+            else:
+                async with shared_session.get(url) as resp:
+                    await resp.json()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_call() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<16} n={total} rps={total / elapsed:8.1f} "
+        f"p50={statistics.median(latencies):7.2f}ms p99={percentile(latencies, 99):7.2f}ms"
+    )
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    runner, url = await start_stub_server()
+    try:
+        await run("fresh session", url, total, concurrency)
+        session = create_http_session()
+        try:
+            await run("shared session", url, total, concurrency, shared_session=session)
+        finally:
+            await session.close()
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+# Load test: cheap DB lookups while slow upstream-bound expansions hold the pool
+# Usage: python -m benchmarks.bench_pool [--pool-size 5] [--expansions 100] [--concurrency 20]
+#        [--lookups 200] [--latency-ms 300] [--query-ms 1]
+# Runs the same load twice against the app (stubbed upstreams, in-memory tables behind a bounded pool):
+#   pinned     one connection checked out for the whole request (the old get_db dependency)
+#   per-query  the pool is passed down and connections are taken per statement
+# and reports /account/{address} latency measured while the expansions are in flight.
+import argparse
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.bench_support import MemoryPool, MemoryTables, percentile
+from benchmarks.stub_upstream import UpstreamStub
+
+class PinnedConnection:
+    # Pool-shaped view of one already checked-out connection
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    @asynccontextmanager
+    async def acquire(self, timeout: float = None):
+        yield self.conn
+
+async def run_mode(mode, app_main, client, args):
+    tables = app_main.db_pool._pool.db
+    for i in range(args.lookups):
+        tables.accounts[f"{mode}-known-{i}"] = {"label": f"Known {i}", "tags": "", "type": "account", "img_url": ""}
+
+    if mode == "pinned":
+        async def pinned_db():
+            async with app_main.db_pool.acquire() as conn:
+                yield PinnedConnection(conn)
+        app_main.app.dependency_overrides[app_main.get_db_pool] = pinned_db
+    else:
+        app_main.app.dependency_overrides.clear()
+
+    expansions_done = 0
+    lookup_latencies = []
+    failures = 0
+    workers = asyncio.Semaphore(args.concurrency)
+
+    async def expansion(i):
+        nonlocal expansions_done, failures
+        async with workers:
+            resp = await client.post(f"/transaction_flows/{mode}-sig-{i}", json={})
+            failures += resp.status_code >= 400
+            expansions_done += 1
+
+    async def lookups():
+        nonlocal failures
+        # Start once the expansions have filled the pool
+        await asyncio.sleep(args.latency_ms / 1000 / 2)
+        for i in range(args.lookups):
+            started = time.perf_counter()
+            resp = await client.get(f"/account/{mode}-known-{i}")
+            lookup_latencies.append((time.perf_counter() - started) * 1000)
+            failures += resp.status_code >= 400
+            if expansions_done >= args.expansions:
+                break
+
+    started = time.perf_counter()
+    await asyncio.gather(lookups(), *(expansion(i) for i in range(args.expansions)))
+    elapsed = time.perf_counter() - started
+    stats = app_main.db_pool.stats()
+    return {
+        "mode": mode,
+        "expansions_rps": args.expansions / elapsed,
+        "lookups": len(lookup_latencies),
+        "lookup_p50_ms": percentile(lookup_latencies, 50),
+        "lookup_p99_ms": percentile(lookup_latencies, 99),
+        "peak_in_use": stats["peak_in_use"],
+        "avg_wait_ms": stats["avg_wait_ms"],
+        "failed": failures,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pool behaviour under slow upstreams")
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--expansions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="expansions in flight at once")
+    parser.add_argument("--lookups", type=int, default=200, help="max /account lookups per mode")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="stub latency per upstream request")
+    parser.add_argument("--query-ms", type=float, default=1.0, help="latency per in-memory statement")
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+    stub = UpstreamStub(latency=args.latency_ms / 1000)
+    base_url = await stub.start()
+    os.environ["HELIUS_RPC_URL"] = f"{base_url}/rpc"
+    os.environ["SOLSCAN_API_URL"] = base_url
+    os.environ["TX_STORE_DIR"] = tempfile.mkdtemp(prefix="bench_tx_store_")
+    os.environ["DB_POOL_MAX_SIZE"] = str(args.pool_size)
+    for name, value in (
+        ("TRANSFER_STORE_ENABLED", "false"), ("PRICE_BACKFILL_ENABLED", "false"),
+        ("METADATA_REFRESH_ENABLED", "false"), ("SOLSCAN_RPS", "1000"), ("SOLSCAN_BURST", "1000"),
+        ("HELIUS_RPS", "1000"), ("HELIUS_BURST", "1000"),
+    ):
+        os.environ.setdefault(name, value)
+
+    import asyncpg
+    import httpx
+
+    async def create_pool(*pool_args, max_size=10, **kwargs):
+        return MemoryPool(MemoryTables(latency=args.query_ms / 1000), max_size=max_size)
+    asyncpg.create_pool = create_pool
+    import main as app_main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    transport = httpx.ASGITransport(app=app_main.app)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for mode in ("pinned", "per-query"):
+            # Fresh pool (and counters) per mode
+            async with app_main.app.router.lifespan_context(app_main.app):
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                    results.append(await run_mode(mode, app_main, client, args))
+    await stub.stop()
+
+    print(f"pool size {args.pool_size}, {args.concurrency} expansions in flight, upstream latency {args.latency_ms:.0f} ms")
+    print(f"{'mode':<10} {'expand/s':>9} {'lookups':>8} {'p50 ms':>8} {'p99 ms':>8} {'peak conns':>11} {'avg wait ms':>12} {'failed':>7}")
+    for result in results:
+        print(
+            f"{result['mode']:<10} {result['expansions_rps']:>9.1f} {result['lookups']:>8} "
+            f"{result['lookup_p50_ms']:>8.1f} {result['lookup_p99_ms']:>8.1f} "
+            f"{result['peak_in_use']:>11} {result['avg_wait_ms']:>12.1f} {result['failed']:>7}"
+        )
+
+if __name__ == "__main__":
+    asyncio.run(main())
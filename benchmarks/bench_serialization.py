@@ -0,0 +1,120 @@
+# Payload size and encode time of graph responses: today's format vs orjson vs the compact format
+# Usage: python -m benchmarks.bench_serialization [--edges 10000] [--accounts 2000] [--mints 20] [--repeat 5]
+# Encodes one synthetic account-flows graph with:
+#   baseline  jsonable_encoder + json.dumps (what FastAPI's default JSONResponse did)
+#   orjson    FastJSONResponse rendering of the same {"nodes", "edges"} shape
+#   compact   compact_graph() + orjson (index tables, columnar edges, mint metadata once)
+# and reports raw, gzip and (if installed) brotli sizes with the best-of-N encode times.
+import argparse
+import gzip
+import json
+import random
+import time
+
+import benchmarks.bench_support  # noqa: F401  (sets up env)
+from fastapi.encoders import jsonable_encoder
+
+from response_utils import brotli, compact_graph, dumps, COMPRESSION_BROTLI_QUALITY, COMPRESSION_GZIP_LEVEL
+
+ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+SOL_IMAGE = "https://raw.githubusercontent.com/solana-labs/token-list/main/assets/mainnet/So11111111111111111111111111111111111111112/logo.png"
+
+def pubkey(rng: random.Random) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(44))
+
+def make_graph(edges: int, accounts: int, mints: int, seed: int = 0) -> dict:
+    # Shaped like build_account_flows_network output
+    rng = random.Random(seed)
+    pubkeys = [pubkey(rng) for _ in range(accounts)]
+    tokens = [("So11111111111111111111111111111111111111112", "SOL", SOL_IMAGE)] + [
+        (pubkey(rng), f"TKN{i}", f"https://arweave.net/{pubkey(rng)}") for i in range(mints - 1)
+    ]
+    nodes = [{
+        "pubkey": key,
+        "label": f"Account {i}" if i % 5 == 0 else "",
+        "tags": "exchange" if i % 17 == 0 else "",
+        "type": "wallet",
+        "imgUrl": "",
+    } for i, key in enumerate(pubkeys)]
+    edge_list = []
+    for i in range(edges):
+        mint, ticker, image = tokens[0] if i % 3 == 0 else rng.choice(tokens)
+        amount = round(rng.uniform(0.001, 10_000), 6)
+        edge_list.append({
+            "source": rng.choice(pubkeys),
+            "target": rng.choice(pubkeys),
+            "amount": amount,
+            "mint": mint,
+            "ticker": ticker,
+            "tokenImage": image,
+            "value": round(amount * 1.5, 2) if i % 4 else None,
+            "type": "transfer",
+            "txId": "".join(rng.choice(ALPHABET) for _ in range(88)),
+            "blockTime": 1_700_000_000 + i * 7,
+        })
+    return {"nodes": nodes, "edges": edge_list, "hasMore": True, "nextCursor": "bench"}
+
+def best_of(repeat: int, fn):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+def measure(name: str, encode, repeat: int) -> dict:
+    encode_ms, body = best_of(repeat, encode)
+    gzip_ms, gzipped = best_of(repeat, lambda: gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL))
+    result = {"format": name, "encode_ms": encode_ms, "raw": len(body), "gzip": len(gzipped), "gzip_ms": gzip_ms}
+    if brotli is not None:
+        br_ms, compressed = best_of(repeat, lambda: brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY))
+        result.update({"br": len(compressed), "br_ms": br_ms})
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Graph response serialization")
+    parser.add_argument("--edges", type=int, default=10_000)
+    parser.add_argument("--accounts", type=int, default=2_000)
+    parser.add_argument("--mints", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    graph = make_graph(args.edges, args.accounts, args.mints)
+
+    def baseline() -> bytes:
+        # starlette's JSONResponse.render after FastAPI's encoder pass
+        return json.dumps(
+            jsonable_encoder(graph), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+    # The compact payload must describe the same graph
+    compact = compact_graph(graph)
+    assert len(compact["edges"]["source"]) == args.edges
+    assert all(compact["pubkeys"][i] == edge["source"] for i, edge in zip(compact["edges"]["source"], graph["edges"]))
+
+    results = [
+        measure("baseline", baseline, args.repeat),
+        measure("orjson", lambda: dumps(graph), args.repeat),
+        measure("compact", lambda: dumps(compact_graph(graph)), args.repeat),
+    ]
+
+    print(f"{args.edges} edges, {args.accounts} accounts, {args.mints} mints (best of {args.repeat})")
+    header = f"{'format':<9} {'encode ms':>10} {'raw KB':>9} {'gzip KB':>9} {'gzip ms':>8}"
+    if brotli is not None:
+        header += f" {'br KB':>9} {'br ms':>8}"
+    else:
+        header += "  (brotli not installed)"
+    print(header)
+    for result in results:
+        line = (
+            f"{result['format']:<9} {result['encode_ms']:>10.1f} {result['raw'] / 1024:>9.1f} "
+            f"{result['gzip'] / 1024:>9.1f} {result['gzip_ms']:>8.1f}"
+        )
+        if brotli is not None:
+            line += f" {result['br'] / 1024:>9.1f} {result['br_ms']:>8.1f}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# Shared fixtures for the benchmark scripts: an in-memory DB and synthetic transactions
+import asyncio
+from contextlib import asynccontextmanager
+import os
+
+os.environ.setdefault("HELIUS_API_KEY", "bench")
+os.environ.setdefault("SOLSCAN_API_KEY", "bench")
+
+USDC = "EPjFWJd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+SYSTEM_PROGRAM_ID = "11111111111111111111111111111111"
+
+class InMemoryDB:
+    # Answers the accounts/tokens/prices_daily queries without Postgres
+    async def fetch(self, query, *args):
+        if "prices_daily" in query:
+            return [{"mint": mint, "day": day, "price": 1.0} for mint, day in zip(args[0], args[1])]
+        if "FROM tokens" in query:
+            return [{"mint": mint, "ticker": "USDC", "decimals": 6, "img_url": ""} for mint in args[0]]
+        if "FROM accounts" in query:
+            return [{"pubkey": pubkey, "label": "", "tags": "", "type": "", "img_url": ""} for pubkey in args[0]]
+        return []
+
+    async def fetchrow(self, query, *args):
+        return None
+
+    async def execute(self, *args):
+        pass
+
+    async def executemany(self, *args):
+        pass
+
+class InMemoryPool:
+    def __init__(self):
+        self.db = InMemoryDB()
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return pool.db
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+class MemoryTables:
+    """Stateful stand-in for the accounts, tokens and prices_daily tables.
+
+    Unlike InMemoryDB it starts empty and keeps what the app writes, so cold
+    requests go upstream and repeated ones are answered "from Postgres".
+    Other tables (transfers, transfer_sync) read as empty. `latency` adds a
+    fixed delay to every statement, like a round trip to a real server.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.accounts = {}
+        self.tokens = {}
+        self.prices = {}
+        self.queries = 0
+        self.latency = latency
+
+    async def _query(self):
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def fetch(self, query, *args):
+        await self._query()
+        if "FROM prices_daily" in query and "unnest" in query:
+            return [{"mint": mint, "day": day, "price": self.prices[(mint, day)]}
+                    for mint, day in zip(args[0], args[1]) if self.prices.get((mint, day)) is not None]
+        if "FROM prices_daily" in query:
+            return [{"mint": mint, "day": day, "price": price} for (mint, day), price in self.prices.items()
+                    if mint in args[0] and args[1] <= day <= args[2] and price is not None]
+        if "FROM tokens" in query:
+            return [{"mint": mint, **self.tokens[mint]} for mint in args[0] if mint in self.tokens]
+        if "FROM accounts" in query and "ANY" in query:
+            return [{"pubkey": pubkey, **self.accounts[pubkey]} for pubkey in args[0] if pubkey in self.accounts]
+        return []
+
+    async def fetchrow(self, query, *args):
+        await self._query()
+        if "FROM accounts" in query:
+            return self.accounts.get(args[0])
+        return None
+
+    async def fetchval(self, *args):
+        await self._query()
+        return None
+
+    async def execute(self, *args):
+        await self._query()
+
+    async def executemany(self, query, rows):
+        await self._query()
+        for row in rows:
+            if "INSERT INTO prices_daily" in query:
+                self.prices[(row[0], row[1])] = row[2]
+            elif "INSERT INTO tokens" in query:
+                self.tokens.setdefault(row[0], {"ticker": row[1], "decimals": row[2], "img_url": row[3]})
+            elif "INSERT INTO accounts" in query:
+                self.accounts[row[0]] = {"label": row[1], "tags": row[2], "type": row[3], "img_url": row[4]}
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        # Write-behind staging tables (write_behind_<table>); the merge statement is a no-op here
+        await self._query()
+        if table_name.endswith("prices_daily"):
+            for mint, day, price in records:
+                if self.prices.get((mint, day)) is None:
+                    self.prices[(mint, day)] = price
+        elif table_name.endswith("tokens"):
+            for mint, ticker, decimals, img_url in records:
+                self.tokens.setdefault(mint, {"ticker": ticker, "decimals": decimals, "img_url": img_url})
+        elif table_name.endswith("accounts"):
+            for pubkey, label, tags, type_, img_url in records:
+                self.accounts[pubkey] = {"label": label, "tags": tags, "type": type_, "img_url": img_url}
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+class MemoryPool:
+    # asyncpg.Pool surface wrapped by db_utils.DatabasePool; max_size bounds checkouts like a real pool
+    def __init__(self, tables: MemoryTables = None, max_size: int = 10):
+        self.db = tables or MemoryTables()
+        self.max_size = max_size
+        self._slots = asyncio.Semaphore(max_size)
+        self._in_use = 0
+
+    async def acquire(self, timeout: float = None):
+        await asyncio.wait_for(self._slots.acquire(), timeout)
+        self._in_use += 1
+        return self.db
+
+    async def release(self, conn):
+        self._in_use -= 1
+        self._slots.release()
+
+    async def close(self):
+        pass
+
+    def get_size(self) -> int:
+        return self.max_size
+
+    def get_idle_size(self) -> int:
+        return self.max_size - self._in_use
+
+    def get_max_size(self) -> int:
+        return self.max_size
+
+def make_transaction(tx_signature: str, seed: int = 0) -> dict:
+    # A SOL transfer plus an inner USDC transfer between two wallets
+    wallet_a, wallet_b = f"walletA{seed % 50}", f"walletB{seed % 50}"
+    ata_a, ata_b = f"ataA{seed % 50}", f"ataB{seed % 50}"
+    return {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": {
+            "blockTime": 1_700_000_000 + seed * 3_600,
+            "meta": {
+                "fee": 10_000,
+                "preTokenBalances": [
+                    {"accountIndex": 1, "mint": USDC, "owner": wallet_a},
+                    {"accountIndex": 2, "mint": USDC, "owner": wallet_b},
+                ],
+                "postTokenBalances": [],
+                "innerInstructions": [{"index": 0, "instructions": [
+                    {"programId": "JUP6LkbZbjS1jKKwapdHNy74zcZ3tLUZoi5QNyVTaV4"},
+                    {"programId": TOKEN_PROGRAM_ID, "parsed": {"type": "transfer", "info": {
+                        "source": ata_a, "destination": ata_b, "authority": wallet_a, "amount": str(1_000_000 + seed)
+                    }}},
+                ]}],
+            },
+            "transaction": {
+                "signatures": [tx_signature],
+                "message": {
+                    "accountKeys": [{"pubkey": key} for key in (wallet_a, ata_a, ata_b, wallet_b)],
+                    "instructions": [
+                        {"programId": SYSTEM_PROGRAM_ID, "parsed": {"type": "transfer", "info": {
+                            "source": wallet_a, "destination": wallet_b, "lamports": 1_000_000 + seed
+                        }}},
+                    ],
+                },
+            },
+        },
+    }
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
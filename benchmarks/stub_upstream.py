@@ -0,0 +1,255 @@
+# Local stand-in for Helius JSON-RPC and the Solscan Pro v2 endpoints the app calls
+# Usage: python -m benchmarks.stub_upstream [--port 8899] [--fixtures DIR] [--latency-ms 40] [--jitter-ms 10] [--error-rate 0.01]
+# then start the app with HELIUS_RPC_URL=http://127.0.0.1:8899/rpc SOLSCAN_API_URL=http://127.0.0.1:8899
+#
+# Recorded responses are replayed from the fixtures directory when present:
+#   getTransaction/<signature>.json   full JSON-RPC response
+#   getAsset/<mint>.json              DAS asset object
+#   account_metadata/<address>.json   Solscan "data" object
+#   account_transfer/<address>.json   list of Solscan transfer rows (filtered and paged here)
+#   token_price/<mint>.json           list of {"date": YYYYMMDD, "price": float}
+# Anything without a fixture is synthesized deterministically from its key.
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import zlib
+from aiohttp import web
+
+from benchmarks.bench_support import USDC, make_transaction
+
+SOL_MINT = "So11111111111111111111111111111111111111111"
+TRANSFERS_PER_ACCOUNT = int(os.getenv("STUB_TRANSFERS_PER_ACCOUNT", "250"))
+COUNTERPARTIES = 40
+
+def seed_of(key: str) -> int:
+    # "sig-17" -> 17 so benchmarks can pick seeds; anything else hashes
+    suffix = key.rsplit("-", 1)[-1]
+    return int(suffix) if suffix.isdigit() else zlib.crc32(key.encode())
+
+class UpstreamStub:
+    def __init__(
+        self,
+        fixtures_dir: str = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503
+    ):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls = Counter()
+        self.errors = Counter()
+        self._fixtures = {}
+        self._runner = None
+        self._random = random.Random(0)
+
+    # Fixtures and synthetic data
+
+    def fixture(self, kind: str, key: str):
+        if not self.fixtures_dir:
+            return None
+        if (kind, key) not in self._fixtures:
+            path = os.path.join(self.fixtures_dir, kind, f"{key}.json")
+            data = None
+            if os.path.exists(path):
+                with open(path) as f:
+                    data = json.load(f)
+            self._fixtures[(kind, key)] = data
+        return self._fixtures[(kind, key)]
+
+    def transaction(self, tx_signature: str):
+        return self.fixture("getTransaction", tx_signature) or make_transaction(tx_signature, seed=seed_of(tx_signature))
+
+    def asset(self, mint: str):
+        return self.fixture("getAsset", mint) or {
+            "id": mint,
+            "token_info": {"decimals": 9 if mint == SOL_MINT else 6},
+            "content": {"metadata": {"symbol": mint[:4].upper()}, "links": {"image": ""}},
+        }
+
+    def account_metadata(self, address: str):
+        return self.fixture("account_metadata", address) or {
+            "account_address": address,
+            "account_label": f"Label {address[:8]}",
+            "account_tags": ["stub"],
+            "account_type": "account",
+            "account_icon": "",
+        }
+
+    def account_transfers(self, address: str) -> list:
+        rows = self.fixture("account_transfer", address)
+        if rows is not None:
+            return rows
+        seed = seed_of(address)
+        rows = []
+        for i in range(TRANSFERS_PER_ACCOUNT):
+            counterparty = f"{address}-cp{(seed + i) % COUNTERPARTIES}"
+            flow = "in" if i % 2 else "out"
+            mint = USDC if i % 3 else SOL_MINT
+            rows.append({
+                "block_id": 250_000_000 + i,
+                "trans_id": f"{address}-tx{i // 2}",
+                "block_time": 1_700_000_000 + i * 1_800,
+                "activity_type": "ACTIVITY_SPL_TRANSFER",
+                "from_address": counterparty if flow == "in" else address,
+                "to_address": address if flow == "in" else counterparty,
+                "token_address": mint,
+                "token_decimals": 9 if mint == SOL_MINT else 6,
+                "amount": 1_000_000 * (1 + (seed + i) % 500),
+                "flow": flow,
+            })
+        self._fixtures[("account_transfer", address)] = rows
+        return rows
+
+    def token_prices(self, mint: str, from_time: str, to_time: str) -> list:
+        prices = self.fixture("token_price", mint)
+        if prices is not None:
+            return [price for price in prices if from_time <= str(price["date"]) <= to_time]
+        base = 1.0 if mint == USDC else 20 + seed_of(mint) % 200
+        day = datetime.strptime(from_time, "%Y%m%d")
+        end = datetime.strptime(to_time, "%Y%m%d")
+        prices = []
+        while day <= end:
+            prices.append({"date": int(day.strftime("%Y%m%d")), "price": base})
+            day += timedelta(days=1)
+        return prices
+
+    # HTTP handlers
+
+    async def inject(self, endpoint: str, count: int = 1):
+        # Latency first, then maybe an injected failure; returns the error response or None
+        self.calls[endpoint] += count
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors[endpoint] += count
+            return web.json_response({"error": "injected failure"}, status=self.error_status)
+        return None
+
+    async def handle_rpc(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        calls = payload if isinstance(payload, list) else [payload]
+        method = calls[0].get("method", "") if calls else ""
+        error = await self.inject(method, len(calls))
+        if error:
+            return error
+
+        def answer(call):
+            params = call.get("params")
+            if call.get("method") == "getTransaction":
+                return {**self.transaction(params[0]), "id": call.get("id")}
+            if call.get("method") == "getAsset":
+                return {"jsonrpc": "2.0", "id": call.get("id"), "result": self.asset(params["id"])}
+            if call.get("method") == "getAssetBatch":
+                return {"jsonrpc": "2.0", "id": call.get("id"), "result": [self.asset(mint) for mint in params["ids"]]}
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32601, "message": "Method not found"}}
+
+        if isinstance(payload, list):
+            return web.json_response([answer(call) for call in calls])
+        return web.json_response(answer(payload))
+
+    async def handle_account_metadata(self, request: web.Request) -> web.Response:
+        error = await self.inject("account/metadata")
+        if error:
+            return error
+        return web.json_response({"success": True, "data": self.account_metadata(request.query["address"])})
+
+    async def handle_account_transfer(self, request: web.Request) -> web.Response:
+        error = await self.inject("account/transfer")
+        if error:
+            return error
+        query = request.query
+        rows = self.account_transfers(query["address"])
+        if "flow" in query:
+            rows = [row for row in rows if row["flow"] == query["flow"]]
+        if "from_time" in query:
+            rows = [row for row in rows if row["block_time"] >= int(query["from_time"])]
+        if "to_time" in query:
+            rows = [row for row in rows if row["block_time"] <= int(query["to_time"])]
+        rows = sorted(rows, key=lambda row: row["block_time"], reverse=query.get("sort_order") == "desc")
+        page, page_size = int(query.get("page", 1)), int(query.get("page_size", 10))
+        return web.json_response({"success": True, "data": rows[(page - 1) * page_size:page * page_size]})
+
+    async def handle_token_price(self, request: web.Request) -> web.Response:
+        error = await self.inject("token/price")
+        if error:
+            return error
+        query = request.query
+        return web.json_response({
+            "success": True,
+            "data": self.token_prices(query["address"], query["from_time"], query["to_time"])
+        })
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": dict(self.calls), "errors": dict(self.errors)})
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        self.errors.clear()
+        return web.json_response({"ok": True})
+
+    def application(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/rpc", self.handle_rpc)
+        app.router.add_post("/", self.handle_rpc)
+        app.router.add_get("/account/metadata", self.handle_account_metadata)
+        app.router.add_get("/account/transfer", self.handle_account_transfer)
+        app.router.add_get("/token/price", self.handle_token_price)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_post("/_reset", self.handle_reset)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        # Returns the base URL; SOLSCAN_API_URL is the base, HELIUS_RPC_URL is base + "/rpc"
+        self._runner = web.AppRunner(self.application())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--fixtures", default=None, help="directory of recorded JSON fixtures")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    return parser.parse_args(argv)
+
+async def main():
+    args = parse_args()
+    stub = UpstreamStub(
+        fixtures_dir=args.fixtures,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    base_url = await stub.start(args.host, args.port)
+    print(f"Stub upstream on {base_url}")
+    print(f"  HELIUS_RPC_URL={base_url}/rpc SOLSCAN_API_URL={base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,67 @@
+# Bloom filter used for the compact existing-graph handshake
+import base64
+import binascii
+import math
+
+FNV_OFFSET_BASIS = 0x811C9DC5
+FNV_PRIME = 0x01000193
+MAX_FILTER_BYTES = 4 * 1024 * 1024
+MAX_HASHES = 32
+
+def fnv1a_32(data: bytes, seed: int = FNV_OFFSET_BASIS) -> int:
+    h = seed
+    for byte in data:
+        h = ((h ^ byte) * FNV_PRIME) & 0xFFFFFFFF
+    return h
+
+class BloomFilter:
+    """Bit array probed at (h1 + i * h2) mod m for i in [0, hashes).
+
+    h1 is 32-bit FNV-1a of the UTF-8 key and h2 is FNV-1a seeded with h1,
+    forced odd. Bit n lives in byte n >> 3 under mask 1 << (n & 7). Clients
+    build the same structure and send it base64-encoded with its hash count.
+    False positives make the server treat a new node or edge as already
+    present, so clients should size the filter for a low error rate.
+    """
+
+    def __init__(self, bits: bytearray, hashes: int):
+        if not bits:
+            raise ValueError("Bloom filter must not be empty")
+        if not 1 <= hashes <= MAX_HASHES:
+            raise ValueError(f"Bloom filter hash count must be between 1 and {MAX_HASHES}")
+        self.bits = bits
+        self.hashes = hashes
+        self.size = len(bits) * 8
+
+    @classmethod
+    def with_capacity(cls, capacity: int, error_rate: float = 0.001) -> "BloomFilter":
+        size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, min(MAX_HASHES, round(size / max(capacity, 1) * math.log(2))))
+        return cls(bytearray((size + 7) // 8), hashes)
+
+    @classmethod
+    def from_base64(cls, encoded: str, hashes: int) -> "BloomFilter":
+        if len(encoded) > MAX_FILTER_BYTES * 4 // 3 + 4:
+            raise ValueError("Bloom filter too large")
+        try:
+            bits = bytearray(base64.b64decode(encoded, validate=True))
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 Bloom filter: {e}")
+        return cls(bits, hashes)
+
+    def to_base64(self) -> str:
+        return base64.b64encode(bytes(self.bits)).decode()
+
+    def _positions(self, key: str):
+        data = key.encode()
+        h1 = fnv1a_32(data)
+        h2 = fnv1a_32(data, h1) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
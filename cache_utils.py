@@ -0,0 +1,119 @@
+# In-process LRU/TTL caches in front of the accounts and tokens tables
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable
+
+class TTLCache:
+    """Bounded LRU cache with per-entry expiry.
+
+    Negative entries (e.g. "Solscan had no label") are stored with their own,
+    usually shorter, TTL so they get re-checked sooner than real data.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value, negative = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        if negative:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        # Lookup without touching LRU order or hit counters
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set(self, key: Hashable, value: Any, negative: bool = False, ttl: float = None):
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value, negative)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+_MISSING = object()
+
+# Values mirror table rows: accounts -> {label, tags (comma separated), type, img_url},
+# tokens -> {ticker, decimals, img_url}
+accounts_cache = TTLCache(
+    maxsize=int(os.getenv("ACCOUNTS_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("ACCOUNTS_CACHE_TTL", "3600")),
+    negative_ttl=float(os.getenv("ACCOUNTS_CACHE_NEGATIVE_TTL", "300")),
+)
+tokens_cache = TTLCache(
+    maxsize=int(os.getenv("TOKENS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKENS_CACHE_TTL", "86400")),
+    negative_ttl=float(os.getenv("TOKENS_CACHE_NEGATIVE_TTL", "300")),
+)
+
+# Cached (negatively) for accounts whose Solscan fetch failed, so they are not re-queued by every graph;
+# compared by identity to tell it apart from a real unlabeled row
+UNRESOLVED_ACCOUNT = {"label": "", "tags": "", "type": "", "img_url": ""}
+ACCOUNT_FAILURE_TTL = float(os.getenv("ACCOUNT_FAILURE_TTL", "300"))
+
+def is_unlabeled(row: Dict[str, Any]) -> bool:
+    return not row.get("label") and not row.get("tags") and not row.get("type")
+
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "accounts": accounts_cache.stats(),
+        "tokens": tokens_cache.stats(),
+    }
@@ -0,0 +1,105 @@
+# Shared Postgres pool: connections are checked out per query, never across upstream waits
+import asyncio
+from contextlib import asynccontextmanager
+import os
+import time
+from typing import Any, AsyncIterator, Dict
+import asyncpg
+
+from metrics_utils import record_span, registry
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+
+pool_wait_seconds = registry.histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled Postgres connection"
+)
+
+class DatabasePool:
+    """asyncpg.Pool with checkout accounting.
+
+    fetch/fetchrow/fetchval/execute/executemany each hold a connection only
+    for that one statement, so handlers pass the pool (not a connection)
+    through code that also awaits Helius and Solscan. Use acquire() for
+    transactions or several statements that must share a connection.
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self._pool = pool
+        self.acquired = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def acquire(self, timeout: float = None) -> AsyncIterator[asyncpg.Connection]:
+        started = time.perf_counter()
+        try:
+            conn = await self._pool.acquire(timeout=timeout or DB_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        pool_wait_seconds.observe(waited)
+        record_span("db_pool_wait", waited)
+        self.acquired += 1
+        self.wait_seconds += waited
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        try:
+            yield conn
+        finally:
+            self.in_use -= 1
+            await self._pool.release(conn)
+
+    async def fetch(self, query: str, *args) -> list:
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args)
+
+    async def fetchval(self, query: str, *args):
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args)
+
+    async def execute(self, query: str, *args) -> str:
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args)
+
+    async def executemany(self, query: str, args) -> None:
+        async with self.acquire() as conn:
+            return await conn.executemany(query, args)
+
+    async def close(self):
+        await self._pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self._pool.get_size(),
+            "idle": self._pool.get_idle_size(),
+            "max_size": self._pool.get_max_size(),
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "utilization": self.in_use / self._pool.get_max_size(),
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self.wait_seconds / self.acquired * 1000 if self.acquired else 0.0,
+        }
+
+async def create_db_pool(dsn: str = None, **kwargs) -> DatabasePool:
+    # Extra kwargs (e.g. init=...) go straight to asyncpg.create_pool
+    pool = await asyncpg.create_pool(
+        dsn or os.getenv("DATABASE_URL"),
+        min_size=min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        **kwargs
+    )
+    return DatabasePool(pool)
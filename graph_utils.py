@@ -1,12 +1,27 @@
 # Parse transaction and build Network data
+from array import array
 import asyncio
 from datetime import datetime
-import os
-from typing import Any, Dict
+from decimal import Decimal
+import logging
+from typing import Any, Callable, Dict, Tuple
 import aiohttp
-import asyncpg
 from fastapi import HTTPException
 
+from cache_utils import accounts_cache, tokens_cache, is_unlabeled
+from db_utils import DatabasePool
+from http_utils import helius_limiter
+from metadata_worker import metadata_worker
+from metrics_utils import sampled_debug, timed
+from price_utils import price_matrix, price_states
+from solana_utils import fetch_solscan_price_range
+from write_behind import price_writes, token_writes, write_behind
+
+logger = logging.getLogger(__name__)
+
+# Graph nodes that are not real accounts and have no metadata to fetch
+PSEUDO_NODES = frozenset({"Validator", "Burn", "Mint"})
+
 sol_mint = "So11111111111111111111111111111111111111111"
 wsol_mint = "So11111111111111111111111111111111111111112"
 
@@ -15,99 +30,113 @@ def sol_address(mint: str) -> str:
         return sol_mint
     return mint
 
+class IdUnion:
+    # Membership across several ID containers (plain sets, Bloom filters, session sets)
+    def __init__(self, *containers):
+        self.containers = containers
+
+    def __contains__(self, item) -> bool:
+        return any(item in container for container in self.containers)
+
+def as_id_set(ids):
+    # Client-supplied ID lists are hashed once per request so membership checks are O(1)
+    if isinstance(ids, (list, tuple)):
+        return set(ids)
+    return ids
+
+def key_amount(amount) -> str:
+    # Formats like JavaScript's String(number), so browser clients can build the same keys
+    amount = float(amount)
+    if amount.is_integer() and abs(amount) < 1e21:
+        return str(int(amount))
+    text = repr(amount)
+    if "e" not in text:
+        return text
+    mantissa, exponent = text.split("e")
+    exponent = int(exponent)
+    if -7 < exponent < 21:
+        return format(Decimal(text), "f")
+    return f"{mantissa}e{'+' if exponent > 0 else '-'}{abs(exponent)}"
+
+def edge_key(edge: Dict[str, Any]) -> str:
+    """Edge ID used by existingEdges, edgeFilter and sessions: `{txId}-{source}-{target}-{mint}-{amount}`.
+
+    Built from the edge as returned to clients: wSOL folded into SOL and the
+    amount in whole token units, formatted by key_amount. Only call it on
+    enriched edges (or account flow edges, whose amounts are already whole).
+    """
+    return f"{edge['txId']}-{edge['source']}-{edge['target']}-{sol_address(edge['mint'])}-{key_amount(edge['amount'])}"
+
+def drop_known_edges(edges: list[Dict[str, Any]], existing_edge_ids) -> list[Dict[str, Any]]:
+    # Runs after enrichment so client, Bloom filter and session IDs all match edge_key
+    existing_edge_ids = as_id_set(existing_edge_ids)
+    return [edge for edge in edges if "txId" not in edge or edge_key(edge) not in existing_edge_ids]
+
+@timed("accounts")
 async def add_accounts_metadata(
     nodes: list[Dict[str, Any]],
     existing_node_pubkeys: list = [],
-    db: asyncpg.Connection = None
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None
 ):
+    """Attach labels from the accounts cache/table. Never calls Solscan.
+
+    Accounts not stored yet are queued for the background metadata worker.
+    """
     if not db:
         return nodes
     
+    existing_node_pubkeys = as_id_set(existing_node_pubkeys)
     nodes_dict = {node["pubkey"]: node for node in nodes}
     new_pubkeys = {node["pubkey"] for node in nodes
                    if node["pubkey"] not in existing_node_pubkeys
-                   and node["pubkey"] not in ['Validator', 'Burn']}
+                   and node["pubkey"] not in PSEUDO_NODES}
     
     if new_pubkeys:
         try:
-            db_results = await db.fetch(
-                """
-                SELECT pubkey, label, tags, type, img_url
-                FROM accounts
-                WHERE pubkey = ANY($1)
-                """,
-                list(new_pubkeys)
-            )
-            
-            db_found_pubkeys = set()
-            for result in db_results:
-                pubkey = result['pubkey']
-                db_found_pubkeys.add(pubkey)
+            known_rows = accounts_cache.get_many(new_pubkeys)
+            uncached_pubkeys = new_pubkeys - known_rows.keys()
+
+            if uncached_pubkeys:
+                db_results = await db.fetch(
+                    """
+                    SELECT pubkey, label, tags, type, img_url
+                    FROM accounts
+                    WHERE pubkey = ANY($1)
+                    """,
+                    list(uncached_pubkeys)
+                )
+                for result in db_results:
+                    row = {
+                        "label": result['label'],
+                        "tags": result['tags'],
+                        "type": result['type'],
+                        "img_url": result['img_url']
+                    }
+                    accounts_cache.set(result['pubkey'], row, negative=is_unlabeled(row))
+                    known_rows[result['pubkey']] = row
+
+            for pubkey, row in known_rows.items():
                 nodes_dict[pubkey].update({
-                    "label": result['label'],
-                    "tags": result['tags'].split(',') if result['tags'] else [],
-                    "type": result['type'],
-                    "img_url": result['img_url']
+                    "label": row['label'],
+                    "tags": row['tags'].split(',') if row['tags'] else [],
+                    "type": row['type'],
+                    "img_url": row['img_url']
                 })
 
-            missing_pubkeys = new_pubkeys - db_found_pubkeys
-            print('missing_pubkeys', missing_pubkeys)
-            if missing_pubkeys:
-                async with aiohttp.ClientSession() as session:
-                    tasks = []
-                    headers = {'token': os.getenv('SOLSCAN_API_KEY')}
-                    for pubkey in missing_pubkeys:
-                        url = f'https://pro-api.solscan.io/v2.0/account/metadata?address={pubkey}'
-                        print('account metadata url', url)
-                        tasks.append(asyncio.create_task(session.get(url, headers=headers)))
-                    
-                    responses = await asyncio.gather(*tasks, return_exceptions=True)
-                    
-                    insert_values = []
-                    for pubkey, resp in zip(missing_pubkeys, responses):
-                        try:
-                            if isinstance(resp, Exception):
-                                raise resp
-                                
-                            if resp.status == 200:
-                                data = (await resp.json())['data']
-                                account_data = {
-                                    "label": data.get('account_label', ''),
-                                    "tags": data.get('account_tags', []),
-                                    "type": data.get('account_type', ''),
-                                    "img_url": data.get('account_icon', '')
-                                }
-                                
-                                nodes_dict[pubkey].update(account_data)
-                                
-                                insert_values.append((
-                                    pubkey,
-                                    account_data["label"],
-                                    ','.join(account_data["tags"]),
-                                    account_data["type"],
-                                    account_data["img_url"]
-                                ))
-                        except Exception as e:
-                            print(f"Error fetching metadata for {pubkey}: {e}")
-                            nodes_dict[pubkey].update({
-                                "label": "",
-                                "tags": [],
-                                "type": "",
-                                "img_url": ""
-                            })
-
-                    if insert_values:
-                        await db.executemany(
-                            """
-                            INSERT INTO accounts (pubkey, label, tags, type, img_url)
-                            VALUES ($1, $2, $3, $4, $5)
-                            ON CONFLICT (pubkey) DO NOTHING
-                            """,
-                            insert_values
-                        )
+            # Labels are fetched off the request path; unknown accounts go out blank this time
+            missing_pubkeys = new_pubkeys - known_rows.keys()
+            for pubkey in missing_pubkeys:
+                nodes_dict[pubkey].update({
+                    "label": "",
+                    "tags": [],
+                    "type": "",
+                    "img_url": ""
+                })
+            metadata_worker.enqueue(missing_pubkeys)
 
         except Exception as e:
-            print(f"Error in metadata processing: {e}")
+            logger.warning(f"Error in metadata processing: {e}")
             for pubkey in new_pubkeys:
                 nodes_dict[pubkey].update({
                     "label": "",
@@ -118,370 +147,439 @@ async def add_accounts_metadata(
 
     return list(nodes_dict.values())
 
-async def build_tx_flows_network(
-    tx_data: Dict[str, Any],
+ASSET_BATCH_SIZE = 1000
+
+def token_from_asset(asset: Dict[str, Any]) -> Dict[str, Any]:
+    if not asset or (asset.get('token_info') or {}).get('decimals') is None:
+        return None
+    content = asset.get('content') or {}
+    return {
+        "ticker": (content.get('metadata') or {}).get('symbol', ''),
+        "decimals": asset['token_info']['decimals'],
+        "img_url": (content.get('links') or {}).get('image', '')
+    }
+
+@timed("tokens")
+async def resolve_tokens(
+    mints,
     rpc_url: str,
-    db: asyncpg.Connection = None,
-    existing_node_pubkeys: list = [],
-    existing_edge_ids: list = []
-) -> Dict[str, Any]:
-    try:
-        nodes = []
-        edges = []
-
-        def add_edge_if_new(edge):
-            edge_id = f"{edge['txId']}-{edge['source']}-{edge['target']}-{edge['mint']}-{edge['amount']}"
-            if edge_id not in existing_edge_ids:
-                edges.append(edge)
-
-        result = tx_data["result"]
-        meta = result["meta"]
-        transaction = result["transaction"]
-        accounts = [account["pubkey"] for account in transaction["message"]["accountKeys"]]
-
-        token_days = set()
-        tx_date = datetime.fromtimestamp(result['blockTime']).strftime('%Y%m%d')
-        token_days.add((sol_mint, tx_date))
-
-        # PROCESS FEES
-        total_fee = meta["fee"]
-        base_fee = len(transaction['signatures']) * 5000  # Base fee calculation
-        priority_fee = total_fee - base_fee
-
-        fee_payer = accounts[0]
-        nodes.append({
-            "pubkey": fee_payer,
-            "label": "Fee Payer",
-        })
-
-        nodes.append({
-            "pubkey": "Burn",
-            "label": "Burn"
-        })
-        edges.append({
-            "source": fee_payer,
-            "target": "Burn",
-            "amount": base_fee / 2,
-            "type": "fee",
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None
+) -> Dict[str, Dict[str, Any]]:
+    # Cache, then one ANY($1) query, then one getAssetBatch call per 1000 missing mints.
+    # Mints Helius has no token metadata for are cached as None (negative TTL), like absent labels.
+    cached = tokens_cache.get_many(set(mints))
+    tokens_map = {mint: token for mint, token in cached.items() if token is not None}
+    missing_mints = [mint for mint in set(mints) if mint not in cached]
+
+    if missing_mints and db:
+        db_results = await db.fetch(
+            """
+            SELECT mint, ticker, decimals, img_url
+            FROM tokens
+            WHERE mint = ANY($1)
+            """,
+            missing_mints
+        )
+        for result in db_results:
+            token = {
+                "ticker": result['ticker'],
+                "decimals": result['decimals'],
+                "img_url": result['img_url']
+            }
+            tokens_cache.set(result['mint'], token)
+            tokens_map[result['mint']] = token
+        missing_mints = [mint for mint in missing_mints if mint not in tokens_map]
+
+    if missing_mints:
+        insert_values = []
+        for i in range(0, len(missing_mints), ASSET_BATCH_SIZE):
+            batch = missing_mints[i:i + ASSET_BATCH_SIZE]
+            async with helius_limiter.request(session, "POST", rpc_url, json={
+                "jsonrpc": "2.0",
+                "id": "resolve_tokens",
+                "method": "getAssetBatch",
+                "params": {
+                    "ids": batch
+                }
+            }) as resp:
+                if resp.status != 200:
+                    raise HTTPException(status_code=resp.status, detail="Failed to fetch token metadata")
+                data = await resp.json()
+            if "error" in data or not isinstance(data.get('result'), list):
+                # Nothing is known about these mints, so nothing is cached for them
+                raise HTTPException(status_code=502, detail=f"Failed to fetch token metadata: {data.get('error')}")
+
+            # Results line up with the requested ids, null where Helius has no asset
+            for mint, asset in zip(batch, data['result']):
+                token = token_from_asset(asset)
+                if token is None:
+                    # Null asset or no token_info: don't ask the DB and Helius again until the negative TTL passes
+                    tokens_cache.set(asset.get('id', mint) if asset else mint, None, negative=True)
+                    continue
+                tokens_cache.set(asset['id'], token)
+                tokens_map[asset['id']] = token
+                insert_values.append((asset['id'], token["ticker"], token["decimals"], token["img_url"]))
+
+        write_behind.add(token_writes, insert_values)
+
+    return tokens_map
+
+SYSTEM_PROGRAM_ID = "11111111111111111111111111111111"
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+ASSOCIATED_TOKEN_PROGRAM_ID = "ATokenGPvbdGVxr1b2hvZbsiqW5xWH25efTNsLJA8knL"
+STAKE_PROGRAM_ID = "Stake11111111111111111111111111111111111111"
+
+class TxContext:
+    # Per-transaction state shared by the instruction decoders
+    def __init__(
+        self,
+        tx_id: str,
+        nodes: Dict[str, Dict[str, Any]],
+        edges: list[Dict[str, Any]],
+        ata_to_mint: Dict[str, str],
+        ata_to_owner: Dict[str, str],
+        wrapped_sol_accounts: set
+    ):
+        self.tx_id = tx_id
+        self.nodes = nodes
+        self.edges = edges
+        self.ata_to_mint = ata_to_mint
+        self.ata_to_owner = ata_to_owner
+        self.wrapped_sol_accounts = wrapped_sol_accounts
+        self.current_program_id = None
+
+    def add_node(self, pubkey: str, label: str = None):
+        if pubkey not in self.nodes:
+            node = {"pubkey": pubkey}
+            if label:
+                node["label"] = label
+            self.nodes[pubkey] = node
+
+    def label_node(self, pubkey: str, label: str):
+        if pubkey in self.nodes:
+            self.nodes[pubkey]["label"] = label
+
+    def add_edge(self, edge: Dict[str, Any]):
+        self.edges.append(edge)
+
+InstructionDecoder = Callable[[TxContext, Dict[str, Any]], None]
+
+# (programId, parsed type) -> decoder, for top-level and inner instructions respectively
+instruction_decoders: Dict[Tuple[str, str], InstructionDecoder] = {}
+inner_instruction_decoders: Dict[Tuple[str, str], InstructionDecoder] = {}
+
+def register_decoder(program_id: str, ix_type: str, inner: bool = False):
+    registry = inner_instruction_decoders if inner else instruction_decoders
+
+    def register(decoder: InstructionDecoder) -> InstructionDecoder:
+        registry[(program_id, ix_type)] = decoder
+        return decoder
+
+    return register
+
+def decode_instruction(ctx: TxContext, ix: Dict[str, Any], registry: Dict[Tuple[str, str], InstructionDecoder]):
+    parsed = ix.get("parsed")
+    if not isinstance(parsed, dict):
+        return
+    decoder = registry.get((ix.get("programId"), parsed.get("type")))
+    if decoder:
+        decoder(ctx, parsed["info"])
+
+def index_wrapped_sol_accounts(meta: Dict[str, Any]) -> set:
+    # Accounts initialized as SOL token accounts by an inner instruction
+    wrapped = set()
+    for ix_group in meta.get("innerInstructions") or []:
+        for ix in ix_group["instructions"]:
+            parsed = ix.get("parsed")
+            if (
+                isinstance(parsed, dict) and
+                parsed.get("type") == "initializeAccount3" and
+                ix["programId"] == TOKEN_PROGRAM_ID and
+                parsed["info"]["mint"] == sol_mint
+            ):
+                wrapped.add(parsed["info"]["account"])
+    return wrapped
+
+@register_decoder(SYSTEM_PROGRAM_ID, "transfer")
+def decode_system_transfer(ctx: TxContext, info: Dict[str, Any]):
+    ctx.add_node(info["source"])
+    ctx.add_node(info["destination"])
+    ctx.add_edge({
+        "source": info["source"],
+        "target": info["destination"],
+        "amount": float(info["lamports"]),
+        "type": "transfer",
+        "mint": sol_mint,
+        "txId": ctx.tx_id
+    })
+
+    if info["destination"] in ctx.wrapped_sol_accounts:
+        ctx.label_node(info["destination"], "Wrap SOL")
+        ctx.add_edge({
+            "source": info["destination"],
+            "target": info["source"],
+            "amount": info["lamports"],
+            "value": info["lamports"],
+            "type": "transfer",
             "mint": sol_mint,
-            "label": "Base Fee"
+            "tag": "Wrap SOL",
+            "txId": ctx.tx_id
         })
 
-        nodes.append({
-            "pubkey": "Validator",
-            "label": "Validator",
-        })
+@register_decoder(ASSOCIATED_TOKEN_PROGRAM_ID, "createIdempotent")
+def decode_create_idempotent(ctx: TxContext, info: Dict[str, Any]):
+    ctx.ata_to_mint[info["account"]] = info["mint"]
+    ctx.ata_to_owner[info["account"]] = info["wallet"]
+
+@register_decoder(SYSTEM_PROGRAM_ID, "createAccount")
+def decode_create_stake_account(ctx: TxContext, info: Dict[str, Any]):
+    if info.get("owner") != STAKE_PROGRAM_ID:
+        return
+    ctx.add_node(info["source"])
+    ctx.add_node(info["newAccount"])
+    ctx.add_edge({
+        "source": info["source"],
+        "target": info["newAccount"],
+        "amount": float(info["lamports"]),
+        "type": "stake",
+        "mint": sol_mint,
+        "txId": ctx.tx_id
+    })
+
+@register_decoder(STAKE_PROGRAM_ID, "delegate")
+def decode_stake_delegate(ctx: TxContext, info: Dict[str, Any]):
+    ctx.add_node(info["stakeAccount"])
+    ctx.add_node(info["voteAccount"])
+    ctx.add_edge({
+        "source": info["stakeAccount"],
+        "target": info["voteAccount"],
+        "amount": 1,
+        "type": "delegate",
+        "mint": sol_mint,
+        "txId": ctx.tx_id
+    })
+
+@register_decoder(TOKEN_PROGRAM_ID, "mintTo")
+def decode_mint_to(ctx: TxContext, info: Dict[str, Any]):
+    ctx.add_node(info["account"])
+    ctx.add_node("Mint", label="Mint")
+    ctx.add_edge({
+        "source": "Mint",
+        "target": info["account"],
+        "amount": info["amount"],
+        "type": "mint",
+        "label": "Mint",
+        "mint": info["mint"],
+        "txId": ctx.tx_id
+    })
+
+@register_decoder(TOKEN_PROGRAM_ID, "initializeAccount3", inner=True)
+def decode_initialize_account(ctx: TxContext, info: Dict[str, Any]):
+    if info["account"] not in ctx.ata_to_mint:
+        ctx.ata_to_mint[info["account"]] = info["mint"]
+        ctx.ata_to_owner[info["account"]] = info["owner"]
+
+@register_decoder(TOKEN_PROGRAM_ID, "transfer", inner=True)
+@register_decoder(TOKEN_PROGRAM_ID, "transferChecked", inner=True)
+def decode_token_transfer(ctx: TxContext, info: Dict[str, Any]):
+    dest_owner = ctx.ata_to_owner[info["destination"]]
+    ctx.add_node(info["authority"])
+    ctx.add_node(dest_owner)
+    ctx.add_edge({
+        "source": info["authority"],
+        "target": dest_owner,
+        "amount": float(info["amount"] if "amount" in info else info["tokenAmount"]["amount"]),
+        "type": "transfer",
+        "mint": ctx.ata_to_mint[info["source"]],
+        "programId": ctx.current_program_id,
+        "txId": ctx.tx_id
+    })
+
+SOL_TOKEN_IMAGE = "https://assets.coingecko.com/coins/images/4128/standard/solana.png?1718769756"
+
+@timed("graph_build")
+def parse_tx_flows(tx_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Structural pass: nodes and edges with raw amounts, no I/O; known edges are dropped after enrichment
+    nodes = {}
+    edges = []
+
+    result = tx_data["result"]
+    meta = result["meta"]
+    transaction = result["transaction"]
+    accounts = [account["pubkey"] for account in transaction["message"]["accountKeys"]]
+
+    token_days = set()
+    tx_date = datetime.fromtimestamp(result['blockTime']).strftime('%Y%m%d')
+    token_days.add((sol_mint, tx_date))
+
+    # PROCESS FEES
+    total_fee = meta["fee"]
+    base_fee = len(transaction['signatures']) * 5000  # Base fee calculation
+    priority_fee = total_fee - base_fee
+
+    tx_id = transaction["signatures"][0]
+    fee_payer = accounts[0]
+    nodes[fee_payer] = {
+        "pubkey": fee_payer,
+        "label": "Fee Payer",
+    }
+
+    nodes["Burn"] = {
+        "pubkey": "Burn",
+        "label": "Burn"
+    }
+    edges.append({
+        "source": fee_payer,
+        "target": "Burn",
+        "amount": base_fee / 2,
+        "type": "fee",
+        "mint": sol_mint,
+        "label": "Base Fee",
+        "txId": tx_id
+    })
+
+    nodes["Validator"] = {
+        "pubkey": "Validator",
+        "label": "Validator",
+    }
+    edges.append({
+        "source": fee_payer,
+        "target": "Validator",
+        "amount": base_fee / 2,
+        "type": "fee",
+        "mint": sol_mint,
+        "label": "Base Fee",
+        "txId": tx_id
+    })
+    
+    if priority_fee > 0:
         edges.append({
             "source": fee_payer,
             "target": "Validator",
-            "amount": base_fee / 2,
+            "amount": priority_fee,
             "type": "fee",
             "mint": sol_mint,
-            "label": "Base Fee"
+            "label": "Priority Fee",
+            "txId": tx_id
         })
-        
-        if priority_fee > 0:
-            edges.append({
-                "source": fee_payer,
-                "target": "Validator",
-                "amount": priority_fee,
-                "type": "fee",
-                "mint": sol_mint,
-                "label": "Priority Fee"
-            })
-
-        ata_to_mint = {}
-        ata_to_owner = {}
-        
-        for balance in meta.get("preTokenBalances", []):
-            account_index = balance['accountIndex']
-            ata_pubkey = accounts[account_index]
+
+    ata_to_mint = {}
+    ata_to_owner = {}
+    
+    for balance in meta.get("preTokenBalances", []):
+        account_index = balance['accountIndex']
+        ata_pubkey = accounts[account_index]
+        ata_to_mint[ata_pubkey] = balance['mint']
+        ata_to_owner[ata_pubkey] = balance['owner']
+        token_days.add((balance['mint'], tx_date))
+    
+    for balance in meta.get("postTokenBalances", []):
+        account_index = balance['accountIndex']
+        ata_pubkey = accounts[account_index]
+        if ata_pubkey not in ata_to_mint:
             ata_to_mint[ata_pubkey] = balance['mint']
             ata_to_owner[ata_pubkey] = balance['owner']
-            token_days.add((balance['mint'], tx_date))
-        
-        for balance in meta.get("postTokenBalances", []):
-            account_index = balance['accountIndex']
-            ata_pubkey = accounts[account_index]
-            if ata_pubkey not in ata_to_mint:
-                ata_to_mint[ata_pubkey] = balance['mint']
-                ata_to_owner[ata_pubkey] = balance['owner']
-
-        print(ata_to_mint)
-        print(ata_to_owner)
-
-        prices_map = await get_prices(token_days, db)
-        print(prices_map)
-
-        current_program_id = None
-
-        # PROCESS INSTRUCTIONS
-        for ix in transaction["message"]["instructions"]:
-            if "parsed" in ix:
-                if ix["parsed"].get("type") == "transfer" and ix["programId"] == "11111111111111111111111111111111":
-                    info = ix["parsed"]["info"]
-                    
-                    source_node = {
-                        "pubkey": info["source"]
-                    }
-                    if source_node not in nodes:
-                        nodes.append(source_node)
-                    
-                    dest_node = {
-                        "pubkey": info["destination"]
-                    }
-                    if dest_node not in nodes:
-                        nodes.append(dest_node)
-                    
-                    edge = {
-                        "source": info["source"],
-                        "target": info["destination"],
-                        "amount": float(info["lamports"]),
-                        "type": "transfer",
-                        "mint": sol_mint,
-                        "txId": transaction["signatures"][0]
-                    }
-                    add_edge_if_new(edge)
-
-                    for inner_ix_group in meta.get("innerInstructions", []):
-                        for inner_ix in inner_ix_group["instructions"]:
-                            if (
-                                "parsed" in inner_ix and 
-                                inner_ix["parsed"].get("type") == "initializeAccount3" and
-                                inner_ix["programId"] == "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA" and
-                                inner_ix["parsed"]["info"]["account"] == info["destination"] and
-                                inner_ix["parsed"]["info"]["mint"] == sol_mint
-                            ):
-                                # tag node where pubkey matches info["destination"] as "Wrap SOL"
-                                for node in nodes:
-                                    if node["pubkey"] == info["destination"]:
-                                        node["label"] = "Wrap SOL"
-                                        break
-                                        
-                                edge = {
-                                    "source": info["destination"],
-                                    "target": info["source"],
-                                    "amount": info["lamports"],
-                                    "value": info["lamports"],
-                                    "type": "transfer",
-                                    "mint": sol_mint,
-                                    "tag": "Wrap SOL",
-                                    "txId": transaction["signatures"][0]
-                                }
-                                add_edge_if_new(edge)
-
-                
-                elif ix["parsed"].get("type") == "createIdempotent" and ix["programId"] == "ATokenGPvbdGVxr1b2hvZbsiqW5xWH25efTNsLJA8knL":
-                    info = ix["parsed"]["info"]
-                    ata_pubkey = info["account"]
-                    ata_to_mint[ata_pubkey] = info["mint"]
-                    ata_to_owner[ata_pubkey] = info["wallet"]
-
-                elif ix["parsed"].get("type") == "createAccount" and ix["parsed"].get("info").get("owner") == "Stake11111111111111111111111111111111111111":
-                    print(ix)
-                    info = ix["parsed"]["info"]
-                    lamports = float(info["lamports"])
-                    new_account = info["newAccount"]
-                    source = info["source"]
-
-                    source_node = {
-                        "pubkey": source
-                    }
-                    if source_node not in nodes:
-                        nodes.append(source_node)
 
-                    stake_account_node = {
-                        "pubkey": new_account
-                    }
-                    if stake_account_node not in nodes:
-                        nodes.append(stake_account_node)
-
-                    edge = {
-                        "source": source,
-                        "target": new_account,
-                        "amount": lamports,
-                        "type": "stake",
-                        "mint": sol_mint,
-                        "txId": transaction["signatures"][0]
-                    }
-                    add_edge_if_new(edge)
-                
-                elif ix["parsed"].get("type") == "delegate" and ix.get("programId") == "Stake11111111111111111111111111111111111111":
-                    info = ix["parsed"]["info"]
-                    stake_account = info["stakeAccount"]
-                    vote_account = info["voteAccount"]
-                    
-                    stake_account_node = {
-                        "pubkey": stake_account
-                    }
-                    if stake_account_node not in nodes:
-                        nodes.append(stake_account_node)
-                    
-                    vote_account_node = {
-                        "pubkey": vote_account
-                    }
-                    if vote_account_node not in nodes:
-                        nodes.append(vote_account_node)
-                        
-                    edge = {
-                        "source": stake_account,
-                        "target": vote_account,
-                        "amount": 1,
-                        "type": "delegate",
-                        "mint": sol_mint,
-                        "txId": transaction["signatures"][0]
-                    }
-                    add_edge_if_new(edge)
+    # PROCESS INSTRUCTIONS
+    ctx = TxContext(
+        tx_id=tx_id,
+        nodes=nodes,
+        edges=edges,
+        ata_to_mint=ata_to_mint,
+        ata_to_owner=ata_to_owner,
+        wrapped_sol_accounts=index_wrapped_sol_accounts(meta)
+    )
+    for ix in transaction["message"]["instructions"]:
+        decode_instruction(ctx, ix, instruction_decoders)
+
+    # PROCESS INNER INSTRUCTIONS
+    if meta["innerInstructions"]:
+        for ix_group in meta["innerInstructions"]:
+            for ix in ix_group["instructions"]:
+                if "parsed" in ix:
+                    decode_instruction(ctx, ix, inner_instruction_decoders)
+                else:
+                    ctx.current_program_id = ix["programId"]
 
-                elif ix["parsed"].get("type") == "mintTo" and ix.get("programId") == "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA":
-                    info = ix["parsed"]["info"]
-                    mint = info["mint"]
-                    amount = info["amount"]
-                    destination = info["account"]
+    return {"nodes": nodes, "edges": edges, "token_days": token_days, "tx_date": tx_date}
 
-                    destination_node = {
-                        "pubkey": destination
-                    }
-                    if destination_node not in nodes:
-                        nodes.append(destination_node)
+def token_mints(edges: list[Dict[str, Any]]) -> set:
+    return {
+        edge["mint"] for edge in edges if "mint" in edge and edge["mint"] not in [sol_mint, wsol_mint]
+    }
 
-                    mint_node = {
-                        "pubkey": "Mint",
-                        "label": "Mint"
-                    }
-                    if mint_node not in nodes:
-                        nodes.append(mint_node)
-
-                    edge = {
-                        "source": "Mint",
-                        "target": destination,
-                        "amount": amount,
-                        "type": "mint",
-                        "label": "Mint",
-                        "mint": mint,
-                        "txId": transaction["signatures"][0]
-                    }
-                    add_edge_if_new(edge)
-
-        # PROCESS INNER INSTRUCTIONS
-        current_program_id = None
-        if meta["innerInstructions"]:
-            for ix_group in meta["innerInstructions"]:
-                for ix in ix_group["instructions"]:
-                    if "parsed" in ix:
-                        if ix["parsed"].get("type") == "initializeAccount3" and ix.get("programId") == "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA":
-                            info = ix["parsed"]["info"]
-                            ata_pubkey = info["account"]
-                            if ata_pubkey not in ata_to_mint:
-                                ata_to_mint[ata_pubkey] = info["mint"]
-                                ata_to_owner[ata_pubkey] = info["owner"]
-
-                        if ix["parsed"].get("type") in ["transfer", "transferChecked"] and ix.get("programId") == "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA":
-                            info = ix["parsed"]["info"]
-                            info["mint"] = ata_to_mint[info["source"]]
-                            info["dest_owner"] = ata_to_owner[info["destination"]]
-
-                            source_node = {
-                                "pubkey": info["authority"]
-                            }
-                            if not any(node["pubkey"] == source_node["pubkey"] for node in nodes):
-                                nodes.append(source_node)
-                            
-                            dest_node = {
-                                "pubkey": info["dest_owner"]
-                            }
-                            if not any(node["pubkey"] == dest_node["pubkey"] for node in nodes):
-                                nodes.append(dest_node)
-                            
-                            edge = {
-                                "source": info["authority"],
-                                "target": info["dest_owner"],
-                                "amount": float(info["amount"] if "amount" in info else info["tokenAmount"]["amount"]),
-                                "type": "transfer",
-                                "mint": info["mint"],
-                                "programId": current_program_id,
-                                "txId": transaction["signatures"][0]
-                            }
-                            add_edge_if_new(edge)
+async def resolve_tx_tokens(
+    edges: list[Dict[str, Any]],
+    rpc_url: str,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None
+) -> Dict[str, Dict[str, Any]]:
+    # Unlike account flows, a transaction graph can't be priced without every mint's decimals
+    token_addresses = token_mints(edges)
+    try:
+        tokens_map = await resolve_tokens(token_addresses, rpc_url, db, session)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"RPC request failed: {str(e)}")
+    unresolved_mints = token_addresses - tokens_map.keys()
+    if unresolved_mints:
+        raise HTTPException(
+            status_code=500,
+            detail=f"RPC request failed: no token metadata for {', '.join(sorted(unresolved_mints))}"
+        )
+    return tokens_map
+
+def apply_tx_token_metadata(edges: list[Dict[str, Any]], tokens_map: Dict[str, Dict[str, Any]]):
+    # Converts raw amounts to whole units and adds ticker/image
+    for edge in edges:
+        if "mint" in edge and edge["type"] != "delegate":
+            if edge["mint"] in [sol_mint, wsol_mint]:
+                edge["mint"] = sol_mint
+                edge["ticker"] = "SOL"
+                edge["tokenImage"] = SOL_TOKEN_IMAGE
+                edge["amount"] = float(edge["amount"]) / 10 ** 9
+            else:
+                token = tokens_map[edge["mint"]]
+                edge["ticker"] = token["ticker"]
+                edge["tokenImage"] = token["img_url"]
+                edge["amount"] = float(edge["amount"]) / 10 ** token["decimals"]
+
+def apply_tx_prices(edges: list[Dict[str, Any]], prices_map: Dict[tuple, float], tx_date: str):
+    # Expects amounts already converted by apply_tx_token_metadata
+    # Edges whose price is unknown (not published yet, or upstream failing) get value None
+    sol_price = prices_map.get((sol_mint, tx_date))
+    for edge in edges:
+        if "mint" in edge and edge["type"] != "delegate":
+            if edge["mint"] in [sol_mint, wsol_mint]:
+                price = sol_price
+            else:
+                price = prices_map.get((edge["mint"], tx_date))
+            edge["value"] = edge["amount"] * price if price is not None else None
 
-                    else:
-                        current_program_id = ix["programId"]
+async def build_tx_flows_network(
+    tx_data: Dict[str, Any],
+    rpc_url: str,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None,
+    existing_node_pubkeys: list = [],
+    existing_edge_ids: list = []
+) -> Dict[str, Any]:
+    try:
+        flows = parse_tx_flows(tx_data)
+        edges = flows["edges"]
 
-        
-        # ADD TRANSFER METADATA
-        token_addresses = {
-            edge["mint"] for edge in edges if "mint" in edge and edge["mint"] not in [sol_mint, wsol_mint]
-        }
-        token_tickers = {}
-        token_decimals = {}
-        token_img_urls = {}
+        prices_map = await get_prices(flows["token_days"], db, session)
+        sampled_debug(logger, "prices_map %s", prices_map)
 
-        for token_address in token_addresses:
-            try:
-                db_result = await db.fetchrow(
-                    """
-                    SELECT ticker, decimals, img_url
-                    FROM tokens
-                    WHERE mint = $1
-                    """,
-                    token_address
-                )
-                if db_result:
-                    token_tickers[token_address] = db_result['ticker']
-                    token_decimals[token_address] = db_result['decimals']
-                    token_img_urls[token_address] = db_result['img_url']
-                else:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(rpc_url, json={
-                            "jsonrpc": "2.0",
-                            "id": "test",
-                            "method": "getAsset",
-                            "params": {
-                                "id": token_address
-                            }
-                        }) as resp:
-                            if resp.status != 200:
-                                raise HTTPException(status_code=resp.status, detail="Failed to fetch transaction data")
-                            data = await resp.json()
-                            ticker = data['result']['content']['metadata']['symbol']
-                            decimals = data['result']['token_info']['decimals']
-                            img_url = data['result']['content']['links']['image']
-
-                            await db.execute(
-                                """
-                                INSERT INTO tokens (mint, ticker, decimals, img_url)
-                                VALUES ($1, $2, $3, $4)
-                                """,
-                                token_address, ticker, decimals, img_url
-                            )
-
-                            token_tickers[token_address] = ticker
-                            token_decimals[token_address] = decimals
-                            token_img_urls[token_address] = img_url
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"RPC request failed: {str(e)}")
-        
-        sol_price = prices_map[(sol_mint, datetime.fromtimestamp(result['blockTime']).strftime('%Y%m%d'))]
-        for edge in edges:
-            if "mint" in edge and edge["type"] != "delegate":
-                if edge["mint"] in [sol_mint, wsol_mint]:
-                    sol_amount = float(edge["amount"]) / 10 ** 9
-                    edge["mint"] = sol_mint
-                    edge["ticker"] = "SOL"
-                    edge["tokenImage"] = "https://assets.coingecko.com/coins/images/4128/standard/solana.png?1718769756"
-                    edge["amount"] = sol_amount
-                    edge["value"] = sol_amount * sol_price
-                else:
-                    whole_amount = float(edge["amount"]) / 10 ** token_decimals[edge["mint"]]
-                    edge["ticker"] = token_tickers[edge["mint"]]
-                    edge["tokenImage"] = token_img_urls[edge["mint"]]
-                    edge["amount"] = whole_amount
-                    edge["value"] = whole_amount * prices_map[(edge["mint"], tx_date)]
+        # ADD TRANSFER METADATA
+        tokens_map = await resolve_tx_tokens(edges, rpc_url, db, session)
+        apply_tx_token_metadata(edges, tokens_map)
+        apply_tx_prices(edges, prices_map, flows["tx_date"])
+        edges = drop_known_edges(edges, existing_edge_ids)
 
         # ADD ACCOUNT METADATA
-        nodes = await add_accounts_metadata(nodes, existing_node_pubkeys, db)
-        print(nodes)
-        print(edges)
+        nodes = await add_accounts_metadata(list(flows["nodes"].values()), existing_node_pubkeys, db, session)
+        sampled_debug(logger, "tx network nodes %s edges %s", nodes, edges)
         
         return {"nodes": nodes, "edges": edges}
     
@@ -496,143 +594,259 @@ async def build_tx_flows_network(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )        
-    
-async def build_account_flows_network(
-    flows_data: list[Dict[str, Any]],
+
+async def build_batch_tx_flows_network(
+    transactions: Dict[str, Dict[str, Any]],
     rpc_url: str,
-    db: asyncpg.Connection = None,
-    limit: int = 10,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None,
     existing_node_pubkeys: list = [],
     existing_edge_ids: list = []
 ) -> Dict[str, Any]:
+    """Merged graph for many transactions with a single enrichment pass.
+
+    Prices, token metadata and account labels are resolved once for the
+    union of (mint, day) pairs, mints and pubkeys. A transaction that fails
+    to parse or enrich is reported under "errors" and left out of the graph.
+    """
+    existing_edge_ids = as_id_set(existing_edge_ids)
+    errors = {}
+    parsed = {}
+    for tx_signature, tx_data in transactions.items():
+        try:
+            parsed[tx_signature] = parse_tx_flows(tx_data)
+        except KeyError as e:
+            errors[tx_signature] = f"Invalid transaction data structure: {str(e)}"
+        except Exception as e:
+            errors[tx_signature] = f"Internal server error: {str(e)}"
+
     try:
-        nodes = []
+        token_days = set().union(*(flows["token_days"] for flows in parsed.values()))
+        prices_map = await get_prices(token_days, db, session)
+
+        mints = set().union(*(token_mints(flows["edges"]) for flows in parsed.values()))
+        try:
+            tokens_map = await resolve_tokens(mints, rpc_url, db, session)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"RPC request failed: {str(e)}")
+
+        nodes = {}
         edges = []
+        for tx_signature, flows in parsed.items():
+            try:
+                unresolved_mints = token_mints(flows["edges"]) - tokens_map.keys()
+                if unresolved_mints:
+                    raise ValueError(f"no token metadata for {', '.join(sorted(unresolved_mints))}")
+                apply_tx_token_metadata(flows["edges"], tokens_map)
+                apply_tx_prices(flows["edges"], prices_map, flows["tx_date"])
+            except Exception as e:
+                errors[tx_signature] = f"Failed to enrich transaction: {str(e)}"
+                continue
+            for pubkey, node in flows["nodes"].items():
+                nodes.setdefault(pubkey, node)
+            edges.extend(drop_known_edges(flows["edges"], existing_edge_ids))
 
-        def add_edge_if_new(edge):
-            edge_id = f"{edge['txId']}-{edge['source']}-{edge['target']}-{edge['mint']}-{edge['amount']}"
-            print('edge_id', edge_id)
-            if edge_id not in existing_edge_ids:
-                edges.append(edge)
+        nodes = await add_accounts_metadata(list(nodes.values()), existing_node_pubkeys, db, session)
+        return {"nodes": nodes, "edges": edges, "errors": errors}
 
-        token_days = [(flow['token_address'], datetime.fromtimestamp(flow['block_time']).strftime('%Y%m%d')) for flow in flows_data]
-        unique_token_days = list(set(token_days))
-        prices_map = await get_prices(unique_token_days, db)
-        print('prices_map', prices_map)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-        for flow in flows_data:
-            if not flow["from_address"] or not flow["to_address"]:
-                print(flow)
-                continue
-            
-            source_node = {
-                "pubkey": flow["from_address"],
-            }
-            if not any(node["pubkey"] == source_node["pubkey"] for node in nodes):
-                nodes.append(source_node)
-            
-            dest_node = {
-                "pubkey": flow["to_address"]
-            }
-            if not any(node["pubkey"] == dest_node["pubkey"] for node in nodes):
-                nodes.append(dest_node)
-
-            whole_amount = flow['amount'] / 10 ** flow['token_decimals']
-            date_str = datetime.fromtimestamp(flow['block_time']).strftime('%Y%m%d')
-            price = prices_map[(flow['token_address'], date_str)]
-                
-            edge = {
-                'source': flow['from_address'],
-                'target': flow['to_address'],
-                'amount': whole_amount,
-                'value': price * whole_amount if price else None,
-                'mint': flow['token_address'],
-                'txId': flow['trans_id'],
-                'blockTime': flow['block_time'],
-                'type': flow['activity_type']
-            }
-            add_edge_if_new(edge)
+@timed("graph_build")
+def parse_account_flows(flows_data: list[Dict[str, Any]]) -> Dict[str, Any]:
+    # Structural pass: one edge per transfer row, value filled in by apply_account_prices
+    nodes = {}
+    edges = []
 
-        # ADD TRANSFER METADATA
-        token_addresses = {
-            edge["mint"] for edge in edges if "mint" in edge and edge["mint"] not in [sol_mint, wsol_mint]
-        }
-        token_tickers = {}
-        token_img_urls = {}
+    token_days = {(flow['token_address'], datetime.fromtimestamp(flow['block_time']).strftime('%Y%m%d')) for flow in flows_data}
 
-        for token_address in token_addresses:
-            try:
-                db_result = await db.fetchrow(
-                    """
-                    SELECT ticker, decimals, img_url
-                    FROM tokens
-                    WHERE mint = $1
-                    """,
-                    token_address
-                )
-                if db_result:
-                    token_tickers[token_address] = db_result['ticker']
-                    token_img_urls[token_address] = db_result['img_url']
-                else:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(rpc_url, json={
-                            "jsonrpc": "2.0",
-                            "id": "test",
-                            "method": "getAsset",
-                            "params": {
-                                "id": token_address
-                            }
-                        }) as resp:
-                            if resp.status != 200:
-                                raise HTTPException(status_code=resp.status, detail="Failed to fetch transaction data")
-                            data = await resp.json()
-                            print(data)
-                            ticker = data['result']['content']['metadata']['symbol']
-                            decimals = data['result']['token_info']['decimals']
-                            img_url = data['result']['content']['links']['image']
-
-                            await db.execute(
-                                """
-                                INSERT INTO tokens (mint, ticker, decimals, img_url)
-                                VALUES ($1, $2, $3, $4)
-                                """,
-                                token_address, ticker, decimals, img_url
-                            )
-
-                            token_tickers[token_address] = ticker
-                            token_img_urls[token_address] = img_url
-                            
-            except Exception as e:
-                #raise HTTPException(status_code=500, detail=f"RPC request failed: {str(e)}")
-                token_tickers[token_address] = ""
-                token_img_urls[token_address] = ""
+    for flow in flows_data:
+        if not flow["from_address"] or not flow["to_address"]:
+            logger.debug(f"Skipping transfer without both endpoints: {flow.get('trans_id')}")
+            continue
         
-        for edge in edges:
-            if "mint" in edge:
-                if edge["mint"] in [sol_mint, wsol_mint]:
-                    edge["mint"] = sol_mint
-                    edge["ticker"] = "SOL"
-                    edge['tokenImage'] = "https://assets.coingecko.com/coins/images/4128/standard/solana.png?1718769756"
-                else:
-                    edge["ticker"] = token_tickers[edge["mint"]]
-                    edge['tokenImage'] = token_img_urls[edge["mint"]]
+        if flow["from_address"] not in nodes:
+            nodes[flow["from_address"]] = {"pubkey": flow["from_address"]}
+        if flow["to_address"] not in nodes:
+            nodes[flow["to_address"]] = {"pubkey": flow["to_address"]}
+
+        edge = {
+            'source': flow['from_address'],
+            'target': flow['to_address'],
+            'amount': flow['amount'] / 10 ** flow['token_decimals'],
+            'value': None,
+            'mint': flow['token_address'],
+            'txId': flow['trans_id'],
+            'blockTime': flow['block_time'],
+            'type': flow['activity_type']
+        }
+        edges.append(edge)
+
+    return {"nodes": nodes, "edges": edges, "token_days": token_days}
+
+def apply_account_prices(edges: list[Dict[str, Any]], prices_map: Dict[tuple, float]):
+    for edge in edges:
+        date_str = datetime.fromtimestamp(edge['blockTime']).strftime('%Y%m%d')
+        price = prices_map.get((edge['mint'], date_str))
+        edge['value'] = price * edge['amount'] if price else None
+
+def apply_account_token_metadata(edges: list[Dict[str, Any]], tokens_map: Dict[str, Dict[str, Any]]):
+    for edge in edges:
+        if "mint" in edge:
+            if edge["mint"] in [sol_mint, wsol_mint]:
+                edge["mint"] = sol_mint
+                edge["ticker"] = "SOL"
+                edge['tokenImage'] = SOL_TOKEN_IMAGE
+            else:
+                token = tokens_map.get(edge["mint"], {})
+                edge["ticker"] = token.get("ticker", "")
+                edge['tokenImage'] = token.get("img_url", "")
+
+@timed("graph_build")
+def aggregate_edges(edges: list[Dict[str, Any]], include_tx_ids: bool = False) -> list[Dict[str, Any]]:
+    """Collapse enriched transfer edges into one edge per (source, target, mint).
+
+    Columns are pulled out once, each row is mapped to a group index, and the
+    sums/min/max are accumulated into typed arrays indexed by group, so no
+    per-row dicts are built. `value` sums the priced transfers (None if none
+    were priced) and `unpriced` counts the rest. Groups keep first-seen order.
+    """
+    if not edges:
+        return []
+    groups: Dict[tuple, int] = {}
+    group_ids = [groups.setdefault((edge['source'], edge['target'], edge['mint']), len(groups)) for edge in edges]
+    size = len(groups)
+
+    amounts = array('d', bytes(8 * size))
+    values = array('d', bytes(8 * size))
+    counts = array('q', bytes(8 * size))
+    priced = array('q', bytes(8 * size))
+    first_times = array('q', [2 ** 62]) * size
+    last_times = array('q', [-2 ** 62]) * size
+    first_edge = [None] * size
+
+    for group, edge in zip(group_ids, edges):
+        amounts[group] += edge['amount']
+        counts[group] += 1
+        value = edge.get('value')
+        if value is not None:
+            values[group] += value
+            priced[group] += 1
+        block_time = edge['blockTime']
+        if block_time < first_times[group]:
+            first_times[group] = block_time
+        if block_time > last_times[group]:
+            last_times[group] = block_time
+        if first_edge[group] is None:
+            first_edge[group] = edge
+
+    tx_ids = None
+    if include_tx_ids:
+        tx_ids = [[] for _ in range(size)]
+        for group, edge in zip(group_ids, edges):
+            tx_ids[group].append(edge['txId'])
+
+    aggregated = []
+    for (source, target, mint), group in groups.items():
+        edge = {
+            'source': source,
+            'target': target,
+            'mint': mint,
+            'ticker': first_edge[group].get('ticker', ''),
+            'tokenImage': first_edge[group].get('tokenImage', ''),
+            'amount': amounts[group],
+            'value': values[group] if priced[group] else None,
+            'unpriced': counts[group] - priced[group],
+            'count': counts[group],
+            'firstBlockTime': first_times[group],
+            'lastBlockTime': last_times[group],
+            'type': 'aggregate'
+        }
+        if tx_ids is not None:
+            edge['txIds'] = tx_ids[group]
+        aggregated.append(edge)
+    return aggregated
+
+async def resolve_account_tokens(
+    edges: list[Dict[str, Any]],
+    rpc_url: str,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None
+) -> Dict[str, Dict[str, Any]]:
+    # Missing metadata only blanks the ticker for account flows
+    try:
+        return await resolve_tokens(token_mints(edges), rpc_url, db, session)
+    except Exception as e:
+        logger.warning(f"Error resolving token metadata: {e}")
+        return {}
+
+async def build_account_flows_network(
+    flows_data: list[Dict[str, Any]],
+    rpc_url: str,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None,
+    limit: int = 10,
+    existing_node_pubkeys: list = [],
+    existing_edge_ids: list = [],
+    has_more: bool = None
+) -> Dict[str, Any]:
+    # has_more comes from cursor pagination; page-number callers fall back to a full-page check
+    try:
+        flows = parse_account_flows(flows_data)
+        edges = flows["edges"]
+
+        prices_map = await get_prices(list(flows["token_days"]), db, session)
+        sampled_debug(logger, "prices_map %s", prices_map)
+        apply_account_prices(edges, prices_map)
+
+        # ADD TRANSFER METADATA
+        tokens_map = await resolve_account_tokens(edges, rpc_url, db, session)
+        apply_account_token_metadata(edges, tokens_map)
+        edges = drop_known_edges(edges, existing_edge_ids)
 
         # ADD ACCOUNT METADATA
-        nodes = await add_accounts_metadata(nodes, existing_node_pubkeys, db)
+        nodes = await add_accounts_metadata(list(flows["nodes"].values()), existing_node_pubkeys, db, session)
         
-        if limit == len(flows_data):
-            return {"nodes": nodes, "edges": edges, "hasMore": True}
-        elif limit > len(flows_data):
-            return {"nodes": nodes, "edges": edges, "hasMore": False}
+        if has_more is None:
+            has_more = len(flows_data) >= limit
+        return {"nodes": nodes, "edges": edges, "hasMore": has_more}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-async def get_prices(token_days, db: asyncpg.Connection = None):
-    print('token_days', token_days)
+@timed("prices")
+async def get_prices(
+    token_days,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None
+):
+    """Daily USD price for every (mint, day) pair; None where no price is known.
+
+    Lookup order: in-memory matrix, known-missing/error states, prices_daily,
+    then Solscan. Only real prices are written to prices_daily; legacy NULL
+    rows are ignored so those days get retried.
+    """
+    sampled_debug(logger, "token_days %s", token_days)
     prices_map = {}
     if not token_days:
         return prices_map
     
+    # Hot mints are answered from the in-memory matrix without touching Postgres
+    token_days = price_matrix.fill(prices_map, token_days)
+    token_days = price_states.fill(prices_map, token_days)
+    # Prices fetched by earlier requests but not flushed to prices_daily yet
+    remaining = []
+    for token, day in token_days:
+        row = price_writes.pending((token, day))
+        if row:
+            prices_map[(token, day)] = row[2]
+        else:
+            remaining.append((token, day))
+    token_days = remaining
+    if not token_days:
+        return prices_map
+
     try:
         tokens = [pair[0] for pair in token_days]
         days = [pair[1] for pair in token_days]
@@ -643,13 +857,14 @@ async def get_prices(token_days, db: asyncpg.Connection = None):
             FROM prices_daily
             WHERE (mint, day) IN (
                 SELECT * FROM unnest($1::text[], $2::text[])
-            )
+            ) AND price IS NOT NULL
             """,
             tokens, days
         )
 
         for result in db_results:
-            prices_map[(result['mint'], result['day'])] = float(result['price']) if result['price'] else None
+            prices_map[(result['mint'], result['day'])] = float(result['price'])
+        price_states.count("db_hits", len(db_results))
 
         missing_pairs = [pair for pair in token_days if pair not in prices_map]
             
@@ -660,59 +875,47 @@ async def get_prices(token_days, db: asyncpg.Connection = None):
                     token_to_days[token] = []
                 token_to_days[token].append(day)
             
-            headers = {'token': os.getenv('SOLSCAN_API_KEY')}
-            async with aiohttp.ClientSession() as session:
-                tasks = []
-                
-                for token, days in token_to_days.items():
-                    days.sort()
-                    from_time = min(days)
-                    to_time = max(days)
-                    
-                    url = f"https://pro-api.solscan.io/v2.0/token/price?address={token}&from_time={from_time}&to_time={to_time}"
-                    tasks.append(asyncio.create_task(session.get(url, headers=headers)))
-                
-                responses = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                insert_values = []
-                for (token, _), resp in zip(token_to_days.items(), responses):
-                    if isinstance(resp, Exception):
-                        print(f"Error fetching price for {token}: {resp}")
-                        for day in token_to_days[token]:
-                            prices_map[(token, day)] = None
-                            insert_values.append((token, day, None))
-                        continue
-                        
-                    if resp.status == 200:
-                        json_data = await resp.json()
-                        days_with_prices = set()
-
-                        if json_data.get('data'):
-                            for price_data in json_data['data']:
-                                day = price_data.get('date')
-                                price = price_data.get('price')
-                                
-                                if day:
-                                    days_with_prices.add(day)
-                                    prices_map[(token, day)] = float(price)
-                                    insert_values.append((token, str(day), float(price)))
-                        
-                        for day in token_to_days[token]:
-                            if day not in days_with_prices:
-                                prices_map[(token, day)] = None
-                                insert_values.append((token, str(day), None))
-                
-                # Bulk insert new prices
-                if insert_values:
-                    await db.executemany(
-                        """
-                        INSERT INTO prices_daily (mint, day, price)
-                        VALUES ($1, $2, $3)
-                        ON CONFLICT (mint, day) DO NOTHING
-                        """,
-                        insert_values
-                    )
-        
+            def fetch_price_range(token, days):
+                days.sort()
+                return fetch_solscan_price_range(token, min(days), max(days), session)
+
+            responses = await asyncio.gather(
+                *(fetch_price_range(token, days) for token, days in token_to_days.items()),
+                return_exceptions=True
+            )
+
+            insert_values = []
+            for (token, requested_days), json_data in zip(token_to_days.items(), responses):
+                if isinstance(json_data, Exception) or json_data is None:
+                    # Transient: answer None now, retry after PRICE_ERROR_TTL, persist nothing
+                    logger.warning(f"Error fetching price for {token}: {json_data}")
+                    for day in requested_days:
+                        prices_map[(token, day)] = None
+                        price_states.mark_error(token, day)
+                    continue
+
+                # Solscan returns the date as an int; keys here are YYYYMMDD strings
+                fetched = {}
+                for price_data in json_data.get('data') or []:
+                    day = price_data.get('date')
+                    price = price_data.get('price')
+                    if day and price is not None:
+                        fetched[str(day)] = float(price)
+
+                for day in requested_days:
+                    price = fetched.get(day)
+                    prices_map[(token, day)] = price
+                    if price is None:
+                        price_states.mark_missing(token, day)
+                    else:
+                        insert_values.append((token, day, price))
+                        price_states.count("upstream_hits")
+
+            write_behind.add(price_writes, insert_values)
+
+        for token, day in token_days:
+            price_matrix.set(token, day, prices_map.get((token, day)))
+
         return prices_map
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,257 @@
+# Shared outbound HTTP client for Helius and Solscan
+import asyncio
+from contextlib import asynccontextmanager
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+import aiohttp
+
+from metrics_utils import observe_upstream
+
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", "100"))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "30"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.25"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def create_http_session() -> aiohttp.ClientSession:
+    # Must be called from inside the running event loop (e.g. the app lifespan)
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TOTAL_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+class UpstreamLimiter:
+    """Process-wide token bucket plus concurrency cap for one upstream API.
+
+    429/5xx responses and connection errors are retried with full-jitter
+    exponential backoff. A 429 with Retry-After pauses the whole bucket, not
+    just the request that hit it.
+    """
+
+    def __init__(self, name: str, rps: float, burst: int, max_concurrency: int):
+        self.name = name
+        self.rps = rps
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    async def _take_token(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rps)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rps
+                self.wait_seconds += wait
+                await asyncio.sleep(wait)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(resp: aiohttp.ClientResponse) -> float:
+        try:
+            return max(0.0, float(resp.headers.get("Retry-After", "")))
+        except ValueError:
+            return None
+
+    @asynccontextmanager
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                attempt = 0
+                while True:
+                    await self._take_token()
+                    self.requests += 1
+                    started = time.perf_counter()
+                    try:
+                        resp = await session.request(method, url, **kwargs)
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        observe_upstream(self.name, type(e).__name__, time.perf_counter() - started)
+                        self.errors += 1
+                        if attempt >= UPSTREAM_MAX_RETRIES:
+                            self.failures += 1
+                            raise
+                        delay = self._backoff(attempt)
+                    else:
+                        observe_upstream(self.name, resp.status, time.perf_counter() - started)
+                        if resp.status not in RETRY_STATUSES or attempt >= UPSTREAM_MAX_RETRIES:
+                            if resp.status in RETRY_STATUSES:
+                                self.failures += 1
+                            try:
+                                yield resp
+                            finally:
+                                resp.release()
+                            return
+
+                        retry_after = self._retry_after(resp)
+                        delay = retry_after if retry_after is not None else self._backoff(attempt)
+                        if resp.status == 429:
+                            self.throttled += 1
+                            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                        resp.release()
+
+                    attempt += 1
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rps": self.rps,
+            "burst": self.burst,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "failures": self.failures,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+class BackgroundLimiter(UpstreamLimiter):
+    """Capped share of another limiter's budget for background jobs.
+
+    Each request takes a token here first and then goes through the parent,
+    so background work never uses more than `rps` of the upstream budget or
+    more than `max_concurrency` of its slots; interactive callers keep the rest.
+    Retries and backoff are handled by the parent.
+    """
+
+    def __init__(self, name: str, parent: UpstreamLimiter, rps: float, burst: int, max_concurrency: int):
+        super().__init__(name, rps, burst, max_concurrency)
+        self.parent = parent
+
+    @asynccontextmanager
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        async with self._semaphore:
+            await self._take_token()
+            self.requests += 1
+            self.in_flight += 1
+            try:
+                async with self.parent.request(session, method, url, **kwargs) as resp:
+                    yield resp
+            finally:
+                self.in_flight -= 1
+
+solscan_limiter = UpstreamLimiter(
+    "solscan",
+    rps=float(os.getenv("SOLSCAN_RPS", "15")),
+    burst=int(os.getenv("SOLSCAN_BURST", "30")),
+    max_concurrency=int(os.getenv("SOLSCAN_MAX_CONCURRENCY", "10")),
+)
+# Background transfer syncs and the price backfill, carved out of the Solscan budget above
+solscan_sync_limiter = BackgroundLimiter(
+    "solscan_sync",
+    solscan_limiter,
+    rps=float(os.getenv("SOLSCAN_SYNC_RPS", "2")),
+    burst=int(os.getenv("SOLSCAN_SYNC_BURST", "2")),
+    max_concurrency=int(os.getenv("SOLSCAN_SYNC_MAX_CONCURRENCY", "1")),
+)
+helius_limiter = UpstreamLimiter(
+    "helius",
+    rps=float(os.getenv("HELIUS_RPS", "40")),
+    burst=int(os.getenv("HELIUS_BURST", "50")),
+    max_concurrency=int(os.getenv("HELIUS_MAX_CONCURRENCY", "20")),
+)
+
+class SingleFlight:
+    """Coalesce concurrent identical upstream calls into one in-flight task.
+
+    Callers sharing a key all await the same result, so they must treat it
+    as read-only.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    async def do(self, endpoint: str, params: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        key = (endpoint, params)
+        counters = self._counters.setdefault(endpoint, {"calls": 0, "coalesced": 0})
+        counters["calls"] += 1
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+
+            def forget(done_task: asyncio.Task):
+                self._inflight.pop(key, None)
+                if not done_task.cancelled():
+                    done_task.exception()
+
+            task.add_done_callback(forget)
+        else:
+            counters["coalesced"] += 1
+
+        # Shield so one caller disconnecting doesn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "endpoints": {endpoint: dict(counters) for endpoint, counters in self._counters.items()},
+        }
+
+upstream_flight = SingleFlight()
+
+def upstream_stats() -> Dict[str, Any]:
+    return {
+        "coalescing": upstream_flight.stats(),
+        "rate_limits": {
+            solscan_limiter.name: solscan_limiter.stats(),
+            solscan_sync_limiter.name: solscan_sync_limiter.stats(),
+            helius_limiter.name: helius_limiter.stats(),
+        },
+    }
@@ -1,15 +1,34 @@
 from contextlib import asynccontextmanager
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import json
 import os
 import logging
-import asyncpg
+import time
+import aiohttp
 import warnings
 warnings.filterwarnings("always", category=UserWarning)
 
-from solana_utils import fetch_account_metadata, fetch_transaction, fetch_account_flows
-from graph_utils import build_tx_flows_network, build_account_flows_network
+from solana_utils import fetch_account_metadata, fetch_transaction, fetch_transactions
+from graph_utils import aggregate_edges, build_account_flows_network, build_batch_tx_flows_network, edge_key, IdUnion
+from bloom_utils import BloomFilter
+from session_store import GraphSession, graph_sessions
+from http_utils import create_http_session, upstream_stats
+from cache_utils import cache_stats
+from db_utils import DatabasePool, create_db_pool
+from tx_store import tx_store
+from tx_graph_cache import TX_GRAPH_MAX_AGE, filter_tx_graph, tx_graphs
+from write_behind import write_behind
+from transfer_store import TRANSFER_STORE_ENABLED, transfer_store
+from metadata_worker import metadata_worker
+from price_utils import PRICE_BACKFILL_ENABLED, price_matrix, price_states, run_price_backfill
+from trace_utils import trace_account_flows
+from stream_utils import ndjson_lines, stream_account_flows_network, stream_tx_flows_network
+from metrics_utils import instrument_connection, registry, request_seconds, sampled_debug, start_request_spans
+from response_utils import CompressionMiddleware, FastJSONResponse, graph_response
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -18,26 +37,85 @@ logger = logging.getLogger(__name__)
 from dotenv import load_dotenv
 load_dotenv()
 
-rpc_url = "https://mainnet.helius-rpc.com/?api-key=" + os.getenv("HELIUS_API_KEY")     
+rpc_url = os.getenv("HELIUS_RPC_URL") or "https://mainnet.helius-rpc.com/?api-key=" + os.getenv("HELIUS_API_KEY")
 
 db_pool = None
+http_session = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Database connection pool setup
-    global db_pool
+    # Database connection pool and shared HTTP client setup
+    global db_pool, http_session
+    backfill_task = None
     try:
-        db_pool = await asyncpg.create_pool(
-            os.getenv("DATABASE_URL")
-        )
+        db_pool = await create_db_pool(init=instrument_connection)
+        write_behind.start(db_pool)
         logger.info("Database connection pool created")
+        http_session = create_http_session()
+        logger.info("HTTP client session created")
+        await metadata_worker.start(db_pool, http_session)
+        await graph_sessions.start(db_pool)
+        if TRANSFER_STORE_ENABLED:
+            await transfer_store.ensure_schema(db_pool)
+        if PRICE_BACKFILL_ENABLED:
+            backfill_task = asyncio.create_task(run_price_backfill(db_pool, http_session))
         yield
     finally:
+        if backfill_task:
+            backfill_task.cancel()
+            await asyncio.gather(backfill_task, return_exceptions=True)
+        await metadata_worker.stop()
+        await transfer_store.stop()
+        await graph_sessions.stop()
+        await write_behind.stop()
+        await tx_store.flush()
+        await tx_graphs.flush()
+        if http_session:
+            await http_session.close()
+            logger.info("HTTP client session closed")
         if db_pool:
             await db_pool.close()
             logger.info("Database connection pool closed")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+@app.middleware("http")
+async def record_request_timing(request, call_next):
+    spans = start_request_spans()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    path = route.path if route else "unmatched"
+    request_seconds.observe(elapsed, method=request.method, route=path, status=response.status_code)
+    # Streaming bodies are still being produced here, so their serialization shows up in /metrics only
+    timings = [f"{name};dur={duration * 1000:.1f}" for name, duration in spans.items()]
+    response.headers["Server-Timing"] = ", ".join(timings + [f"total;dur={elapsed * 1000:.1f}"])
+    logger.info(json.dumps({
+        "event": "request",
+        "method": request.method,
+        "route": path,
+        "status": response.status_code,
+        "ms": round(elapsed * 1000, 1),
+        "stages": {name: round(duration * 1000, 1) for name, duration in spans.items()},
+    }))
+    return response
+
+# Existing stats() dicts, exposed as gauges on /metrics
+registry.register_stats("cache", "cache", cache_stats)
+registry.register_stats("rate_limit", "upstream", lambda: upstream_stats()["rate_limits"])
+registry.register_stats("component", "component", lambda: {
+    "coalescing": upstream_stats()["coalescing"],
+    "transactions": tx_store.stats(),
+    "price_matrix": price_matrix.stats(),
+    "prices": price_states.stats(),
+    "metadata_worker": metadata_worker.stats(),
+    "account_transfers": transfer_store.stats(),
+    "graph_sessions": graph_sessions.stats(),
+    "tx_graphs": tx_graphs.stats(),
+})
+registry.register_stats("db_pool", "pool", lambda: {"postgres": db_pool.stats()} if db_pool else {})
+registry.register_stats("write_behind", "table", write_behind.stats)
 
 # Add CORS middleware
 app.add_middleware(
@@ -47,28 +125,164 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+class BloomFilterData(BaseModel):
+    bits: str
+    hashes: int
 
 class ExistingNetworkData(BaseModel):
+    # Either the full ID lists, Bloom filters over them, or a server-side session (or a mix).
+    # Node IDs are pubkeys. Edge IDs are `${txId}-${source}-${target}-${mint}-${amount}` built from
+    # the edges as returned (SOL mint, whole-unit amount as String(amount) formats it); see graph_utils.edge_key.
     existingNodes: list[str] = []
     existingEdges: list[str] = []
+    nodeFilter: BloomFilterData | None = None
+    edgeFilter: BloomFilterData | None = None
+    sessionId: str | None = None
+    sessionVersion: int | None = None
+
+MAX_BATCH_SIGNATURES = int(os.getenv("MAX_BATCH_SIGNATURES", "200"))
+
+class TransactionBatchRequest(ExistingNetworkData):
+    signatures: list[str]
+
+async def resolve_existing_network(data: ExistingNetworkData) -> tuple[IdUnion, IdUnion, GraphSession | None]:
+    node_sets = [set(data.existingNodes)]
+    edge_sets = [set(data.existingEdges)]
+    try:
+        if data.nodeFilter:
+            node_sets.append(BloomFilter.from_base64(data.nodeFilter.bits, data.nodeFilter.hashes))
+        if data.edgeFilter:
+            edge_sets.append(BloomFilter.from_base64(data.edgeFilter.bits, data.edgeFilter.hashes))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    session = None
+    if data.sessionId:
+        session = await graph_sessions.get_or_create(data.sessionId)
+        if data.sessionVersion is not None and data.sessionVersion != session.version:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Session version mismatch: client has {data.sessionVersion}, server has {session.version}"
+            )
+        # Lists sent alongside a session id (re)seed it
+        session.seed(node_sets[0], edge_sets[0])
+        node_sets = [session.node_pubkeys] + node_sets[1:]
+        edge_sets = [session.edge_ids] + edge_sets[1:]
+
+    return IdUnion(*node_sets), IdUnion(*edge_sets), session
+
+def record_session(network_data: dict, session: GraphSession | None):
+    # With a session the response is only the delta: nodes the session already holds are dropped
+    if session:
+        network_data["nodes"] = session.delta(network_data["nodes"])
+        version = graph_sessions.record(session, network_data["nodes"], network_data["edges"])
+        network_data["session"] = {"id": session.id, "version": version}
+
+async def record_streamed_session(events, session: GraphSession | None):
+    # Records the fully enriched graph once the stream finishes without error
+    structure = None
+    failed = False
+    async for event in events:
+        if event["type"] == "structure":
+            if session:
+                event = {**event, "nodes": session.delta(event["nodes"])}
+            structure = event
+        elif event["type"] == "error":
+            failed = True
+        elif event["type"] == "done" and session and structure and not failed:
+            network_data = {"nodes": structure["nodes"], "edges": structure["edges"]}
+            record_session(network_data, session)
+            yield {"type": "session", **network_data["session"]}
+        yield event
+
+async def fetch_account_flows_page(
+    account_address: str,
+    pool: DatabasePool,
+    session: aiohttp.ClientSession,
+    direction: str,
+    sort: str,
+    limit: int,
+    page: int,
+    cursor: str | None
+):
+    # Cursor pagination (also used for the first page); page > 1 without a cursor is the legacy path
+    if cursor is None and page > 1:
+        flows_data = await transfer_store.account_flows(
+            account_address,
+            db_pool=pool,
+            session=session,
+            direction=direction,
+            sort=sort,
+            limit=limit,
+            page=page
+        )
+        return flows_data, None, None
+    try:
+        flows_data, next_cursor = await transfer_store.account_flows_page(
+            account_address,
+            db_pool=pool,
+            session=session,
+            rpc_url=rpc_url,
+            direction=direction,
+            sort=sort,
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return flows_data, next_cursor is not None, next_cursor
 
-async def get_db():
+async def get_db_pool():
     if not db_pool:
         raise HTTPException(status_code=500, detail="Database connection pool not initialized")
-    
-    conn = await db_pool.acquire()
-    try:
-        yield conn
-    finally:
-        await db_pool.release(conn)
+    return db_pool
+
+async def get_http_session():
+    if not http_session:
+        raise HTTPException(status_code=500, detail="HTTP client session not initialized")
+    return http_session
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    return {
+        **cache_stats(),
+        "transactions": tx_store.stats(),
+        "price_matrix": price_matrix.stats(),
+        "prices": price_states.stats(),
+        "metadata_worker": metadata_worker.stats(),
+        "account_transfers": transfer_store.stats(),
+        "graph_sessions": graph_sessions.stats(),
+        "db_pool": db_pool.stats() if db_pool else {},
+        "write_behind": write_behind.stats(),
+        "tx_graphs": tx_graphs.stats(),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/upstream_stats")
+async def get_upstream_stats():
+    return upstream_stats()
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str, since: int = Query(default=0)):
+    # Whole accumulated graph in one round trip, or only what was added after version `since`
+    session = await graph_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return session.snapshot(since)
 
 @app.get("/account/{account_address}")
 async def get_account(
     account_address: str,
-    db: asyncpg.Connection = Depends(get_db)
+    db: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
 ):
     try:
-        return await fetch_account_metadata(account_address, db=db)
+        return await fetch_account_metadata(account_address, db=db, session=session)
     except HTTPException as he:
         logger.error(f"HTTP Exception: {str(he.detail)}")
         raise
@@ -76,34 +290,68 @@ async def get_account(
         logger.error(f"Unexpected error processing account: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def get_tx_graph(tx_signature: str, db: DatabasePool, session: aiohttp.ClientSession) -> dict:
+    # Cached enriched graph, built (once, for concurrent callers) on a miss
+    entry = await tx_graphs.get(tx_signature)
+    if entry is None:
+        logger.info(f"Fetching transaction data for signature: {tx_signature}")
+        tx_data = await fetch_transaction(tx_signature, session=session)
+        logger.info("Building network data from transaction")
+        entry = await tx_graphs.build(tx_signature, tx_data, rpc_url, db=db, session=session)
+    return entry
+
+@app.get("/transaction_flows/{tx_signature}")
+async def get_transaction_graph(
+    tx_signature: str,
+    request: Request,
+    compact: bool = Query(default=False),
+    db: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
+):
+    # Unfiltered graph for browser/CDN caching; a matching If-None-Match gets a 304
+    try:
+        entry = await get_tx_graph(tx_signature, db, session)
+        # Each wire format is its own representation
+        etag = entry["etag"][:-1] + '-compact"' if compact else entry["etag"]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={TX_GRAPH_MAX_AGE}" if entry["complete"] else "no-cache",
+        }
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        if not entry["graph"]["edges"]:
+            raise HTTPException(status_code=404, detail="No valid transfers found in this transaction")
+        return graph_response(entry["graph"], compact, headers=headers)
+    except HTTPException as he:
+        logger.error(f"HTTP Exception: {str(he.detail)}")
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error processing transaction: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 @app.post("/transaction_flows/{tx_signature}")
 async def get_transaction_flows(
     tx_signature: str,
     existing_network_data: ExistingNetworkData,
-    db: asyncpg.Connection = Depends(get_db)
+    compact: bool = Query(default=False),
+    db: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
 ):
     try:
-        logger.info(f"Fetching transaction data for signature: {tx_signature}")
-        tx_data = await fetch_transaction(tx_signature)
-        
-        logger.info("Building network data from transaction")
-        network_data = await build_tx_flows_network(
-            tx_data,
-            rpc_url,
-            db=db,
-            existing_node_pubkeys=existing_network_data.existingNodes,
-            existing_edge_ids=existing_network_data.existingEdges
-        )
-        
-        if not network_data["edges"]:
+        existing_nodes, existing_edges, session_graph = await resolve_existing_network(existing_network_data)
+        entry = await get_tx_graph(tx_signature, db, session)
+        # A transaction the client already has is an empty delta, not a 404
+        if not entry["graph"]["edges"]:
             logger.warning(f"No valid transfers found in transaction: {tx_signature}")
             raise HTTPException(
                 status_code=404,
                 detail="No valid transfers found in this transaction"
             )
-        
+        network_data = filter_tx_graph(entry["graph"], existing_nodes, existing_edges)
+
+        record_session(network_data, session_graph)
         logger.info(f"Successfully processed transaction with {len(network_data['edges'])} transfers")
-        return network_data
+        return graph_response(network_data, compact)
     except HTTPException as he:
         logger.error(f"HTTP Exception: {str(he.detail)}")
         raise
@@ -119,41 +367,208 @@ async def get_account_flows(
     sort: str = Query(default="asc"),
     limit: int = Query(default=100),
     page: int = Query(default=1),
-    db: asyncpg.Connection = Depends(get_db)
+    cursor: str | None = Query(default=None),
+    aggregate: bool = Query(default=False),
+    tx_ids: bool = Query(default=False),
+    compact: bool = Query(default=False),
+    pool: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
 ):
+    # aggregate=true returns one edge per (source, target, mint); tx_ids=true adds each edge's txIds
     try:
-        print('existing_network_data', existing_network_data)
-        flows_data = await fetch_account_flows(
-            account_address,
-            direction=direction,
-            sort=sort,
-            limit=limit,
-            page=page
+        existing_nodes, existing_edges, session_graph = await resolve_existing_network(existing_network_data)
+        flows_data, has_more, next_cursor = await fetch_account_flows_page(
+            account_address, pool, session, direction, sort, limit, page, cursor
         )
-        print('flows_data', flows_data)
+        sampled_debug(logger, "flows_data %s", flows_data)
         logger.info("Building network data from flows")
         network_data = await build_account_flows_network(
             flows_data,
             rpc_url=rpc_url,
-            db=db,
+            db=pool,
+            session=session,
             limit=limit,
-            existing_node_pubkeys=existing_network_data.existingNodes,
-            existing_edge_ids=existing_network_data.existingEdges
+            existing_node_pubkeys=existing_nodes,
+            existing_edge_ids=existing_edges,
+            has_more=has_more
         )
-        print('network_data', network_data)
+        network_data["nextCursor"] = next_cursor
+        if aggregate:
+            if session_graph:
+                # The session still tracks the individual transfers so later pages skip them
+                session_graph.seed((), (edge_key(edge) for edge in network_data["edges"]))
+            network_data["edges"] = aggregate_edges(network_data["edges"], include_tx_ids=tx_ids)
+        sampled_debug(logger, "network_data %s", network_data)
 
-        if not network_data["edges"]:
+        # Checked on the page itself: a page the client already holds entirely is an empty delta, not a 404
+        if not flows_data:
             logger.warning(f"No valid flows found for account: {account_address}")
             raise HTTPException(
                 status_code=404,
                 detail="No valid flows found for this account"
             )
         
+        record_session(network_data, session_graph)
         logger.info(f"Successfully processed inflows for account: {account_address}")
-        return network_data
+        return graph_response(network_data, compact)
     except HTTPException as he:
         logger.error(f"HTTP Exception: {str(he.detail)}")
         raise
     except Exception as e:
         logger.error(f"Unexpected error processing transaction: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@app.post("/trace/{account_address}")
+async def trace_account(
+    account_address: str,
+    existing_network_data: ExistingNetworkData,
+    direction: str = Query(default="out"),
+    sort: str = Query(default="desc"),
+    hops: int = Query(default=2, ge=1, le=5),
+    fan_out: int = Query(default=10, ge=1, le=50),
+    min_value: float = Query(default=0.0, ge=0),
+    limit: int = Query(default=100, ge=1, le=100),
+    compact: bool = Query(default=False),
+    pool: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
+):
+    try:
+        existing_nodes, existing_edges, session_graph = await resolve_existing_network(existing_network_data)
+        logger.info(f"Tracing {direction} flows for {account_address}: {hops} hops, fan-out {fan_out}")
+        network_data = await trace_account_flows(
+            account_address,
+            rpc_url=rpc_url,
+            db_pool=pool,
+            session=session,
+            direction=direction,
+            sort=sort,
+            hops=hops,
+            fan_out=fan_out,
+            min_value=min_value,
+            limit=limit,
+            existing_node_pubkeys=existing_nodes,
+            existing_edge_ids=existing_edges
+        )
+
+        # Known edges are dropped during the walk, so check what upstream returned instead
+        if not any(hop["transfers"] for hop in network_data["hops"]):
+            logger.warning(f"No valid flows found tracing account: {account_address}")
+            raise HTTPException(
+                status_code=404,
+                detail="No valid flows found for this account"
+            )
+
+        record_session(network_data, session_graph)
+        logger.info(f"Traced {len(network_data['edges'])} flows from account: {account_address}")
+        return graph_response(network_data, compact)
+    except HTTPException as he:
+        logger.error(f"HTTP Exception: {str(he.detail)}")
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error tracing account: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@app.post("/transaction_flows/{tx_signature}/stream")
+async def stream_transaction_flows(
+    tx_signature: str,
+    existing_network_data: ExistingNetworkData,
+    pool: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
+):
+    started_at = time.perf_counter()
+    existing_nodes, existing_edges, session_graph = await resolve_existing_network(existing_network_data)
+    logger.info(f"Fetching transaction data for signature: {tx_signature}")
+    tx_data = await fetch_transaction(tx_signature, session=session)
+
+    events = stream_tx_flows_network(
+        tx_data,
+        rpc_url,
+        started_at,
+        db=pool,
+        session=session,
+        existing_node_pubkeys=existing_nodes,
+        existing_edge_ids=existing_edges
+    )
+
+    return StreamingResponse(
+        ndjson_lines(record_streamed_session(events, session_graph)),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/account_flows/{account_address}/stream")
+async def stream_account_flows(
+    account_address: str,
+    existing_network_data: ExistingNetworkData,
+    direction: str = Query(default="in"),
+    sort: str = Query(default="asc"),
+    limit: int = Query(default=100),
+    page: int = Query(default=1),
+    cursor: str | None = Query(default=None),
+    pool: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
+):
+    started_at = time.perf_counter()
+    existing_nodes, existing_edges, session_graph = await resolve_existing_network(existing_network_data)
+    flows_data, has_more, next_cursor = await fetch_account_flows_page(
+        account_address, pool, session, direction, sort, limit, page, cursor
+    )
+
+    events = stream_account_flows_network(
+        flows_data,
+        rpc_url,
+        started_at,
+        db=pool,
+        session=session,
+        limit=limit,
+        existing_node_pubkeys=existing_nodes,
+        existing_edge_ids=existing_edges,
+        has_more=has_more,
+        next_cursor=next_cursor
+    )
+
+    return StreamingResponse(
+        ndjson_lines(record_streamed_session(events, session_graph)),
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/transactions/flows")
+async def get_transactions_flows(
+    batch_request: TransactionBatchRequest,
+    compact: bool = Query(default=False),
+    db: DatabasePool = Depends(get_db_pool),
+    session: aiohttp.ClientSession = Depends(get_http_session)
+):
+    try:
+        tx_signatures = list(dict.fromkeys(batch_request.signatures))
+        if not tx_signatures:
+            raise HTTPException(status_code=400, detail="No signatures provided")
+        if len(tx_signatures) > MAX_BATCH_SIGNATURES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIGNATURES} signatures per request")
+
+        existing_nodes, existing_edges, session_graph = await resolve_existing_network(batch_request)
+        logger.info(f"Fetching {len(tx_signatures)} transactions")
+        transactions, fetch_errors = await fetch_transactions(tx_signatures, session=session)
+
+        logger.info("Building network data from transactions")
+        network_data = await build_batch_tx_flows_network(
+            transactions,
+            rpc_url,
+            db=db,
+            session=session,
+            existing_node_pubkeys=existing_nodes,
+            existing_edge_ids=existing_edges
+        )
+        network_data["errors"].update(fetch_errors)
+
+        record_session(network_data, session_graph)
+        logger.info(
+            f"Processed {len(tx_signatures) - len(network_data['errors'])}/{len(tx_signatures)} transactions "
+            f"with {len(network_data['edges'])} transfers"
+        )
+        return graph_response(network_data, compact)
+    except HTTPException as he:
+        logger.error(f"HTTP Exception: {str(he.detail)}")
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error processing transaction batch: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -0,0 +1,157 @@
+# Background prefetch and refresh of Solscan account labels into the accounts table
+import asyncio
+import itertools
+import logging
+import os
+from typing import Any, Dict, Iterable
+import aiohttp
+
+from cache_utils import ACCOUNT_FAILURE_TTL, UNRESOLVED_ACCOUNT, accounts_cache
+from db_utils import DatabasePool
+from solana_utils import account_row_from_solscan, fetch_solscan_account_metadata, upsert_accounts
+
+logger = logging.getLogger(__name__)
+
+METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "2"))
+METADATA_BATCH_SIZE = int(os.getenv("METADATA_BATCH_SIZE", "20"))
+METADATA_QUEUE_MAX = int(os.getenv("METADATA_QUEUE_MAX", "50000"))
+METADATA_REFRESH_ENABLED = os.getenv("METADATA_REFRESH_ENABLED", "true").lower() == "true"
+METADATA_REFRESH_INTERVAL = float(os.getenv("METADATA_REFRESH_INTERVAL", "600"))
+METADATA_REFRESH_BATCH = int(os.getenv("METADATA_REFRESH_BATCH", "500"))
+METADATA_STALE_AFTER_DAYS = int(os.getenv("METADATA_STALE_AFTER_DAYS", "7"))
+
+# Lower runs first: accounts in graphs just returned to a user beat scheduled refreshes
+PRIORITY_DISCOVERED = 0
+PRIORITY_REFRESH = 1
+
+class AccountMetadataWorker:
+    """In-process priority queue of pubkeys whose labels should be (re)fetched.
+
+    Request handlers only read the accounts table and enqueue what they could
+    not find. Workers drain the queue through the shared Solscan limiter, so
+    prefetching and refreshing stay within the same rate budget as everything
+    else, and refreshes only use capacity left over by discovered accounts.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.PriorityQueue = None
+        self._queued: Dict[str, int] = {}
+        self._order = itertools.count()
+        self._tasks: list[asyncio.Task] = []
+        self.enqueued = 0
+        self.dropped = 0
+        self.fetched = 0
+        self.failed = 0
+        self.refresh_scans = 0
+
+    def enqueue(self, pubkeys: Iterable[str], priority: int = PRIORITY_DISCOVERED):
+        if self._queue is None:
+            return
+        for pubkey in pubkeys:
+            queued_priority = self._queued.get(pubkey)
+            if queued_priority is not None and queued_priority <= priority:
+                continue
+            if self._queue.qsize() >= METADATA_QUEUE_MAX:
+                self.dropped += 1
+                continue
+            # A re-prioritised pubkey leaves a stale entry behind; workers skip it
+            self._queued[pubkey] = priority
+            self._queue.put_nowait((priority, next(self._order), pubkey))
+            self.enqueued += 1
+
+    async def _next_batch(self) -> list[str]:
+        batch = []
+        while len(batch) < METADATA_BATCH_SIZE:
+            if batch and self._queue.empty():
+                break
+            priority, _, pubkey = self._queue.get_nowait() if batch else await self._queue.get()
+            if self._queued.get(pubkey) == priority:
+                del self._queued[pubkey]
+                batch.append(pubkey)
+        return batch
+
+    async def _process(self, db_pool: DatabasePool, session: aiohttp.ClientSession, pubkeys: list[str]):
+        responses = await asyncio.gather(
+            *(fetch_solscan_account_metadata(pubkey, session) for pubkey in pubkeys),
+            return_exceptions=True
+        )
+        rows = {}
+        for pubkey, data in zip(pubkeys, responses):
+            if isinstance(data, Exception) or data is None:
+                logger.debug(f"Metadata fetch failed for {pubkey}: {data}")
+                self.failed += 1
+                # Graphs show it blank until ACCOUNT_FAILURE_TTL passes instead of re-queueing it every time
+                accounts_cache.set(pubkey, UNRESOLVED_ACCOUNT, negative=True, ttl=ACCOUNT_FAILURE_TTL)
+                continue
+            rows[pubkey] = account_row_from_solscan(data)
+        if rows:
+            upsert_accounts(rows)
+            self.fetched += len(rows)
+
+    async def _work(self, db_pool: DatabasePool, session: aiohttp.ClientSession):
+        while True:
+            pubkeys = await self._next_batch()
+            try:
+                await self._process(db_pool, session, pubkeys)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += len(pubkeys)
+                logger.error(f"Metadata worker batch failed: {str(e)}", exc_info=True)
+
+    async def _refresh(self, db_pool: DatabasePool):
+        # Re-queue the oldest rows (never-refreshed ones first) once they go stale
+        while True:
+            try:
+                async with db_pool.acquire() as db:
+                    results = await db.fetch(
+                        """
+                        SELECT pubkey
+                        FROM accounts
+                        WHERE refreshed_at IS NULL
+                           OR refreshed_at < now() - make_interval(days => $1)
+                        ORDER BY refreshed_at NULLS FIRST
+                        LIMIT $2
+                        """,
+                        METADATA_STALE_AFTER_DAYS, METADATA_REFRESH_BATCH
+                    )
+                self.enqueue((result['pubkey'] for result in results), PRIORITY_REFRESH)
+                self.refresh_scans += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Metadata refresh scan failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(METADATA_REFRESH_INTERVAL)
+
+    async def start(self, db_pool: DatabasePool, session: aiohttp.ClientSession):
+        try:
+            async with db_pool.acquire() as db:
+                await db.execute("ALTER TABLE accounts ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMPTZ")
+        except Exception as e:
+            logger.error(f"Could not add accounts.refreshed_at: {str(e)}")
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._work(db_pool, session)) for _ in range(METADATA_WORKERS)]
+        if METADATA_REFRESH_ENABLED:
+            self._tasks.append(asyncio.create_task(self._refresh(db_pool)))
+        logger.info(f"Account metadata worker started with {METADATA_WORKERS} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._tasks),
+            "queued": len(self._queued),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "refresh_scans": self.refresh_scans,
+        }
+
+metadata_worker = AccountMetadataWorker()
@@ -0,0 +1,218 @@
+# Prometheus text-format metrics, per-request stage timing and sampled debug logging
+from contextlib import contextmanager
+import contextvars
+import functools
+import inspect
+import logging
+import math
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+METRICS_PREFIX = "solana_forensics"
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_SAMPLE_RATE", "0.01"))
+DEBUG_PAYLOAD_CHARS = int(os.getenv("DEBUG_PAYLOAD_CHARS", "2000"))
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[tuple, list[int]] = {}
+        self._sums: Dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self._sums[key] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(self._sums[key])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Registry:
+    """Metrics owned by this process plus collectors that turn existing stats() dicts into gauges."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._metrics: list = []
+        self._collectors: list[Tuple[str, str, Callable[[], Dict[str, Any]]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, name: str, label: str, stats: Callable[[], Dict[str, Any]]):
+        # stats() returns {key: {field: number}}; each field becomes gauge <prefix>_<name>_<field>{<label>=key}
+        self._collectors.append((name, label, stats))
+
+    def _render_stats(self) -> list[str]:
+        gauges: Dict[str, list[str]] = {}
+        for name, label, stats in self._collectors:
+            for key, fields in stats().items():
+                for field, value in fields.items():
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if not isinstance(value, (int, float)):
+                        continue
+                    metric = f"{self.prefix}_{name}_{field}"
+                    gauges.setdefault(metric, []).append(f'{metric}{{{label}="{_escape(key)}"}} {_number(value)}')
+        lines = []
+        for metric, samples in gauges.items():
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(samples)
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(self._render_stats())
+        return "\n".join(lines) + "\n"
+
+registry = Registry(METRICS_PREFIX)
+
+request_seconds = registry.histogram(
+    "request_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+stage_seconds = registry.histogram(
+    "stage_seconds", "Time spent in each request stage", ["stage"]
+)
+upstream_requests = registry.counter(
+    "upstream_requests_total", "Upstream HTTP attempts by upstream and status", ["upstream", "status"]
+)
+upstream_seconds = registry.histogram(
+    "upstream_request_seconds", "Upstream HTTP attempt latency", ["upstream"]
+)
+db_query_seconds = registry.histogram(
+    "db_query_seconds", "Postgres query latency by statement type", ["operation"]
+)
+
+# Stage durations of the current request, summed when a stage runs several times or concurrently
+_request_spans: contextvars.ContextVar = contextvars.ContextVar("request_spans", default=None)
+
+def start_request_spans() -> Dict[str, float]:
+    spans: Dict[str, float] = {}
+    _request_spans.set(spans)
+    return spans
+
+def record_span(name: str, elapsed: float):
+    spans = _request_spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + elapsed
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=name)
+        record_span(name, elapsed)
+
+def timed(name: str):
+    # Decorator form of stage() for sync and async functions
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def observe_upstream(upstream: str, status: Any, elapsed: float):
+    upstream_requests.inc(upstream=upstream, status=status)
+    upstream_seconds.observe(elapsed, upstream=upstream)
+    record_span("upstream", elapsed)
+
+def observe_query(record):
+    # asyncpg query logger callback (Connection.add_query_logger)
+    operation = record.query.split(None, 1)[0].upper() if record.query.strip() else "UNKNOWN"
+    db_query_seconds.observe(record.elapsed, operation=operation)
+    record_span("db", record.elapsed)
+
+async def instrument_connection(conn):
+    # asyncpg.create_pool(init=...) hook
+    conn.add_query_logger(observe_query)
+
+class _Truncated:
+    # Defers repr() of a payload until the log record is actually formatted
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        text = repr(self.value)
+        if len(text) > DEBUG_PAYLOAD_CHARS:
+            return f"{text[:DEBUG_PAYLOAD_CHARS]}... ({len(text)} chars)"
+        return text
+
+def sampled_debug(logger: logging.Logger, message: str, *payloads: Any):
+    """Log payload dumps at DEBUG for a DEBUG_SAMPLE_RATE fraction of calls, truncated.
+
+    Costs one level check when DEBUG is off, so it is safe on the hot path.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_SAMPLE_RATE:
+        logger.debug(message, *(_Truncated(payload) for payload in payloads))
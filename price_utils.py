@@ -0,0 +1,307 @@
+# In-memory daily price matrix for hot mints, filled by a background backfill job
+import asyncio
+from array import array
+from datetime import date, datetime
+from functools import lru_cache
+import logging
+import math
+import os
+from typing import Any, Dict, Iterable
+import aiohttp
+
+from cache_utils import TTLCache
+from db_utils import DatabasePool, create_db_pool
+from http_utils import solscan_sync_limiter
+from solana_utils import fetch_solscan_price_range
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MATRIX_MINTS = ",".join([
+    "So11111111111111111111111111111111111111111",  # SOL
+    "So11111111111111111111111111111111111111112",  # wSOL
+    "EPjFWJd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v",  # USDC
+    "Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB",  # USDT
+    "JUPyiwrYJFskUPiHa7hkeR8VUtAeFoSYbKedZNsDvCN",   # JUP
+])
+PRICE_MATRIX_MINTS = [mint for mint in os.getenv("PRICE_MATRIX_MINTS", DEFAULT_MATRIX_MINTS).split(",") if mint]
+PRICE_MATRIX_START = os.getenv("PRICE_MATRIX_START", "20240101")
+PRICE_BACKFILL_ENABLED = os.getenv("PRICE_BACKFILL_ENABLED", "true").lower() == "true"
+PRICE_BACKFILL_INTERVAL = float(os.getenv("PRICE_BACKFILL_INTERVAL", "3600"))
+PRICE_BACKFILL_WINDOW_DAYS = int(os.getenv("PRICE_BACKFILL_WINDOW_DAYS", "30"))
+PRICE_STATE_CACHE_SIZE = int(os.getenv("PRICE_STATE_CACHE_SIZE", "100000"))
+# Solscan has no price for a settled day: re-check rarely
+PRICE_MISSING_TTL = float(os.getenv("PRICE_MISSING_TTL", "86400"))
+# No price yet for today or yesterday: it may still be published
+PRICE_PENDING_TTL = float(os.getenv("PRICE_PENDING_TTL", "600"))
+PRICE_PENDING_DAYS = int(os.getenv("PRICE_PENDING_DAYS", "1"))
+# Upstream failed: back off briefly, never persisted
+PRICE_ERROR_TTL = float(os.getenv("PRICE_ERROR_TTL", "30"))
+
+NAN = float("nan")
+
+@lru_cache(maxsize=4096)
+def day_ordinal(day: str) -> int:
+    return datetime.strptime(day, '%Y%m%d').date().toordinal()
+
+def day_string(ordinal: int) -> str:
+    return date.fromordinal(ordinal).strftime('%Y%m%d')
+
+class PriceMatrix:
+    """Dense float64 rows of daily prices, one per tracked mint.
+
+    Row i holds the prices of the i-th tracked mint; column j is the day
+    start_day + j. Unknown prices are NaN. Only tracked mints are stored, so
+    lookups for anything else fall through to Postgres and Solscan.
+    """
+
+    def __init__(self, start_day: str):
+        self.start_ordinal = day_ordinal(start_day)
+        self.num_days = 0
+        self.mint_index: Dict[str, int] = {}
+        self.rows: list[array] = []
+        # Cells only go from NaN to a price, so this is kept as a counter instead of scanning rows
+        self.known = 0
+        self.hits = 0
+        self.misses = 0
+
+    def track(self, mints: Iterable[str]):
+        for mint in mints:
+            if mint not in self.mint_index:
+                self.mint_index[mint] = len(self.rows)
+                self.rows.append(array('d', [NAN]) * self.num_days)
+
+    def ensure_days(self, end_day: str):
+        num_days = day_ordinal(end_day) - self.start_ordinal + 1
+        if num_days > self.num_days:
+            padding = array('d', [NAN]) * (num_days - self.num_days)
+            for row in self.rows:
+                row.extend(padding)
+            self.num_days = num_days
+
+    def _cell(self, mint: str, day: str):
+        row = self.mint_index.get(mint)
+        if row is None:
+            return None, None
+        column = day_ordinal(day) - self.start_ordinal
+        if not 0 <= column < self.num_days:
+            return None, None
+        return row, column
+
+    def peek(self, mint: str, day: str) -> float:
+        row, column = self._cell(mint, day)
+        if row is None:
+            return None
+        price = self.rows[row][column]
+        return None if math.isnan(price) else price
+
+    def set(self, mint: str, day: str, price: float):
+        row, column = self._cell(mint, day)
+        if row is not None and price is not None:
+            if math.isnan(self.rows[row][column]):
+                self.known += 1
+            self.rows[row][column] = price
+
+    def fill(self, prices_map: Dict[tuple, float], token_days) -> list[tuple]:
+        # Copies known prices into prices_map and returns the pairs still to resolve
+        remaining = []
+        for pair in token_days:
+            price = self.peek(*pair)
+            if price is None:
+                remaining.append(pair)
+                self.misses += 1
+            else:
+                prices_map[pair] = price
+                self.hits += 1
+        return remaining
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mints": len(self.rows),
+            "days": self.num_days,
+            "known_prices": self.known,
+            "bytes": len(self.rows) * self.num_days * 8,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+class PriceStates:
+    """Short-lived memory of (mint, day) pairs that have no price right now.
+
+    Only real prices are persisted to prices_daily. A pair Solscan answered
+    without a price is "missing" (long TTL for settled days, short TTL for
+    the last PRICE_PENDING_DAYS), a pair whose request failed is "error"
+    (very short TTL). Both resolve to None until they expire and are retried.
+    """
+
+    def __init__(self, maxsize: int):
+        self._states = TTLCache(maxsize=maxsize, ttl=PRICE_MISSING_TTL)
+        self.counters = {
+            "db_hits": 0,
+            "upstream_hits": 0,
+            "missing_hits": 0,
+            "error_hits": 0,
+            "missing_recorded": 0,
+            "pending_recorded": 0,
+            "errors_recorded": 0,
+        }
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def fill(self, prices_map: Dict[tuple, float], token_days) -> list[tuple]:
+        # Known-missing and recently failed pairs resolve to None without an upstream call
+        remaining = []
+        for pair in token_days:
+            state = self._states.get(pair)
+            if state is None:
+                remaining.append(pair)
+            else:
+                prices_map[pair] = None
+                self.count("missing_hits" if state == "missing" else "error_hits")
+        return remaining
+
+    def mark_missing(self, mint: str, day: str):
+        pending = day_ordinal(day) >= date.today().toordinal() - PRICE_PENDING_DAYS
+        self._states.set((mint, day), "missing", ttl=PRICE_PENDING_TTL if pending else PRICE_MISSING_TTL)
+        self.count("pending_recorded" if pending else "missing_recorded")
+
+    def known(self, mint: str, day: str) -> bool:
+        # Recorded as missing or failed and not expired yet
+        return self._states.peek((mint, day)) is not None
+
+    def settled(self, mint: str, day: str) -> bool:
+        # Known to have no price, and old enough that none is coming
+        return (
+            self._states.peek((mint, day)) == "missing"
+            and day_ordinal(day) < date.today().toordinal() - PRICE_PENDING_DAYS
+        )
+
+    def mark_error(self, mint: str, day: str):
+        self._states.set((mint, day), "error", ttl=PRICE_ERROR_TTL)
+        self.count("errors_recorded")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "size": len(self._states)}
+
+price_states = PriceStates(PRICE_STATE_CACHE_SIZE)
+
+price_matrix = PriceMatrix(PRICE_MATRIX_START)
+price_matrix.track(PRICE_MATRIX_MINTS)
+price_matrix.ensure_days(date.today().strftime('%Y%m%d'))
+
+def missing_ranges(mint: str, start_day: str, end_day: str) -> list[tuple[str, str]]:
+    """Runs of unknown days, split into windows of at most PRICE_BACKFILL_WINDOW_DAYS.
+
+    Days recorded in price_states (no price on Solscan, e.g. before a token
+    launched, or a recent failure) are skipped until their state expires.
+    """
+    ranges = []
+    run_start = None
+    end_ordinal = day_ordinal(end_day)
+    for ordinal in range(day_ordinal(start_day), end_ordinal + 2):
+        day = day_string(ordinal)
+        unknown = ordinal <= end_ordinal and price_matrix.peek(mint, day) is None and not price_states.known(mint, day)
+        if run_start is not None and (not unknown or ordinal - run_start == PRICE_BACKFILL_WINDOW_DAYS):
+            ranges.append((day_string(run_start), day_string(ordinal - 1)))
+            run_start = None
+        if unknown and run_start is None:
+            run_start = ordinal
+    return ranges
+
+async def backfill_prices(
+    db_pool: DatabasePool,
+    session: aiohttp.ClientSession,
+    mints: list[str] = PRICE_MATRIX_MINTS,
+    start_day: str = PRICE_MATRIX_START,
+    end_day: str = None
+) -> int:
+    """Load prices_daily into the matrix, then fetch the gaps from Solscan.
+
+    Returns the number of prices fetched from Solscan and written back.
+    """
+    end_day = end_day or date.today().strftime('%Y%m%d')
+    price_matrix.track(mints)
+    price_matrix.ensure_days(end_day)
+
+    async with db_pool.acquire() as db:
+        db_results = await db.fetch(
+            """
+            SELECT mint, day, price
+            FROM prices_daily
+            WHERE mint = ANY($1) AND day >= $2 AND day <= $3 AND price IS NOT NULL
+            """,
+            mints, start_day, end_day
+        )
+    for result in db_results:
+        price_matrix.set(result['mint'], result['day'], float(result['price']))
+
+    insert_values = []
+    for mint in mints:
+        for from_time, to_time in missing_ranges(mint, start_day, end_day):
+            days = [day_string(ordinal) for ordinal in range(day_ordinal(from_time), day_ordinal(to_time) + 1)]
+            try:
+                json_data = await fetch_solscan_price_range(mint, from_time, to_time, session, limiter=solscan_sync_limiter)
+            except Exception as e:
+                json_data = e
+            if isinstance(json_data, Exception) or json_data is None:
+                # Non-200 or failed request: retry after PRICE_ERROR_TTL instead of recording the days as missing
+                logger.warning(f"Price backfill failed for {mint} {from_time}-{to_time}: {json_data or 'non-200 response'}")
+                for day in days:
+                    price_states.mark_error(mint, day)
+                continue
+            for price_data in json_data.get('data') or []:
+                day = price_data.get('date')
+                price = price_data.get('price')
+                if day and price is not None:
+                    price_matrix.set(mint, str(day), float(price))
+                    insert_values.append((mint, str(day), float(price)))
+            for day in days:
+                if price_matrix.peek(mint, day) is None:
+                    price_states.mark_missing(mint, day)
+
+    if insert_values:
+        async with db_pool.acquire() as db:
+            await db.executemany(
+                """
+                INSERT INTO prices_daily (mint, day, price)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (mint, day) DO UPDATE SET price = EXCLUDED.price
+                WHERE prices_daily.price IS NULL
+                """,
+                insert_values
+            )
+    logger.info(f"Price backfill loaded {len(db_results)} stored and {len(insert_values)} fetched prices")
+    return len(insert_values)
+
+async def run_price_backfill(db_pool: DatabasePool, session: aiohttp.ClientSession):
+    # Background loop started from the app lifespan; new days are picked up each interval
+    while True:
+        try:
+            await backfill_prices(db_pool, session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Price backfill failed: {str(e)}", exc_info=True)
+        await asyncio.sleep(PRICE_BACKFILL_INTERVAL)
+
+async def main(start_day: str, end_day: str):
+    from dotenv import load_dotenv
+    from http_utils import create_http_session
+
+    load_dotenv()
+    db_pool = await create_db_pool()
+    session = create_http_session()
+    try:
+        fetched = await backfill_prices(db_pool, session, start_day=start_day, end_day=end_day)
+        print(f"Backfilled {fetched} prices for {len(PRICE_MATRIX_MINTS)} mints")
+    finally:
+        await session.close()
+        await db_pool.close()
+
+if __name__ == "__main__":
+    # Offline run: python price_utils.py [start YYYYMMDD] [end YYYYMMDD]
+    import sys
+    asyncio.run(main(
+        sys.argv[1] if len(sys.argv) > 1 else PRICE_MATRIX_START,
+        sys.argv[2] if len(sys.argv) > 2 else None
+    ))
@@ -0,0 +1,222 @@
+# Graph responses: orjson rendering, the compact columnar format and response compression
+import asyncio
+from decimal import Decimal
+import gzip
+import os
+from typing import Any, Dict
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics_utils import stage
+
+try:
+    import brotli
+except ImportError:  # listed in requirements; fall back to gzip where the wheel is missing
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# Bodies above this are compressed in a worker thread
+COMPRESSION_THREAD_SIZE = int(os.getenv("COMPRESSION_THREAD_SIZE", str(256 * 1024)))
+# NDJSON streams are left alone: compressing them would hold events back in the encoder
+COMPRESSIBLE_TYPES = ("application/json", "text/plain")
+
+COMPACT_FORMAT = "compact/v1"
+# Per-edge fields with their own place in the compact format; anything else becomes an extra column
+COMPACT_EDGE_FIELDS = {"source", "target", "mint", "amount", "ticker", "tokenImage"}
+
+def _default(value: Any) -> Any:
+    # Types jsonable_encoder used to handle that can show up in graph payloads
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(JSONResponse):
+    """orjson-rendered JSON, timed as the request's serialization stage.
+
+    Endpoints that return it directly also skip FastAPI's jsonable_encoder
+    pass, which otherwise walks every node and edge first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with stage("serialization"):
+            return dumps(content)
+
+def compact_graph(network_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Columnar form of a {"nodes", "edges", ...} response.
+
+    pubkeys is the index table; nodes[i] (without its pubkey) belongs to
+    pubkeys[i], and indices past len(nodes) are accounts only referenced by
+    edges (e.g. already known to the client). Edges are parallel arrays of
+    source/target/mint indices and amounts, mint index -1 meaning no mint.
+    ticker and tokenImage are sent once per mint in mintInfo. Other edge
+    fields become columns under edges, with None where an edge lacks them.
+    Remaining top-level keys (hasMore, nextCursor, session, ...) pass through.
+    """
+    nodes = network_data["nodes"]
+    edges = network_data["edges"]
+    pubkey_index = {node["pubkey"]: i for i, node in enumerate(nodes)}
+    pubkeys = list(pubkey_index)
+
+    def index_of(pubkey: str) -> int:
+        i = pubkey_index.get(pubkey)
+        if i is None:
+            i = pubkey_index[pubkey] = len(pubkeys)
+            pubkeys.append(pubkey)
+        return i
+
+    mint_index: Dict[str, int] = {}
+    mint_info = []
+    sources, targets, mints, amounts = [], [], [], []
+    extra: Dict[str, list] = {}
+    for position, edge in enumerate(edges):
+        sources.append(index_of(edge["source"]))
+        targets.append(index_of(edge["target"]))
+        amounts.append(edge.get("amount"))
+        mint = edge.get("mint")
+        if mint is None:
+            mints.append(-1)
+        else:
+            i = mint_index.get(mint)
+            if i is None:
+                i = mint_index[mint] = len(mint_info)
+                mint_info.append({"mint": mint, "ticker": edge.get("ticker"), "tokenImage": edge.get("tokenImage")})
+            mints.append(i)
+        for field, value in edge.items():
+            if field not in COMPACT_EDGE_FIELDS:
+                column = extra.get(field)
+                if column is None:
+                    column = extra[field] = [None] * position
+                column.append(value)
+        for column in extra.values():
+            if len(column) == position:
+                column.append(None)
+
+    compact = {key: value for key, value in network_data.items() if key not in ("nodes", "edges")}
+    compact.update({
+        "format": COMPACT_FORMAT,
+        "pubkeys": pubkeys,
+        "nodes": [{key: value for key, value in node.items() if key != "pubkey"} for node in nodes],
+        "mintInfo": mint_info,
+        "edges": {"source": sources, "target": targets, "mint": mints, "amount": amounts, **extra},
+    })
+    return compact
+
+def graph_response(network_data: Dict[str, Any], compact: bool = False, headers: Dict[str, str] = None) -> FastJSONResponse:
+    return FastJSONResponse(compact_graph(network_data) if compact else network_data, headers=headers)
+
+def _compress(encoding: str, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    # A strong ETag names one exact byte sequence, so each content coding gets its own
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+def decoded_etags(if_none_match: str, encoding: str) -> tuple[str, bool]:
+    # Maps "<etag>-<encoding>" tags a client got from this middleware back to the app's ETags
+    suffix = f'-{encoding}"'
+    tags = []
+    decoded = False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.endswith(suffix) and not tag.startswith("W/"):
+            tag = tag[:-len(suffix)] + '"'
+            decoded = True
+        tags.append(tag)
+    return ", ".join(tags), decoded
+
+class CompressionMiddleware:
+    """Brotli (when installed and accepted) or gzip for buffered JSON and text responses.
+
+    Compressed responses get an encoding-specific ETag ("<etag>-gzip",
+    "<etag>-br"). If-None-Match is translated back before it reaches the
+    app, so conditional requests keep matching, and a 304 answers with the
+    tag the client sent.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        not_modified_encoded = False
+        if "if-none-match" in request_headers:
+            if_none_match, not_modified_encoded = decoded_etags(request_headers["if-none-match"], encoding)
+            raw = [(key, value) for key, value in scope["headers"] if key != b"if-none-match"]
+            raw.append((b"if-none-match", if_none_match.encode("latin-1")))
+            scope = {**scope, "headers": raw}
+
+        start: Message = None
+        chunks: list[bytes] = []
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if message["status"] == 304:
+                    if not_modified_encoded and "etag" in headers:
+                        MutableHeaders(raw=message["headers"])["ETag"] = encoded_etag(headers["etag"], encoding)
+                    passthrough = True
+                    await send(message)
+                    return
+                media_type = headers.get("content-type", "").split(";")[0].strip()
+                if media_type not in COMPRESSIBLE_TYPES or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=start["headers"])
+            if len(body) >= COMPRESSION_MIN_SIZE:
+                if len(body) >= COMPRESSION_THREAD_SIZE:
+                    body = await asyncio.to_thread(_compress, encoding, body)
+                else:
+                    body = _compress(encoding, body)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,199 @@
+# Server-side investigation sessions: the accumulated graph, versioned, optionally persisted to Postgres
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict
+
+from cache_utils import TTLCache
+from db_utils import DatabasePool
+from graph_utils import edge_key
+
+logger = logging.getLogger(__name__)
+
+GRAPH_SESSION_PERSIST = os.getenv("GRAPH_SESSION_PERSIST", "false").lower() == "true"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS graph_sessions (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS graph_session_items (
+    session_id TEXT NOT NULL REFERENCES graph_sessions (id) ON DELETE CASCADE,
+    kind CHAR(1) NOT NULL,
+    key TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data JSONB NOT NULL,
+    PRIMARY KEY (session_id, kind, key)
+);
+"""
+
+class GraphSession:
+    """Nodes and edges a client has already been sent, keyed by pubkey / edge key.
+
+    Each stored item carries the version that added it, so a client can fetch
+    everything after the version it last saw. Ids seeded from client-supplied
+    lists only count as known; the server has no data for them.
+    """
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.version = 0
+        self.node_pubkeys: set = set()
+        self.edge_ids: set = set()
+        self.nodes: Dict[str, tuple[int, Dict[str, Any]]] = {}
+        self.edges: Dict[str, tuple[int, Dict[str, Any]]] = {}
+
+    def seed(self, node_pubkeys, edge_ids):
+        self.node_pubkeys.update(node_pubkeys)
+        self.edge_ids.update(edge_ids)
+
+    def delta(self, nodes: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+        # Known edges are already dropped by the builders (after enrichment); nodes come back whole
+        return [node for node in nodes if node["pubkey"] not in self.node_pubkeys]
+
+    def record(self, nodes: list[Dict[str, Any]], edges: list[Dict[str, Any]]) -> tuple[int, Dict[str, Any], Dict[str, Any]]:
+        # Returns the new version and the items it added
+        version = self.version + 1
+        new_nodes = {node["pubkey"]: node for node in nodes if node["pubkey"] not in self.node_pubkeys}
+        new_edges = {}
+        untracked_edges = {}
+        for index, edge in enumerate(edges):
+            if "txId" in edge:
+                key = edge_key(edge)
+                if key not in self.edge_ids:
+                    new_edges[key] = edge
+            else:
+                # Aggregated edges carry no txId; their transfers are seeded as known instead
+                untracked_edges[f"untracked-{version}-{index}"] = edge
+        for pubkey, node in new_nodes.items():
+            self.nodes[pubkey] = (version, node)
+        self.node_pubkeys.update(new_nodes)
+        self.edge_ids.update(new_edges)
+        new_edges.update(untracked_edges)
+        for key, edge in new_edges.items():
+            self.edges[key] = (version, edge)
+        self.version = version
+        return version, new_nodes, new_edges
+
+    def snapshot(self, since: int = 0) -> Dict[str, Any]:
+        return {
+            "session": {"id": self.id, "version": self.version},
+            "nodes": [node for version, node in self.nodes.values() if version > since],
+            "edges": [edge for version, edge in self.edges.values() if version > since],
+        }
+
+class GraphSessionStore:
+    def __init__(self, maxsize: int, ttl: float):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._db_pool: DatabasePool = None
+        self._writes: set[asyncio.Task] = set()
+        self.loaded = 0
+        self.persisted = 0
+        self.persist_failures = 0
+
+    async def start(self, db_pool: DatabasePool):
+        if not GRAPH_SESSION_PERSIST:
+            return
+        try:
+            async with db_pool.acquire() as db:
+                await db.execute(SCHEMA)
+            self._db_pool = db_pool
+            logger.info("Graph session persistence enabled")
+        except Exception as e:
+            logger.error(f"Could not create graph session tables, sessions stay in memory: {str(e)}")
+
+    async def _load(self, session_id: str) -> GraphSession | None:
+        async with self._db_pool.acquire() as db:
+            version = await db.fetchval("SELECT version FROM graph_sessions WHERE id = $1", session_id)
+            if version is None:
+                return None
+            rows = await db.fetch(
+                "SELECT kind, key, version, data FROM graph_session_items WHERE session_id = $1",
+                session_id
+            )
+        session = GraphSession(session_id)
+        session.version = version
+        for row in rows:
+            items = session.nodes if row['kind'] == 'n' else session.edges
+            items[row['key']] = (row['version'], json.loads(row['data']))
+        session.node_pubkeys.update(session.nodes)
+        session.edge_ids.update(key for key in session.edges if not key.startswith("untracked-"))
+        self.loaded += 1
+        return session
+
+    async def get(self, session_id: str) -> GraphSession | None:
+        session = self._sessions.get(session_id)
+        if session is None and self._db_pool:
+            try:
+                session = await self._load(session_id)
+            except Exception as e:
+                logger.error(f"Could not load graph session {session_id}: {str(e)}")
+        if session is not None:
+            # Re-setting refreshes the idle TTL on every use
+            self._sessions.set(session_id, session)
+        return session
+
+    async def get_or_create(self, session_id: str) -> GraphSession:
+        session = await self.get(session_id)
+        if session is None:
+            session = GraphSession(session_id)
+            self._sessions.set(session_id, session)
+        return session
+
+    async def _persist(self, session_id: str, version: int, nodes: Dict[str, Any], edges: Dict[str, Any]):
+        items = [(session_id, 'n', key, version, json.dumps(node)) for key, node in nodes.items()]
+        items += [(session_id, 'e', key, version, json.dumps(edge)) for key, edge in edges.items()]
+        try:
+            async with self._db_pool.acquire() as db:
+                async with db.transaction():
+                    await db.execute(
+                        """
+                        INSERT INTO graph_sessions (id, version) VALUES ($1, $2)
+                        ON CONFLICT (id) DO UPDATE
+                        SET version = GREATEST(graph_sessions.version, EXCLUDED.version), updated_at = now()
+                        """,
+                        session_id, version
+                    )
+                    if items:
+                        await db.executemany(
+                            """
+                            INSERT INTO graph_session_items (session_id, kind, key, version, data)
+                            VALUES ($1, $2, $3, $4, $5::jsonb)
+                            ON CONFLICT (session_id, kind, key) DO NOTHING
+                            """,
+                            items
+                        )
+            self.persisted += 1
+        except Exception as e:
+            self.persist_failures += 1
+            logger.error(f"Could not persist graph session {session_id}: {str(e)}")
+
+    def record(self, session: GraphSession, nodes: list[Dict[str, Any]], edges: list[Dict[str, Any]]) -> int:
+        version, new_nodes, new_edges = session.record(nodes, edges)
+        if self._db_pool:
+            # Written off the request path; the in-memory copy is authoritative while cached
+            task = asyncio.create_task(self._persist(session.id, version, new_nodes, new_edges))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+        return version
+
+    async def stop(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._sessions.stats(),
+            "persistent": self._db_pool is not None,
+            "loaded": self.loaded,
+            "persisted": self.persisted,
+            "persist_failures": self.persist_failures,
+            "pending_writes": len(self._writes),
+        }
+
+graph_sessions = GraphSessionStore(
+    maxsize=int(os.getenv("GRAPH_SESSIONS_MAX", "1000")),
+    ttl=float(os.getenv("GRAPH_SESSION_TTL", "21600")),
+)
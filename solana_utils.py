@@ -1,26 +1,99 @@
-import asyncpg
+import asyncio
 import os
 import aiohttp
-import json
 from typing import Dict, Any
 from fastapi import HTTPException
 import logging
 
+from cache_utils import accounts_cache, is_unlabeled
+from db_utils import DatabasePool
+from http_utils import UpstreamLimiter, helius_limiter, solscan_limiter, solscan_sync_limiter, upstream_flight
+from metrics_utils import sampled_debug, timed
+from tx_store import tx_store
+from write_behind import account_writes, write_behind
+
 logger = logging.getLogger(__name__)
 
-rpc_url = "https://mainnet.helius-rpc.com/?api-key=" + os.getenv("HELIUS_API_KEY")
+# HELIUS_RPC_URL / SOLSCAN_API_URL override the upstreams, e.g. with benchmarks/stub_upstream.py
+rpc_url = os.getenv("HELIUS_RPC_URL") or "https://mainnet.helius-rpc.com/?api-key=" + os.getenv("HELIUS_API_KEY")
+SOLSCAN_DEFAULT_URL = "https://pro-api.solscan.io/v2.0"
+TX_RPC_BATCH_SIZE = int(os.getenv("TX_RPC_BATCH_SIZE", "50"))
 # flipside = Flipside(api_key=os.getenv("FLIPSIDE_API_KEY"))
 
-async def fetch_account_metadata(account_address: str, db: asyncpg.Connection) -> Dict[str, Any]:
+def solscan_url(path: str) -> str:
+    return f"{os.getenv('SOLSCAN_API_URL', SOLSCAN_DEFAULT_URL)}/{path}"
+
+async def fetch_solscan_account_metadata(pubkey: str, session: aiohttp.ClientSession) -> Dict[str, Any]:
+    async def fetch():
+        url = solscan_url(f'account/metadata?address={pubkey}')
+        headers = {
+            'token': os.getenv('SOLSCAN_API_KEY')
+        }
+        async with solscan_limiter.request(session, "GET", url, headers=headers) as resp:
+            if resp.status != 200:
+                raise HTTPException(status_code=resp.status, detail="Failed to fetch account metadata")
+            json_data = await resp.json()
+            return json_data['data']
+
+    return await upstream_flight.do("account/metadata", pubkey, fetch)
+
+async def fetch_solscan_price_range(
+    token: str,
+    from_time: str,
+    to_time: str,
+    session: aiohttp.ClientSession,
+    limiter: UpstreamLimiter = solscan_limiter
+) -> Dict[str, Any]:
+    # Daily prices between two YYYYMMDD days inclusive, or None on a non-200 response
+    # (the price backfill passes solscan_sync_limiter so it stays off the interactive budget)
+    async def fetch():
+        url = solscan_url(f"token/price?address={token}&from_time={from_time}&to_time={to_time}")
+        headers = {'token': os.getenv('SOLSCAN_API_KEY')}
+        async with limiter.request(session, "GET", url, headers=headers) as resp:
+            if resp.status != 200:
+                return None
+            return await resp.json()
+
+    # Keyed by limiter too, so an interactive request never waits on a background-paced one
+    return await upstream_flight.do("token/price", (token, from_time, to_time, limiter.name), fetch)
+
+def account_row_from_solscan(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Solscan account metadata shaped like an accounts row (tags comma separated)
+    return {
+        'label': data.get('account_label', ''),
+        'tags': ','.join(data.get('account_tags', [])),
+        'type': data.get('account_type', ''),
+        'img_url': data.get('account_icon', '')
+    }
+
+def upsert_accounts(rows: Dict[str, Dict[str, Any]]):
+    # Cached now, written (with refreshed_at, so stale rows can be found later) by the write-behind flusher
+    for pubkey, row in rows.items():
+        accounts_cache.set(pubkey, row, negative=is_unlabeled(row))
+    write_behind.add(
+        account_writes,
+        ((pubkey, row['label'], row['tags'], row['type'], row['img_url']) for pubkey, row in rows.items())
+    )
+
+async def fetch_account_metadata(
+    account_address: str,
+    db: DatabasePool,
+    session: aiohttp.ClientSession
+) -> Dict[str, Any]:
     try:
-        db_result = await db.fetchrow(
-            """
-            SELECT label, tags, img_url, type
-            FROM accounts
-            WHERE pubkey = $1
-            """,
-            account_address
-        )
+        db_result = accounts_cache.get(account_address)
+        if db_result is None:
+            db_result = await db.fetchrow(
+                """
+                SELECT label, tags, img_url, type
+                FROM accounts
+                WHERE pubkey = $1
+                """,
+                account_address
+            )
+            if db_result:
+                row = dict(db_result)
+                accounts_cache.set(account_address, row, negative=is_unlabeled(row))
         if db_result:
             return {
                 'pubkey': account_address,
@@ -30,44 +103,30 @@ async def fetch_account_metadata(account_address: str, db: asyncpg.Connection) -
                 'img_url': db_result['img_url']
             }
         else:
-            url = f'https://pro-api.solscan.io/v2.0/account/metadata?address={account_address}'
-            headers = {
-                'token': os.getenv('SOLSCAN_API_KEY')
+            # Explicit lookup of an account the prefetch worker has not reached yet
+            data = await fetch_solscan_account_metadata(account_address, session)
+            row = account_row_from_solscan(data)
+            upsert_accounts({account_address: row})
+            return {
+                'pubkey': account_address,
+                'label': row['label'],
+                'tags': data.get('account_tags', []),
+                'type': row['type'],
+                'img_url': row['img_url']
             }
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as resp:
-                    if resp.status != 200:
-                        raise HTTPException(status_code=resp.status, detail="Failed to fetch account metadata")
-                    json_data = await resp.json()
-                    data = json_data['data']
-                    tags = data.get('account_tags', [])
-                    tags_str = ', '.join(tags)
-                    await db.execute(
-                        """
-                        INSERT INTO accounts (pubkey, label, tags, type, img_url)
-                        VALUES ($1, $2, $3, $4, $5)
-                        """,
-                        account_address,
-                        data.get('account_label', ''),
-                        tags_str,
-                        data.get('account_type', ''),
-                        data.get('account_icon', '')
-                    )
-                    return {
-                        'pubkey': account_address,
-                        'label': data.get('account_label', ''),
-                        'tags': tags,
-                        'type': data.get('account_type', ''),
-                        'img_url': data.get('account_icon', '')
-                    }
     except Exception as e:
         logger.error(f"Unexpected error fetching account metadata: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-async def fetch_transaction(tx_signature: str) -> Dict[str, Any]:
+@timed("upstream_fetch")
+async def fetch_transaction(tx_signature: str, session: aiohttp.ClientSession) -> Dict[str, Any]:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(rpc_url, json={
+        async def fetch():
+            stored = await tx_store.get(tx_signature)
+            if stored is not None:
+                return stored
+
+            async with helius_limiter.request(session, "POST", rpc_url, json={
                 "jsonrpc": "2.0",
                 "id": 1,
                 "method": "getTransaction",
@@ -82,22 +141,85 @@ async def fetch_transaction(tx_signature: str) -> Dict[str, Any]:
                 if resp.status != 200:
                     raise HTTPException(status_code=resp.status, detail="Failed to fetch transaction data")
                 json_data = await resp.json()
-                with open(f"tx_{tx_signature}.json", "w") as f:
-                    json.dump(json_data, f, indent=2)
+                if json_data.get("result") is not None:
+                    tx_store.put_background(tx_signature, json_data)
                 return json_data
+
+        return await upstream_flight.do("getTransaction", tx_signature, fetch)
     except aiohttp.ClientError as e:
         raise HTTPException(status_code=500, detail=f"RPC request failed: {str(e)}")
     
+@timed("upstream_fetch")
+async def fetch_transactions(
+    tx_signatures: list[str],
+    session: aiohttp.ClientSession
+) -> tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    # Stored transactions first, the rest via JSON-RPC batch getTransaction requests
+    stored = await asyncio.gather(*(tx_store.get(tx_signature) for tx_signature in tx_signatures))
+    transactions = {
+        tx_signature: tx_data for tx_signature, tx_data in zip(tx_signatures, stored) if tx_data is not None
+    }
+    errors = {}
+    missing = [tx_signature for tx_signature in tx_signatures if tx_signature not in transactions]
+    chunks = [missing[i:i + TX_RPC_BATCH_SIZE] for i in range(0, len(missing), TX_RPC_BATCH_SIZE)]
+
+    async def fetch_chunk(chunk: list[str]) -> list[Dict[str, Any]]:
+        async with helius_limiter.request(session, "POST", rpc_url, json=[
+            {
+                "jsonrpc": "2.0",
+                "id": index,
+                "method": "getTransaction",
+                "params": [
+                    tx_signature,
+                    {
+                        "encoding": "jsonParsed",
+                        "maxSupportedTransactionVersion": 0
+                    }
+                ]
+            }
+            for index, tx_signature in enumerate(chunk)
+        ]) as resp:
+            if resp.status != 200:
+                raise HTTPException(status_code=resp.status, detail="Failed to fetch transaction data")
+            json_data = await resp.json()
+            if not isinstance(json_data, list):
+                raise HTTPException(status_code=502, detail=f"Batch RPC request failed: {json_data.get('error')}")
+            return json_data
+
+    responses = await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks), return_exceptions=True)
+    for chunk, response in zip(chunks, responses):
+        if isinstance(response, Exception):
+            detail = response.detail if isinstance(response, HTTPException) else f"RPC request failed: {str(response)}"
+            for tx_signature in chunk:
+                errors[tx_signature] = detail
+            continue
+
+        items = {item.get("id"): item for item in response}
+        for index, tx_signature in enumerate(chunk):
+            item = items.get(index)
+            if item is None or "error" in item:
+                errors[tx_signature] = f"RPC error: {item.get('error') if item else 'no response'}"
+            elif item.get("result") is None:
+                errors[tx_signature] = "Transaction not found"
+            else:
+                transactions[tx_signature] = item
+                tx_store.put_background(tx_signature, item)
+
+    return transactions, errors
+
+@timed("upstream_fetch")
 async def fetch_account_flows(
     account_address,
+    session: aiohttp.ClientSession,
     direction: str = "in",
     sort: str = "asc",
     limit: int = 10,
     page: int = 1,
+    to_time: int = None,
 ) -> list[Dict[str, Any]]:
     try:
         url = (
-            f"https://pro-api.solscan.io/v2.0/account/transfer"
+            f"{solscan_url('account/transfer')}"
             f"?address={account_address}"
             f"&flow={direction}"
             f"&page={page}"
@@ -105,23 +227,60 @@ async def fetch_account_flows(
             f"&sort_by=block_time"
             f"&sort_order={sort}"
         )
+        if to_time is not None:
+            # Pins page boundaries while new blocks arrive (newest-first paging)
+            url += f"&to_time={to_time}"
         headers = {
             'token': os.getenv("SOLSCAN_API_KEY")
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as resp:
-                print('url', url)
+        async def fetch():
+            async with solscan_limiter.request(session, "GET", url, headers=headers) as resp:
                 if resp.status != 200:
-                    print('resp.text', await resp.text())
+                    logger.warning(f"Solscan account/transfer returned {resp.status}: {(await resp.text())[:500]}")
                     raise HTTPException(status_code=resp.status, detail="Failed to fetch transaction data")
                 json_data = await resp.json()
-                print('json_data', json_data)
+                sampled_debug(logger, "account/transfer %s -> %s", url, json_data)
                 if json_data.get('success') != True:
-                    print('json_data', json_data)
+                    logger.warning(f"Solscan account/transfer unsuccessful: {str(json_data)[:500]}")
                     raise HTTPException(status_code=400, detail="Failed to fetch transaction data")
                 return json_data['data']
 
+        return await upstream_flight.do(
+            "account/transfer",
+            (account_address, direction, sort, limit, page, to_time),
+            fetch
+        )
+
     except Exception as e:
         logger.error(f"Unexpected error fetching account inflow txs: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-    
\ No newline at end of file
+
+@timed("upstream_fetch")
+async def fetch_account_transfers_since(
+    account_address: str,
+    session: aiohttp.ClientSession,
+    from_time: int = 0,
+    page: int = 1,
+    page_size: int = 100,
+    limiter: UpstreamLimiter = solscan_sync_limiter
+) -> list[Dict[str, Any]]:
+    # Both directions, oldest first, block_time >= from_time; used by the transfers sync
+    # (background runs on the sync share of the Solscan budget, inline catch-ups pass solscan_limiter)
+    url = (
+        f"{solscan_url('account/transfer')}"
+        f"?address={account_address}"
+        f"&from_time={from_time}"
+        f"&page={page}"
+        f"&page_size={page_size}"
+        f"&sort_by=block_time"
+        f"&sort_order=asc"
+    )
+    headers = {'token': os.getenv("SOLSCAN_API_KEY")}
+    async with limiter.request(session, "GET", url, headers=headers) as resp:
+        if resp.status != 200:
+            raise HTTPException(status_code=resp.status, detail="Failed to fetch account transfers")
+        json_data = await resp.json()
+        if json_data.get('success') != True:
+            raise HTTPException(status_code=400, detail="Failed to fetch account transfers")
+        return json_data['data']
+
@@ -0,0 +1,162 @@
+# NDJSON streaming variants of the graph builders
+import logging
+import time
+from typing import Any, AsyncIterator, Dict
+import aiohttp
+from fastapi import HTTPException
+
+from db_utils import DatabasePool
+from metrics_utils import stage
+from response_utils import dumps
+from graph_utils import (
+    add_accounts_metadata,
+    apply_account_prices,
+    apply_account_token_metadata,
+    apply_tx_prices,
+    apply_tx_token_metadata,
+    drop_known_edges,
+    get_prices,
+    parse_account_flows,
+    parse_tx_flows,
+    resolve_account_tokens,
+    resolve_tx_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+# Event stream, one JSON object per line:
+#   {"type": "structure", "nodes": [...], "edges": [...]}   amounts in whole units, edges the client has are left out
+#   {"type": "edges", "patches": [{"index": i, ...fields}]}  index into the structure edges
+#   {"type": "nodes", "patches": [{"pubkey": ..., ...fields}]}
+#   {"type": "error", "status": ..., "detail": ...}
+#   {"type": "done", "timings": {"firstEdgeMs": ..., "totalMs": ...}}
+TOKEN_FIELDS = ("mint", "amount", "ticker", "tokenImage")
+PRICE_FIELDS = ("value",)
+NODE_FIELDS = ("label", "tags", "type", "img_url")
+
+def edge_patches(edges: list[Dict[str, Any]], fields: tuple) -> Dict[str, Any]:
+    patches = []
+    for index, edge in enumerate(edges):
+        patch = {field: edge[field] for field in fields if field in edge}
+        if patch:
+            patch["index"] = index
+            patches.append(patch)
+    return {"type": "edges", "patches": patches}
+
+def node_patches(nodes: list[Dict[str, Any]]) -> Dict[str, Any]:
+    patches = []
+    for node in nodes:
+        patch = {field: node[field] for field in NODE_FIELDS if field in node}
+        if patch:
+            patch["pubkey"] = node["pubkey"]
+            patches.append(patch)
+    return {"type": "nodes", "patches": patches}
+
+class StreamTimer:
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.first_edge_ms = None
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 2)
+
+    def mark_first_edge(self):
+        self.first_edge_ms = self.elapsed_ms()
+
+    def done(self) -> Dict[str, Any]:
+        return {"type": "done", "timings": {"firstEdgeMs": self.first_edge_ms, "totalMs": self.elapsed_ms()}}
+
+async def stream_tx_flows_network(
+    tx_data: Dict[str, Any],
+    rpc_url: str,
+    started_at: float,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None,
+    existing_node_pubkeys: list = [],
+    existing_edge_ids: list = []
+) -> AsyncIterator[Dict[str, Any]]:
+    timer = StreamTimer(started_at)
+    try:
+        flows = parse_tx_flows(tx_data)
+        # Edge IDs are built from whole-unit amounts, so token decimals are needed before known edges can be dropped
+        tokens_map = await resolve_tx_tokens(flows["edges"], rpc_url, db, session)
+        apply_tx_token_metadata(flows["edges"], tokens_map)
+        edges = drop_known_edges(flows["edges"], existing_edge_ids)
+        nodes = list(flows["nodes"].values())
+        timer.mark_first_edge()
+        yield {"type": "structure", "nodes": nodes, "edges": edges}
+
+        prices_map = await get_prices(flows["token_days"], db, session)
+        apply_tx_prices(edges, prices_map, flows["tx_date"])
+        yield edge_patches(edges, PRICE_FIELDS)
+
+        nodes = await add_accounts_metadata(nodes, existing_node_pubkeys, db, session)
+        yield node_patches(nodes)
+    except KeyError as e:
+        yield {"type": "error", "status": 400, "detail": f"Invalid transaction data structure: {str(e)}"}
+    except HTTPException as he:
+        yield {"type": "error", "status": he.status_code, "detail": str(he.detail)}
+    except Exception as e:
+        logger.error(f"Unexpected error streaming transaction flows: {str(e)}", exc_info=True)
+        yield {"type": "error", "status": 500, "detail": f"Internal server error: {str(e)}"}
+
+    done = timer.done()
+    logger.info(f"Streamed transaction flows: first edge {done['timings']['firstEdgeMs']}ms, total {done['timings']['totalMs']}ms")
+    yield done
+
+async def stream_account_flows_network(
+    flows_data: list[Dict[str, Any]],
+    rpc_url: str,
+    started_at: float,
+    db: DatabasePool = None,
+    session: aiohttp.ClientSession = None,
+    limit: int = 10,
+    existing_node_pubkeys: list = [],
+    existing_edge_ids: list = [],
+    has_more: bool = None,
+    next_cursor: str = None
+) -> AsyncIterator[Dict[str, Any]]:
+    timer = StreamTimer(started_at)
+    try:
+        flows = parse_account_flows(flows_data)
+        # Amounts are already whole units and edge_key folds wSOL, so the IDs match the enriched edges
+        edges = drop_known_edges(flows["edges"], existing_edge_ids)
+        nodes = list(flows["nodes"].values())
+        timer.mark_first_edge()
+        if has_more is None:
+            has_more = len(flows_data) >= limit
+        yield {
+            "type": "structure",
+            "nodes": nodes,
+            "edges": edges,
+            "hasMore": has_more,
+            "nextCursor": next_cursor
+        }
+
+        # Prices first: they are keyed by the raw mint, before wSOL is folded into SOL
+        prices_map = await get_prices(list(flows["token_days"]), db, session)
+        apply_account_prices(edges, prices_map)
+        yield edge_patches(edges, PRICE_FIELDS)
+
+        tokens_map = await resolve_account_tokens(edges, rpc_url, db, session)
+        apply_account_token_metadata(edges, tokens_map)
+        yield edge_patches(edges, TOKEN_FIELDS)
+
+        nodes = await add_accounts_metadata(nodes, existing_node_pubkeys, db, session)
+        yield node_patches(nodes)
+    except HTTPException as he:
+        yield {"type": "error", "status": he.status_code, "detail": str(he.detail)}
+    except Exception as e:
+        logger.error(f"Unexpected error streaming account flows: {str(e)}", exc_info=True)
+        yield {"type": "error", "status": 500, "detail": f"Internal server error: {str(e)}"}
+
+    done = timer.done()
+    logger.info(f"Streamed account flows: first edge {done['timings']['firstEdgeMs']}ms, total {done['timings']['totalMs']}ms")
+    yield done
+
+async def ndjson_lines(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    # Serialize each event before the generator resumes and mutates the graph further
+    async for event in events:
+        with stage("serialization"):
+            line = dumps(event) + b"\n"
+        yield line
@@ -0,0 +1,38 @@
+# Runs the app in-process against benchmarks/stub_upstream.py and the in-memory tables
+# Usage: pip install -r requirements-dev.txt && python -m pytest
+import socket
+
+import httpx
+import pytest
+
+from benchmarks.bench_app import configure_app, load_app
+from benchmarks.stub_upstream import UpstreamStub
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Test modules import app modules at collection time, so the stub's address is fixed up front
+STUB_PORT = free_port()
+STUB_URL = f"http://127.0.0.1:{STUB_PORT}"
+configure_app(STUB_URL)
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+async def stub():
+    stub = UpstreamStub()
+    await stub.start(port=STUB_PORT)
+    yield stub
+    await stub.stop()
+
+@pytest.fixture(scope="session")
+async def client(stub):
+    # One app for the whole run: tests use their own signatures and accounts instead of resetting caches
+    app = load_app(STUB_URL)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=60) as client:
+            yield client
@@ -0,0 +1,164 @@
+import base64
+from collections import defaultdict
+import math
+
+import pytest
+
+from benchmarks.bench_app import SCENARIOS, run_scenario, valid_graph
+from bloom_utils import BloomFilter, fnv1a_32
+from graph_utils import edge_key
+
+pytestmark = pytest.mark.anyio
+
+@pytest.mark.parametrize("name, request_fn", [(name, request) for name, request, _ in SCENARIOS])
+async def test_bench_scenarios_return_valid_bodies(client, stub, name, request_fn):
+    result = await run_scenario(name, request_fn, client, stub, total=4, concurrency=2)
+    assert result["failed"] == 0
+
+async def test_tx_repeated_with_session_returns_only_new_edges(client):
+    body = {"sessionId": "test-tx-session"}
+    first = await client.post("/transaction_flows/session-tx-1", json=body)
+    assert valid_graph(first)
+    edges = first.json()["edges"]
+    assert first.json()["session"]["version"] == 1
+
+    again = await client.post("/transaction_flows/session-tx-1", json=body)
+    assert again.status_code == 200
+    assert again.json()["edges"] == []
+    assert again.json()["nodes"] == []
+
+    snapshot = (await client.get("/sessions/test-tx-session")).json()
+    assert sorted(map(edge_key, snapshot["edges"])) == sorted(map(edge_key, edges))
+
+async def test_batch_repeated_with_session_returns_only_new_edges(client):
+    body = {"sessionId": "test-batch-session", "signatures": ["session-batch-1", "session-batch-2"]}
+    first = await client.post("/transactions/flows", json=body)
+    assert valid_graph(first)
+    first_count = len(first.json()["edges"])
+
+    body["signatures"].append("session-batch-3")
+    second = await client.post("/transactions/flows", json=body)
+    assert second.status_code == 200
+    new_edges = second.json()["edges"]
+    assert new_edges and all(edge["txId"] == "session-batch-3" for edge in new_edges)
+
+    snapshot = (await client.get("/sessions/test-batch-session")).json()
+    assert len(snapshot["edges"]) == first_count + len(new_edges)
+
+async def test_account_repeated_with_session_returns_empty_delta(client):
+    body = {"sessionId": "test-account-session"}
+    url = "/account_flows/session-acct-1?direction=in&limit=20"
+    first = await client.post(url, json=body)
+    assert valid_graph(first)
+
+    again = await client.post(url, json=body)
+    assert again.status_code == 200
+    assert again.json()["edges"] == []
+    assert again.json()["nodes"] == []
+    assert again.json()["session"]["id"] == "test-account-session"
+    assert again.json()["nextCursor"] == first.json()["nextCursor"]
+
+async def test_trace_repeated_with_session_returns_empty_delta(client):
+    body = {"sessionId": "test-trace-session"}
+    url = "/trace/session-trace-1?hops=1&limit=20"
+    first = await client.post(url, json=body)
+    assert valid_graph(first)
+
+    again = await client.post(url, json=body)
+    assert again.status_code == 200
+    assert again.json()["edges"] == []
+    assert again.json()["session"]["id"] == "test-trace-session"
+    assert again.json()["hops"][0]["transfers"] == first.json()["hops"][0]["transfers"]
+
+async def test_account_cursor_walk_covers_every_transfer_once(client, stub):
+    address = "cursor-walk-1"
+    expected = sorted(row["trans_id"] for row in stub.account_transfers(address) if row["flow"] == "out")
+    tx_ids = []
+    cursor = None
+    for _ in range(len(expected)):
+        url = f"/account_flows/{address}?direction=out&sort=desc&limit=30"
+        resp = await client.post(url + (f"&cursor={cursor}" if cursor else ""), json={})
+        assert valid_graph(resp)
+        tx_ids += [edge["txId"] for edge in resp.json()["edges"]]
+        cursor = resp.json()["nextCursor"]
+        if not cursor:
+            break
+    assert sorted(tx_ids) == expected
+
+async def test_account_cursor_rejected_when_invalid_or_foreign(client):
+    url = "/account_flows/cursor-owner-1?direction=in&limit=10"
+    first = await client.post(url, json={})
+    cursor = first.json()["nextCursor"]
+    assert cursor
+
+    assert (await client.post(url + f"&cursor={cursor}", json={})).status_code == 200
+    assert (await client.post(url + "&cursor=not-a-cursor", json={})).status_code == 400
+    foreign = await client.post(f"/account_flows/cursor-other-1?direction=in&limit=10&cursor={cursor}", json={})
+    assert foreign.status_code == 400
+
+async def test_aggregate_edges_totals_match_transfers(client):
+    url = "/account_flows/aggregate-1?direction=in&limit=100"
+    transfers = (await client.post(url, json={})).json()["edges"]
+    aggregated = (await client.post(url + "&aggregate=true&tx_ids=true", json={})).json()["edges"]
+
+    groups = defaultdict(list)
+    for edge in transfers:
+        groups[(edge["source"], edge["target"], edge["mint"])].append(edge)
+    assert len(aggregated) == len(groups)
+    for edge in aggregated:
+        group = groups[(edge["source"], edge["target"], edge["mint"])]
+        priced = [transfer["value"] for transfer in group if transfer.get("value") is not None]
+        assert edge["type"] == "aggregate"
+        assert edge["count"] == len(group)
+        assert edge["amount"] == pytest.approx(sum(transfer["amount"] for transfer in group))
+        assert edge["value"] == (pytest.approx(sum(priced)) if priced else None)
+        assert edge["unpriced"] == len(group) - len(priced)
+        assert edge["firstBlockTime"] == min(transfer["blockTime"] for transfer in group)
+        assert edge["lastBlockTime"] == max(transfer["blockTime"] for transfer in group)
+        assert sorted(edge["txIds"]) == sorted(transfer["txId"] for transfer in group)
+
+def client_bloom_filter(keys, size_bytes: int, hashes: int) -> str:
+    # Independent build of the documented layout, as a client would do it
+    bits = bytearray(size_bytes)
+    size = size_bytes * 8
+    for key in keys:
+        data = key.encode()
+        h1 = fnv1a_32(data)
+        h2 = fnv1a_32(data, h1) | 1
+        for i in range(hashes):
+            position = (h1 + i * h2) % size
+            bits[position >> 3] |= 1 << (position & 7)
+    return base64.b64encode(bytes(bits)).decode()
+
+def test_bloom_filter_hash_layout():
+    # Reference 32-bit FNV-1a values
+    assert fnv1a_32(b"") == 0x811C9DC5
+    assert fnv1a_32(b"a") == 0xE40C292C
+    assert fnv1a_32(b"foobar") == 0xBF9CF968
+
+    bloom = BloomFilter(bytearray(64), 5)
+    bloom.add("sig-1-walletA1-Burn-So11111111111111111111111111111111111111111-0.0000025")
+    assert bloom.to_base64() == client_bloom_filter(
+        ["sig-1-walletA1-Burn-So11111111111111111111111111111111111111111-0.0000025"], 64, 5
+    )
+
+    # Bit n is bit (n & 7) of byte n >> 3, least significant first
+    single = BloomFilter(bytearray(2), 1)
+    single.add("x")
+    position = fnv1a_32(b"x") % 16
+    assert int.from_bytes(single.bits, "little") == 1 << position
+
+    sized = BloomFilter.with_capacity(1000, 0.01)
+    assert sized.size >= math.ceil(-1000 * math.log(0.01) / math.log(2) ** 2)
+    assert sized.hashes == 7
+
+async def test_client_built_edge_filter_drops_known_edges(client):
+    first = await client.post("/transaction_flows/bloom-tx-1", json={})
+    assert valid_graph(first)
+    edges = first.json()["edges"]
+    known = [edge_key(edge) for edge in edges[:2]]
+
+    body = {"edgeFilter": {"bits": client_bloom_filter(known, 256, 7), "hashes": 7}}
+    again = await client.post("/transaction_flows/bloom-tx-1", json=body)
+    assert again.status_code == 200
+    assert sorted(map(edge_key, again.json()["edges"])) == sorted(map(edge_key, edges[2:]))
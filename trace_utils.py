@@ -0,0 +1,123 @@
+# Server-side multi-hop fund tracing over account flows
+import asyncio
+import logging
+import os
+from typing import Any, Dict
+import aiohttp
+from fastapi import HTTPException
+
+from db_utils import DatabasePool
+from transfer_store import transfer_store
+from graph_utils import build_account_flows_network, edge_key, IdUnion
+
+logger = logging.getLogger(__name__)
+
+TRACE_MAX_WORKERS = int(os.getenv("TRACE_MAX_WORKERS", "5"))
+
+async def trace_account_flows(
+    account_address: str,
+    rpc_url: str,
+    db_pool: DatabasePool,
+    session: aiohttp.ClientSession,
+    direction: str = "out",
+    sort: str = "desc",
+    hops: int = 2,
+    fan_out: int = 10,
+    min_value: float = 0.0,
+    limit: int = 100,
+    existing_node_pubkeys=(),
+    existing_edge_ids=()
+) -> Dict[str, Any]:
+    """Breadth-first expansion of account flows, `hops` levels out from the root.
+
+    Each hop expands every frontier account concurrently (at most
+    TRACE_MAX_WORKERS at a time; each statement checks a connection out of
+    the pool and returns it, so slow upstream calls hold none), keeps
+    edges worth at least `min_value` USD and follows the `fan_out` highest
+    value counterparties not yet visited. Each entry of `hops` reports the
+    accounts expanded, the transfers upstream returned for them (known
+    edges included) and the candidates found.
+    """
+    if direction not in ("in", "out"):
+        raise HTTPException(status_code=400, detail="direction must be 'in' or 'out'")
+
+    nodes: Dict[str, Dict[str, Any]] = {}
+    edges: Dict[str, Dict[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    hop_stats = []
+    visited = {account_address}
+    frontier = [account_address]
+    seen_nodes = IdUnion(nodes, existing_node_pubkeys)
+    seen_edges = IdUnion(edges, existing_edge_ids)
+    workers = asyncio.Semaphore(TRACE_MAX_WORKERS)
+
+    transfers = 0
+
+    async def expand(address: str) -> Dict[str, Any]:
+        nonlocal transfers
+        async with workers:
+            try:
+                flows_data = await transfer_store.account_flows(
+                    address,
+                    db_pool=db_pool,
+                    session=session,
+                    direction=direction,
+                    sort=sort,
+                    limit=limit,
+                    page=1,
+                    # Frontier accounts are served as-is; only direct requests start a full-history sync
+                    start_sync=False
+                )
+                transfers += len(flows_data)
+                return await build_account_flows_network(
+                    flows_data,
+                    rpc_url=rpc_url,
+                    db=db_pool,
+                    session=session,
+                    limit=limit,
+                    existing_node_pubkeys=seen_nodes,
+                    existing_edge_ids=seen_edges
+                )
+            except HTTPException as he:
+                errors[address] = str(he.detail)
+            except Exception as e:
+                logger.error(f"Unexpected error tracing {address}: {str(e)}", exc_info=True)
+                errors[address] = str(e)
+            return None
+
+    for hop in range(1, hops + 1):
+        if not frontier:
+            break
+        transfers = 0
+        results = await asyncio.gather(*(expand(address) for address in frontier))
+
+        candidates: Dict[str, float] = {}
+        for network_data in results:
+            if not network_data:
+                continue
+            node_by_pubkey = {node["pubkey"]: node for node in network_data["nodes"]}
+            for edge in network_data["edges"]:
+                value = edge.get("value") or 0.0
+                if value < min_value:
+                    continue
+                edges.setdefault(edge_key(edge), edge)
+                for pubkey in (edge["source"], edge["target"]):
+                    if pubkey not in nodes and pubkey in node_by_pubkey:
+                        nodes[pubkey] = node_by_pubkey[pubkey]
+                counterparty = edge["target"] if direction == "out" else edge["source"]
+                if counterparty not in visited:
+                    candidates[counterparty] = candidates.get(counterparty, 0.0) + value
+
+        hop_stats.append({"hop": hop, "expanded": len(frontier), "transfers": transfers, "candidates": len(candidates)})
+        frontier = sorted(candidates, key=candidates.get, reverse=True)[:fan_out]
+        visited.update(frontier)
+
+    if account_address not in nodes:
+        nodes[account_address] = {"pubkey": account_address}
+
+    return {
+        "nodes": list(nodes.values()),
+        "edges": list(edges.values()),
+        "hops": hop_stats,
+        "errors": errors
+    }
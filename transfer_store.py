@@ -0,0 +1,527 @@
+# Local copy of Solscan account transfers, synced incrementally per account
+import asyncio
+import base64
+from decimal import Decimal
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Tuple
+import aiohttp
+import asyncpg
+
+from cache_utils import TTLCache
+from db_utils import DatabasePool
+from graph_utils import build_account_flows_network
+from http_utils import UpstreamLimiter, solscan_limiter, solscan_sync_limiter
+from solana_utils import fetch_account_flows, fetch_account_transfers_since
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_STORE_ENABLED = os.getenv("TRANSFER_STORE_ENABLED", "true").lower() == "true"
+# Seconds a synced account is served without asking Solscan for newer transfers
+TRANSFER_SYNC_TTL = float(os.getenv("TRANSFER_SYNC_TTL", "300"))
+TRANSFER_SYNC_PAGE_SIZE = 100
+# Pages per sync run; the first sync of a large account continues in the background
+TRANSFER_SYNC_MAX_PAGES = int(os.getenv("TRANSFER_SYNC_MAX_PAGES", "20"))
+TRANSFER_INLINE_SYNC_PAGES = int(os.getenv("TRANSFER_INLINE_SYNC_PAGES", "2"))
+# Background runs per trigger (at most MAX_RUNS x MAX_PAGES Solscan calls, on the solscan_sync limiter)
+TRANSFER_SYNC_MAX_RUNS = int(os.getenv("TRANSFER_SYNC_MAX_RUNS", "5"))
+# Seconds before an account whose sync ran out of budget (or failed) may start another one
+TRANSFER_SYNC_COOLDOWN = float(os.getenv("TRANSFER_SYNC_COOLDOWN", "1800"))
+
+PAGE_PREFETCH_ENABLED = os.getenv("PAGE_PREFETCH_ENABLED", "true").lower() == "true"
+PAGE_PREFETCH_TTL = float(os.getenv("PAGE_PREFETCH_TTL", "120"))
+# 2: cursors carry the account hash
+CURSOR_VERSION = 2
+
+TRANSFER_COLUMNS = (
+    "trans_id, block_time, activity_type, from_address, to_address, "
+    "token_address, token_decimals, amount, flow"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    address TEXT NOT NULL,
+    trans_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    block_time BIGINT NOT NULL,
+    activity_type TEXT,
+    from_address TEXT,
+    to_address TEXT,
+    token_address TEXT,
+    token_decimals INTEGER,
+    amount NUMERIC,
+    flow TEXT NOT NULL,
+    PRIMARY KEY (address, trans_id, position)
+);
+CREATE INDEX IF NOT EXISTS transfers_address_block_time_idx
+    ON transfers (address, block_time, trans_id, position);
+CREATE TABLE IF NOT EXISTS transfer_sync (
+    address TEXT PRIMARY KEY,
+    high_water_time BIGINT NOT NULL DEFAULT 0,
+    complete BOOLEAN NOT NULL DEFAULT FALSE,
+    synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+def transfer_rows(address: str, flows: list[Dict[str, Any]]) -> list[tuple]:
+    """Rows for the transfers table.
+
+    Solscan does not expose the instruction index, so position is the ordinal
+    of the transfer among its transaction's transfers in a content-defined
+    order. That is stable no matter which page or sort order delivered them,
+    so re-syncing the same transaction hits the same keys.
+    """
+    by_tx: Dict[str, list] = {}
+    for flow in flows:
+        by_tx.setdefault(flow['trans_id'], []).append(flow)
+    rows = []
+    for trans_id, tx_flows in by_tx.items():
+        tx_flows.sort(key=lambda flow: (
+            flow.get('activity_type') or '',
+            flow.get('from_address') or '',
+            flow.get('to_address') or '',
+            flow.get('token_address') or '',
+            str(flow.get('amount')),
+            flow.get('flow') or '',
+        ))
+        for position, flow in enumerate(tx_flows):
+            rows.append((
+                address,
+                trans_id,
+                position,
+                flow['block_time'],
+                flow.get('activity_type'),
+                flow.get('from_address'),
+                flow.get('to_address'),
+                flow.get('token_address'),
+                flow.get('token_decimals'),
+                Decimal(str(flow['amount'])),
+                flow.get('flow'),
+            ))
+    return rows
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def cursor_account(address: str) -> str:
+    # Short hash of the account a cursor was issued for
+    return hashlib.sha256(address.encode()).hexdigest()[:16]
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Opaque page cursor -> state dict; raises ValueError for anything malformed.
+
+    Every cursor carries the account hash, direction and sort it was issued
+    for. Local cursors carry the last (block_time, trans_id, position) served.
+    Cursors for accounts still paged from Solscan carry a page number plus,
+    for newest-first paging, the to_time anchor fixed on the first page.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(state, dict) or state.get("v") != CURSOR_VERSION:
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(state.get(field), str) for field in ("h", "d", "s")):
+        raise ValueError("Invalid cursor")
+    key = state.get("k")
+    if key is not None:
+        valid = (isinstance(key, list) and len(key) == 3
+                 and isinstance(key[0], int) and isinstance(key[1], str) and isinstance(key[2], int))
+    else:
+        valid = isinstance(state.get("p"), int) and state["p"] >= 1 and isinstance(state.get("a"), (int, type(None)))
+    if not valid:
+        raise ValueError("Invalid cursor")
+    return state
+
+def flow_from_record(record: asyncpg.Record) -> Dict[str, Any]:
+    # Same shape as a Solscan /account/transfer row
+    flow = dict(record)
+    amount = flow['amount']
+    flow['amount'] = int(amount) if amount == amount.to_integral_value() else float(amount)
+    return flow
+
+class TransferStore:
+    """Serves /account/transfer pages from Postgres once an account is fully synced.
+
+    Each account has a high-water mark (latest stored block_time). A sync
+    pulls transfers at or after it, oldest first, so only new activity costs
+    an API call; the boundary second is re-read and deduplicated by key.
+    Until the backlog has been drained ("complete"), requests fall through to
+    Solscan while the sync carries on in the background.
+    """
+
+    def __init__(self):
+        self._syncs: Dict[str, asyncio.Task] = {}
+        self._sync_cooldowns = TTLCache(maxsize=100000, ttl=TRANSFER_SYNC_COOLDOWN)
+        # Keyset cursor that ends each served page, so page N+1 avoids OFFSET
+        self._page_cursors = TTLCache(maxsize=10000, ttl=TRANSFER_SYNC_TTL)
+        self._upstream_pages = TTLCache(maxsize=1000, ttl=PAGE_PREFETCH_TTL)
+        self._prefetched = TTLCache(maxsize=1000, ttl=PAGE_PREFETCH_TTL)
+        self._prefetch_tasks: set = set()
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self.local_pages = 0
+        self.upstream_pages = 0
+        self.synced_rows = 0
+        self.sync_runs = 0
+        self.sync_errors = 0
+
+    async def ensure_schema(self, db_pool: DatabasePool):
+        async with db_pool.acquire() as db:
+            await db.execute(SCHEMA)
+
+    async def _sync(
+        self,
+        address: str,
+        db_pool: DatabasePool,
+        session: aiohttp.ClientSession,
+        max_pages: int,
+        limiter: UpstreamLimiter = solscan_sync_limiter
+    ) -> bool:
+        async with db_pool.acquire() as db:
+            state = await db.fetchrow(
+                "SELECT high_water_time FROM transfer_sync WHERE address = $1", address
+            )
+        from_time = state['high_water_time'] if state else 0
+
+        flows = []
+        page = 1
+        complete = False
+        for _ in range(max_pages):
+            batch = await fetch_account_transfers_since(
+                address, session, from_time=from_time, page=page, page_size=TRANSFER_SYNC_PAGE_SIZE, limiter=limiter
+            )
+            if len(batch) < TRANSFER_SYNC_PAGE_SIZE:
+                flows.extend(batch)
+                complete = True
+                break
+            last_time = batch[-1]['block_time']
+            if last_time > from_time:
+                # Restart just at the last second so no transaction is split across runs
+                flows.extend(flow for flow in batch if flow['block_time'] < last_time)
+                from_time, page = last_time, 1
+            else:
+                flows.extend(batch)
+                page += 1
+        if complete:
+            high_water_time = max((flow['block_time'] for flow in flows), default=from_time)
+        else:
+            # Keep only whole seconds; the rest is re-read from from_time next run
+            flows = [flow for flow in flows if flow['block_time'] < from_time]
+            high_water_time = from_time
+
+        rows = transfer_rows(address, flows)
+        async with db_pool.acquire() as db:
+            async with db.transaction():
+                if rows:
+                    await db.executemany(
+                        f"""
+                        INSERT INTO transfers (address, trans_id, position, {TRANSFER_COLUMNS})
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+                        ON CONFLICT (address, trans_id, position) DO NOTHING
+                        """,
+                        rows
+                    )
+                await db.execute(
+                    """
+                    INSERT INTO transfer_sync (address, high_water_time, complete, synced_at)
+                    VALUES ($1, $2, $3, now())
+                    ON CONFLICT (address) DO UPDATE SET
+                        high_water_time = GREATEST(transfer_sync.high_water_time, EXCLUDED.high_water_time),
+                        complete = EXCLUDED.complete,
+                        synced_at = EXCLUDED.synced_at
+                    """,
+                    address, high_water_time, complete
+                )
+        self.sync_runs += 1
+        self.synced_rows += len(rows)
+        return complete
+
+    async def _sync_to_completion(self, address: str, db_pool: DatabasePool, session: aiohttp.ClientSession):
+        complete = False
+        try:
+            for _ in range(TRANSFER_SYNC_MAX_RUNS):
+                if await self._sync(address, db_pool, session, TRANSFER_SYNC_MAX_PAGES):
+                    complete = True
+                    break
+        except Exception as e:
+            self.sync_errors += 1
+            logger.warning(f"Transfer sync failed for {address}: {str(e)}")
+        finally:
+            self._syncs.pop(address, None)
+            if not complete:
+                # Out of budget: keep serving it from Solscan for a while instead of re-triggering on every touch
+                self._sync_cooldowns.set(address, True)
+
+    def sync_in_background(self, address: str, db_pool: DatabasePool, session: aiohttp.ClientSession):
+        if address not in self._syncs and address not in self._sync_cooldowns:
+            self._syncs[address] = asyncio.create_task(self._sync_to_completion(address, db_pool, session))
+
+    async def _ready(
+        self,
+        address: str,
+        db_pool: DatabasePool,
+        session: aiohttp.ClientSession,
+        start_sync: bool = True
+    ) -> bool:
+        """True when the local table holds this account's full, reasonably fresh history.
+
+        Only direct user requests pass start_sync; trace expansions and
+        prefetches read synced accounts but never start or extend a sync.
+        """
+        if address in self._syncs:
+            return False
+        async with db_pool.acquire() as db:
+            state = await db.fetchrow(
+                """
+                SELECT complete, extract(epoch FROM now() - synced_at) AS age
+                FROM transfer_sync
+                WHERE address = $1
+                """,
+                address
+            )
+        if not state or not state['complete']:
+            if start_sync:
+                self.sync_in_background(address, db_pool, session)
+            return False
+        if state['age'] > TRANSFER_SYNC_TTL:
+            if not start_sync:
+                return False
+            try:
+                # On the request path, so it uses the interactive Solscan budget
+                if not await self._sync(address, db_pool, session, TRANSFER_INLINE_SYNC_PAGES, solscan_limiter):
+                    self.sync_in_background(address, db_pool, session)
+                    return False
+            except Exception as e:
+                self.sync_errors += 1
+                logger.warning(f"Incremental transfer sync failed for {address}: {str(e)}")
+                return False
+        return True
+
+    async def query(
+        self,
+        db: asyncpg.Connection,
+        address: str,
+        direction: str,
+        sort: str,
+        limit: int,
+        after: tuple = None,
+        offset: int = 0
+    ) -> list[Dict[str, Any]]:
+        """One page in (block_time, trans_id, position) order, optionally after a keyset cursor."""
+        descending = sort == "desc"
+        order = "DESC" if descending else "ASC"
+        params = [address, direction, limit]
+        if after is not None:
+            keyset = f"AND (block_time, trans_id, position) {'<' if descending else '>'} ($4, $5, $6)"
+            skip = ""
+            params.extend(after)
+        else:
+            keyset = ""
+            skip = "OFFSET $4"
+            params.append(offset)
+        records = await db.fetch(
+            f"""
+            SELECT {TRANSFER_COLUMNS}, position
+            FROM transfers
+            WHERE address = $1 AND flow = $2 {keyset}
+            ORDER BY block_time {order}, trans_id {order}, position {order}
+            LIMIT $3 {skip}
+            """,
+            *params
+        )
+        return [flow_from_record(record) for record in records]
+
+    async def account_flows(
+        self,
+        address: str,
+        db_pool: DatabasePool,
+        session: aiohttp.ClientSession,
+        direction: str = "in",
+        sort: str = "asc",
+        limit: int = 10,
+        page: int = 1,
+        start_sync: bool = True
+    ) -> list[Dict[str, Any]]:
+        """Drop-in for fetch_account_flows: local when synced, Solscan otherwise."""
+        if TRANSFER_STORE_ENABLED and await self._ready(address, db_pool, session, start_sync):
+            page_key = (address, direction, sort, limit, page)
+            after = self._page_cursors.get(page_key)
+            async with db_pool.acquire() as db:
+                flows = await self.query(
+                    db, address, direction, sort, limit,
+                    after=after, offset=0 if after else (page - 1) * limit
+                )
+            if flows:
+                last = flows[-1]
+                self._page_cursors.set(
+                    (address, direction, sort, limit, page + 1),
+                    (last['block_time'], last['trans_id'], last['position'])
+                )
+            for flow in flows:
+                del flow['position']
+            self.local_pages += 1
+            return flows
+
+        self.upstream_pages += 1
+        return await fetch_account_flows(
+            address,
+            session=session,
+            direction=direction,
+            sort=sort,
+            limit=limit,
+            page=page
+        )
+
+    async def _upstream_page(self, address, session, direction, sort, limit, page, anchor) -> list[Dict[str, Any]]:
+        key = (address, direction, sort, limit, page, anchor)
+        flows = self._upstream_pages.get(key)
+        if flows is None:
+            flows = await fetch_account_flows(
+                address,
+                session=session,
+                direction=direction,
+                sort=sort,
+                limit=limit,
+                page=page,
+                to_time=anchor
+            )
+            self._upstream_pages.set(key, flows)
+            self.upstream_pages += 1
+        return flows
+
+    async def _fetch_page(
+        self,
+        address: str,
+        db_pool: DatabasePool,
+        session: aiohttp.ClientSession,
+        direction: str,
+        sort: str,
+        limit: int,
+        state: Dict[str, Any],
+        start_sync: bool = True
+    ) -> Tuple[list[Dict[str, Any]], Dict[str, Any]]:
+        # A pagination keeps the mode (local or Solscan) its first page was served in
+        if state is None:
+            local = TRANSFER_STORE_ENABLED and await self._ready(address, db_pool, session, start_sync)
+        else:
+            local = "k" in state
+        base = {"v": CURSOR_VERSION, "h": cursor_account(address), "d": direction, "s": sort}
+
+        if local:
+            async with db_pool.acquire() as db:
+                flows = await self.query(
+                    db, address, direction, sort, limit + 1,
+                    after=tuple(state["k"]) if state else None
+                )
+            self.local_pages += 1
+            next_state = None
+            if len(flows) > limit:
+                flows = flows[:limit]
+                last = flows[-1]
+                next_state = {**base, "k": [last['block_time'], last['trans_id'], last['position']]}
+            for flow in flows:
+                del flow['position']
+            return flows, next_state
+
+        # Solscan page sizes are fixed, so hasMore comes from fetching the following page too
+        anchor = state.get("a") if state else (int(time.time()) if sort == "desc" else None)
+        page = state["p"] if state else 1
+        flows, following = await asyncio.gather(
+            self._upstream_page(address, session, direction, sort, limit, page, anchor),
+            self._upstream_page(address, session, direction, sort, limit, page + 1, anchor)
+        )
+        next_state = None
+        if len(flows) >= limit and following:
+            next_state = {**base, "a": anchor, "p": page + 1}
+        return flows, next_state
+
+    def _prefetch(self, key, address, db_pool, session, rpc_url, direction, sort, limit, state):
+        # Fetch and enrich the next page while the client renders this one; warms price,
+        # token and account caches, the graph itself is rebuilt on the real request
+        async def run():
+            flows, next_state = await self._fetch_page(
+                address, db_pool, session, direction, sort, limit, state, start_sync=False
+            )
+            await build_account_flows_network(flows, rpc_url=rpc_url, db=db_pool, session=session, limit=limit)
+            return flows, next_state
+
+        task = asyncio.create_task(run())
+        self._prefetch_tasks.add(task)
+
+        def done(finished: asyncio.Task):
+            self._prefetch_tasks.discard(finished)
+            if not finished.cancelled() and finished.exception():
+                logger.debug(f"Prefetch for {address} failed: {finished.exception()}")
+
+        task.add_done_callback(done)
+        self._prefetched.set(key, task)
+        self.prefetches += 1
+
+    async def account_flows_page(
+        self,
+        address: str,
+        db_pool: DatabasePool,
+        session: aiohttp.ClientSession,
+        rpc_url: str,
+        direction: str = "in",
+        sort: str = "asc",
+        limit: int = 10,
+        cursor: str = None
+    ) -> Tuple[list[Dict[str, Any]], str]:
+        """One page of account flows and the cursor for the next one (None on the last page).
+
+        Raises ValueError for a malformed cursor or one issued for another
+        account, direction or sort order.
+        """
+        state = decode_cursor(cursor) if cursor else None
+        if state and state["h"] != cursor_account(address):
+            raise ValueError("Cursor was issued for a different account")
+        if state and (state["d"], state["s"]) != (direction, sort):
+            raise ValueError("Cursor was issued for a different direction or sort order")
+
+        key = (address, direction, sort, limit, cursor)
+        task = self._prefetched.get(key)
+        result = None
+        if task is not None:
+            self._prefetched.invalidate(key)
+            try:
+                result = await task
+                self.prefetch_hits += 1
+            except Exception as e:
+                logger.warning(f"Prefetched page for {address} failed: {str(e)}")
+        if result is None:
+            result = await self._fetch_page(address, db_pool, session, direction, sort, limit, state)
+        flows, next_state = result
+
+        next_cursor = encode_cursor(next_state) if next_state else None
+        if next_cursor and PAGE_PREFETCH_ENABLED:
+            self._prefetch(
+                (address, direction, sort, limit, next_cursor),
+                address, db_pool, session, rpc_url, direction, sort, limit, next_state
+            )
+        return flows, next_cursor
+
+    async def stop(self):
+        tasks = [*self._syncs.values(), *self._prefetch_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local_pages": self.local_pages,
+            "upstream_pages": self.upstream_pages,
+            "syncs_running": len(self._syncs),
+            "syncs_cooling_down": len(self._sync_cooldowns),
+            "sync_runs": self.sync_runs,
+            "synced_rows": self.synced_rows,
+            "sync_errors": self.sync_errors,
+            "prefetches": self.prefetches,
+            "prefetch_hits": self.prefetch_hits,
+        }
+
+transfer_store = TransferStore()
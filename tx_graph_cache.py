@@ -0,0 +1,123 @@
+# Memoized, fully enriched transaction graphs keyed by signature
+from datetime import datetime
+import hashlib
+import json
+import os
+from typing import Any, Dict
+import aiohttp
+
+from cache_utils import TTLCache, UNRESOLVED_ACCOUNT, accounts_cache
+from db_utils import DatabasePool
+from graph_utils import PSEUDO_NODES, build_tx_flows_network, drop_known_edges, sol_mint, wsol_mint
+from http_utils import SingleFlight
+from price_utils import price_states
+from tx_store import TransactionStore
+
+# Bump when the graph builder's output changes so persisted graphs are rebuilt
+# (2: fee edges carry txId)
+TX_GRAPH_VERSION = 2
+TX_GRAPH_CACHE_SIZE = int(os.getenv("TX_GRAPH_CACHE_SIZE", "5000"))
+TX_GRAPH_CACHE_TTL = float(os.getenv("TX_GRAPH_CACHE_TTL", "3600"))
+TX_GRAPH_PARTIAL_TTL = float(os.getenv("TX_GRAPH_PARTIAL_TTL", "60"))
+TX_GRAPH_MAX_AGE = int(os.getenv("TX_GRAPH_MAX_AGE", "3600"))
+TX_GRAPH_STORE_ENABLED = os.getenv("TX_GRAPH_STORE_ENABLED", "false").lower() == "true"
+TX_GRAPH_STORE_DIR = os.getenv("TX_GRAPH_STORE_DIR", ".tx_graph_store")
+TX_GRAPH_STORE_MAX_BYTES = int(os.getenv("TX_GRAPH_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+def graph_etag(graph: Dict[str, Any]) -> str:
+    body = json.dumps(graph, sort_keys=True, separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+def is_complete(graph: Dict[str, Any], tx_date: str) -> bool:
+    # Complete once every label came from the accounts table and every missing price is settled
+    for node in graph["nodes"]:
+        if node["pubkey"] in PSEUDO_NODES:
+            continue
+        row = accounts_cache.peek(node["pubkey"])
+        if row is None or row is UNRESOLVED_ACCOUNT:
+            return False
+    for edge in graph["edges"]:
+        if "mint" in edge and edge["type"] != "delegate" and edge.get("value") is None:
+            mint = sol_mint if edge["mint"] == wsol_mint else edge["mint"]
+            if not price_states.settled(mint, tx_date):
+                return False
+    return True
+
+def filter_tx_graph(
+    graph: Dict[str, Any],
+    existing_node_pubkeys=(),
+    existing_edge_ids=()
+) -> Dict[str, Any]:
+    """The caller's view of a cached graph: edges it already has are dropped.
+
+    Matches edge_key on the enriched edges, the same IDs every other
+    endpoint filters on. Nodes are returned whole; cached entries are
+    shared, so never mutate them.
+    """
+    return {"nodes": list(graph["nodes"]), "edges": drop_known_edges(graph["edges"], existing_edge_ids)}
+
+class TxGraphCache:
+    """LRU of enriched graphs, with an optional on-disk tier for complete ones.
+
+    Transaction structure never changes, but labels and prices can arrive
+    after the first build (metadata worker, price not published yet), so
+    graphs with gaps are kept only for TX_GRAPH_PARTIAL_TTL and not persisted.
+    """
+
+    def __init__(self, store: TransactionStore = None):
+        self._graphs = TTLCache(maxsize=TX_GRAPH_CACHE_SIZE, ttl=TX_GRAPH_CACHE_TTL, negative_ttl=TX_GRAPH_PARTIAL_TTL)
+        self._store = store
+        self._flight = SingleFlight()
+        self.builds = 0
+        self.store_hits = 0
+
+    def _key(self, tx_signature: str) -> str:
+        return f"v{TX_GRAPH_VERSION}:{tx_signature}"
+
+    async def get(self, tx_signature: str) -> Dict[str, Any] | None:
+        # {"graph": ..., "etag": ..., "complete": ...} or None
+        key = self._key(tx_signature)
+        entry = self._graphs.get(key)
+        if entry is None and self._store:
+            entry = await self._store.get(key)
+            if entry is not None:
+                self.store_hits += 1
+                self._graphs.set(key, entry)
+        return entry
+
+    async def build(
+        self,
+        tx_signature: str,
+        tx_data: Dict[str, Any],
+        rpc_url: str,
+        db: DatabasePool = None,
+        session: aiohttp.ClientSession = None
+    ) -> Dict[str, Any]:
+        async def build_entry():
+            graph = await build_tx_flows_network(tx_data, rpc_url, db=db, session=session)
+            tx_date = datetime.fromtimestamp(tx_data['result']['blockTime']).strftime('%Y%m%d')
+            entry = {"graph": graph, "etag": graph_etag(graph), "complete": is_complete(graph, tx_date)}
+            key = self._key(tx_signature)
+            self._graphs.set(key, entry, negative=not entry["complete"])
+            if self._store and entry["complete"]:
+                self._store.put_background(key, entry)
+            self.builds += 1
+            return entry
+
+        return await self._flight.do("tx_graph", tx_signature, build_entry)
+
+    async def flush(self):
+        if self._store:
+            await self._store.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._graphs.stats(),
+            "builds": self.builds,
+            "store_hits": self.store_hits,
+            "store": self._store.stats() if self._store else None,
+        }
+
+tx_graphs = TxGraphCache(
+    TransactionStore(TX_GRAPH_STORE_DIR, TX_GRAPH_STORE_MAX_BYTES) if TX_GRAPH_STORE_ENABLED else None
+)
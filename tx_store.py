@@ -0,0 +1,136 @@
+# Local content-addressed cache of confirmed getTransaction responses
+import asyncio
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import zlib
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+TX_STORE_DIR = os.getenv("TX_STORE_DIR", ".tx_store")
+TX_STORE_MAX_BYTES = int(os.getenv("TX_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+TX_STORE_COMPRESSION_LEVEL = int(os.getenv("TX_STORE_COMPRESSION_LEVEL", "6"))
+
+class TransactionStore:
+    """zlib-compressed JSON files sharded two levels deep by sha256(signature).
+
+    Confirmed transactions never change, so entries are only evicted (least
+    recently used first) once the store grows past max_bytes. All disk I/O
+    runs in worker threads.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._sizes: OrderedDict = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _path(self, tx_signature: str) -> str:
+        key = hashlib.sha256(tx_signature.encode()).hexdigest()
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.json.z")
+
+    def _ensure_loaded(self):
+        # Rebuild the LRU order from file mtimes the first time the store is touched
+        if self._loaded:
+            return
+        entries = []
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith(".json.z"):
+                        stat = os.stat(os.path.join(dirpath, filename))
+                        entries.append((stat.st_mtime, os.path.join(dirpath, filename), stat.st_size))
+        for _, path, size in sorted(entries):
+            self._sizes[path] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def _read(self, tx_signature: str) -> Dict[str, Any]:
+        path = self._path(tx_signature)
+        with self._lock:
+            self._ensure_loaded()
+            if path not in self._sizes:
+                self.misses += 1
+                return None
+            self._sizes.move_to_end(path)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = json.loads(zlib.decompress(mm))
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Dropping unreadable tx store entry {path}: {e}")
+            with self._lock:
+                self._total_bytes -= self._sizes.pop(path, 0)
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def _write(self, tx_signature: str, tx_data: Dict[str, Any]):
+        path = self._path(tx_signature)
+        payload = zlib.compress(json.dumps(tx_data, separators=(",", ":")).encode(), TX_STORE_COMPRESSION_LEVEL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._ensure_loaded()
+            self._total_bytes += len(payload) - self._sizes.pop(path, 0)
+            self._sizes[path] = len(payload)
+            self.writes += 1
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+                old_path, size = self._sizes.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(old_path)
+            self.evictions += len(evicted)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    async def get(self, tx_signature: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._read, tx_signature)
+
+    def put_background(self, tx_signature: str, tx_data: Dict[str, Any]):
+        # Fire-and-forget so the response never waits on the disk write
+        task = asyncio.ensure_future(asyncio.to_thread(self._write, tx_signature, tx_data))
+        self._pending.add(task)
+
+        def done(finished: asyncio.Task):
+            self._pending.discard(finished)
+            if not finished.cancelled() and finished.exception():
+                logger.warning(f"Failed to store transaction {tx_signature}: {finished.exception()}")
+
+        task.add_done_callback(done)
+
+    async def flush(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._sizes),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+tx_store = TransactionStore(TX_STORE_DIR, TX_STORE_MAX_BYTES)
@@ -0,0 +1,212 @@
+# Write-behind batching of accounts, tokens and prices_daily rows discovered by requests
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Tuple
+
+from db_utils import DatabasePool
+from metrics_utils import registry
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0"))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "1000"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "100000"))
+
+flush_rows = registry.histogram(
+    "write_behind_flush_rows", "Rows written per write-behind flush", ["table"],
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+)
+flush_lag_seconds = registry.histogram(
+    "write_behind_lag_seconds", "Age of the oldest buffered row when its flush completed", ["table"]
+)
+flush_seconds = registry.histogram(
+    "write_behind_flush_seconds", "Duration of write-behind flushes", ["table"]
+)
+
+class WriteBehindTable:
+    """Pending rows for one table, keyed by its conflict key (later rows win).
+
+    A flush COPYs the rows into a per-connection temp table and merges them
+    with a single INSERT ... SELECT ... ON CONFLICT statement.
+    """
+
+    def __init__(self, table: str, columns: list[Tuple[str, str]], key_size: int, merge_sql: str):
+        self.table = table
+        self.columns = columns
+        self.key_size = key_size
+        self.staging = f"write_behind_{table}"
+        self.merge_sql = merge_sql.format(staging=self.staging)
+        self._rows: Dict[tuple, tuple] = {}
+        self._oldest: float = None
+        self.added = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, rows: Iterable[tuple]):
+        for row in rows:
+            key = row[:self.key_size]
+            if key not in self._rows and len(self._rows) >= WRITE_BEHIND_MAX_PENDING:
+                self.dropped += 1
+                continue
+            self._rows[key] = row
+            self.added += 1
+        if self._rows and self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def pending(self, key: tuple) -> tuple | None:
+        # Rows not yet flushed, so readers can see their own writes
+        return self._rows.get(key)
+
+    def _requeue(self, rows: Dict[tuple, tuple], oldest: float):
+        # Put a failed batch back unless newer rows for the same keys arrived meanwhile
+        for key, row in rows.items():
+            self._rows.setdefault(key, row)
+        self._oldest = oldest if self._oldest is None else min(oldest, self._oldest)
+
+    async def flush(self, db_pool: DatabasePool):
+        if not self._rows:
+            return
+        rows, oldest = self._rows, self._oldest
+        self._rows, self._oldest = {}, None
+        started = time.monotonic()
+        try:
+            async with db_pool.acquire() as db:
+                async with db.transaction():
+                    columns = ", ".join(f"{name} {type_}" for name, type_ in self.columns)
+                    await db.execute(
+                        f"CREATE TEMP TABLE IF NOT EXISTS {self.staging} ({columns}) ON COMMIT DELETE ROWS"
+                    )
+                    await db.copy_records_to_table(
+                        self.staging, records=list(rows.values()), columns=[name for name, _ in self.columns]
+                    )
+                    await db.execute(self.merge_sql)
+        except asyncio.CancelledError:
+            self._requeue(rows, oldest)
+            raise
+        except Exception as e:
+            self.failures += 1
+            self._requeue(rows, oldest)
+            logger.error(f"Write-behind flush of {len(rows)} {self.table} rows failed: {str(e)}")
+            return
+        finished = time.monotonic()
+        self.flushes += 1
+        self.flushed += len(rows)
+        self.last_lag = finished - oldest
+        flush_rows.observe(len(rows), table=self.table)
+        flush_lag_seconds.observe(self.last_lag, table=self.table)
+        flush_seconds.observe(finished - started, table=self.table)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._rows),
+            "added": self.added,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_lag_seconds": self.last_lag,
+        }
+
+class WriteBehind:
+    """Flushes every table on WRITE_BEHIND_INTERVAL, early once one holds WRITE_BEHIND_MAX_ROWS, and on stop().
+
+    Rows added before start() (or without the app running) stay buffered
+    until a flush; callers keep their in-memory caches up to date themselves.
+    """
+
+    def __init__(self, *tables: WriteBehindTable):
+        self.tables = tables
+        self._db_pool: DatabasePool = None
+        self._task: asyncio.Task = None
+        self._wakeup: asyncio.Event = None
+
+    def add(self, table: WriteBehindTable, rows: Iterable[tuple]):
+        table.add(rows)
+        if self._wakeup and len(table) >= WRITE_BEHIND_MAX_ROWS:
+            self._wakeup.set()
+
+    async def flush(self):
+        for table in self.tables:
+            await table.flush(self._db_pool)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), WRITE_BEHIND_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {str(e)}", exc_info=True)
+
+    def start(self, db_pool: DatabasePool):
+        self._db_pool = db_pool
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Final flush so nothing buffered is lost on shutdown
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._db_pool:
+            await self.flush()
+        self._wakeup = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {table.table: table.stats() for table in self.tables}
+
+account_writes = WriteBehindTable(
+    "accounts",
+    [("pubkey", "TEXT"), ("label", "TEXT"), ("tags", "TEXT"), ("type", "TEXT"), ("img_url", "TEXT")],
+    key_size=1,
+    merge_sql="""
+    INSERT INTO accounts (pubkey, label, tags, type, img_url, refreshed_at)
+    SELECT pubkey, label, tags, type, img_url, now() FROM {staging}
+    ON CONFLICT (pubkey) DO UPDATE SET
+        label = EXCLUDED.label,
+        tags = EXCLUDED.tags,
+        type = EXCLUDED.type,
+        img_url = EXCLUDED.img_url,
+        refreshed_at = EXCLUDED.refreshed_at
+    """
+)
+
+token_writes = WriteBehindTable(
+    "tokens",
+    [("mint", "TEXT"), ("ticker", "TEXT"), ("decimals", "INTEGER"), ("img_url", "TEXT")],
+    key_size=1,
+    merge_sql="""
+    INSERT INTO tokens (mint, ticker, decimals, img_url)
+    SELECT mint, ticker, decimals, img_url FROM {staging}
+    ON CONFLICT (mint) DO NOTHING
+    """
+)
+
+# Only real prices are buffered; the merge fills in NULLs stored by older versions
+price_writes = WriteBehindTable(
+    "prices_daily",
+    [("mint", "TEXT"), ("day", "TEXT"), ("price", "DOUBLE PRECISION")],
+    key_size=2,
+    merge_sql="""
+    INSERT INTO prices_daily (mint, day, price)
+    SELECT mint, day, price FROM {staging}
+    ON CONFLICT (mint, day) DO UPDATE SET price = EXCLUDED.price
+    WHERE prices_daily.price IS NULL
+    """
+)
+
+write_behind = WriteBehind(account_writes, token_writes, price_writes)